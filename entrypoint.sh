@@ -5,5 +5,24 @@ echo "Applying migrations..."
 cd /app/moneyTransfer
 python manage.py migrate
 
+# статика с хешами в именах и сжатыми копиями - в томе, который раздает nginx
+echo "Collecting static files..."
+python manage.py collectstatic --noinput
+python manage.py compress_static
+
+if [ "$TRANSFERS_PARTITIONING" = "True" ] || [ "$TRANSFERS_PARTITIONING" = "true" ]; then
+    echo "Creating transfer partitions..."
+    python manage.py manage_partitions
+fi
+
+if [ "$SERVER_MODE" = "production" ]; then
+    if [ "$SERVER_INTERFACE" = "asgi" ]; then
+        echo "Starting gunicorn (ASGI)..."
+        exec gunicorn moneyTransfer.asgi:application --config gunicorn.conf.py
+    fi
+    echo "Starting gunicorn..."
+    exec gunicorn moneyTransfer.wsgi:application --config gunicorn.conf.py
+fi
+
 echo "Starting server..."
 exec python manage.py runserver 0.0.0.0:8000
\ No newline at end of file
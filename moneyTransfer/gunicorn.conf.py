@@ -0,0 +1,59 @@
+"""
+Настройки gunicorn для SERVER_MODE=production.
+
+Таймауты согласованы с nginx.conf: nginx закрывает простаивающие
+keepalive-соединения раньше воркера, а запросы, которые идут дольше
+proxy_read_timeout, обрывает сам.
+"""
+import multiprocessing
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+
+# потоки держат keepalive-соединения от nginx и пережидают запросы к базе;
+# у каждого потока свое постоянное соединение с Postgres
+# под ASGI (SERVER_INTERFACE=asgi) - воркер uvicorn с циклом событий
+threads = int(os.getenv('WEB_THREADS', 4))
+if os.getenv('SERVER_INTERFACE', 'wsgi') == 'asgi':
+    worker_class = 'uvicorn_worker.UvicornWorker'
+    # постоянные соединения пула main.parallel (ASYNC_DB_THREADS, как в settings.py)
+    # и соединения запросов: они закрываются после запроса, и на них
+    # закладывается WEB_THREADS одновременных запросов
+    connections_per_worker = int(os.getenv('ASYNC_DB_THREADS', 4)) + threads
+else:
+    worker_class = os.getenv('GUNICORN_WORKER_CLASS', 'gthread')
+    connections_per_worker = threads
+
+# Соединения с Postgres всех воркеров не должны превышать бюджет контейнера:
+# по умолчанию 90 из стандартных max_connections = 100, остальное - миграциям,
+# manage.py и резерву суперпользователя
+db_connections = int(os.getenv('DB_CONNECTIONS', 90))
+
+# воркеры по числу ядер: (2 x CPU) + 1, но не больше, чем позволяет бюджет
+workers = int(os.getenv(
+    'WEB_WORKERS',
+    max(min(multiprocessing.cpu_count() * 2 + 1, db_connections // connections_per_worker), 1),
+))
+if workers * connections_per_worker > db_connections:
+    raise SystemExit(
+        f"{workers} воркеров x {connections_per_worker} соединений = "
+        f"{workers * connections_per_worker} соединений с Postgres, "
+        f"больше DB_CONNECTIONS={db_connections}: уменьшите WEB_WORKERS или WEB_THREADS"
+    )
+
+# keepalive дольше, чем keepalive_timeout upstream в nginx (60s)
+keepalive = 75
+# gthread отмечается в основном цикле, поэтому timeout ловит только зависший
+# воркер; длинный импорт в потоке его не вызывает
+timeout = 120
+graceful_timeout = 30
+
+# перезапуск воркеров ограничивает рост памяти; jitter - чтобы не все сразу
+max_requests = int(os.getenv('GUNICORN_MAX_REQUESTS', 5000))
+max_requests_jitter = 500
+
+# X-Forwarded-* приходят от nginx из той же сети docker
+forwarded_allow_ips = '*'
+
+accesslog = os.getenv('GUNICORN_ACCESS_LOG', '-') or None
+errorlog = '-'
@@ -1,7 +1,162 @@
-from django.contrib import admin
+import time
+from datetime import date
+
+from django.conf import settings
+from django.contrib import admin, messages
 from django import forms
+from django.contrib.auth.models import User
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from .models import Status, OperationType, Category, Subcategory, MoneyTransfer
+from django.db.models import Count, IntegerField, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from .caching import get_references
+from .filtering import day_start
+from .forms import AmountField
+from . import reassign
+from .models import (
+    ArchivedTransfer, ExchangeRate, Status, OperationType, Category, Subcategory, MoneyTransfer, ReassignJob,
+    TransferDailyRollup,
+)
+from .money import format_money
+from .pagination import EstimatedCountPaginator
+
+
+def filter_user(request):
+    """Пользователь из фильтра ?user= (имя или id), None - если не выбран или не найден"""
+    if not hasattr(request, '_admin_filter_user'):
+        value = request.GET.get(UserFilter.parameter_name, '').strip()
+        user = None
+        if value:
+            users = User.objects.filter(username=value)
+            if value.isdigit():
+                users = User.objects.filter(pk=int(value)) | users
+            user = users.order_by('pk').first()
+        request._admin_filter_user = user
+    return request._admin_filter_user
+
+
+class InputFilter(admin.SimpleListFilter):
+    """Фильтр с полем ввода вместо списка всех значений"""
+    template = 'admin/input_filter.html'
+    # параметры, которые теряют смысл при смене значения
+    resets = ()
+
+    def lookups(self, request, model_admin):
+        # непустой список, иначе фильтр не выводится
+        return [('', '')]
+
+    def choices(self, changelist):
+        yield {
+            'value': self.value() or '',
+            'hidden': [
+                (key, value)
+                for key, values in changelist.filter_params.items()
+                if key != self.parameter_name and key not in self.resets
+                for value in values
+            ],
+        }
+
+
+class UserFilter(InputFilter):
+    title = 'пользователю'
+    parameter_name = 'user'
+    resets = ('status', 'type', 'category', 'subcategory')
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        user = filter_user(request)
+        return queryset.filter(user=user) if user else queryset.none()
+
+
+class UserReferenceFilter(admin.SimpleListFilter):
+    """
+    Фильтр по справочнику пользователя. Значения показываются только после
+    выбора пользователя: список справочников всех пользователей слишком велик
+    """
+    references = None
+
+    def lookups(self, request, model_admin):
+        user = filter_user(request)
+        if user is None:
+            return None
+        return [(obj.pk, obj.name) for obj in self.get_objects(request, get_references(user))]
+
+    def get_objects(self, request, references):
+        return getattr(references, self.references)
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value:
+            return queryset
+        if not value.isdigit():
+            return queryset.none()
+        return queryset.filter(**{f'{self.parameter_name}_id': int(value)})
+
+
+class StatusFilter(UserReferenceFilter):
+    title = 'статусу'
+    parameter_name = 'status'
+    references = 'statuses'
+
+
+class TypeFilter(UserReferenceFilter):
+    title = 'типу'
+    parameter_name = 'type'
+    references = 'types'
+
+
+class CategoryFilter(UserReferenceFilter):
+    title = 'категории'
+    parameter_name = 'category'
+    references = 'categories'
+
+
+class SubcategoryFilter(UserReferenceFilter):
+    title = 'подкатегории'
+    parameter_name = 'subcategory'
+    references = 'subcategories'
+
+    def get_objects(self, request, references):
+        category = request.GET.get(CategoryFilter.parameter_name, '')
+        if category.isdigit():
+            return [obj for obj in references.subcategories if obj.category_id == int(category)]
+        return references.subcategories
+
+
+class YearFilter(admin.SimpleListFilter):
+    """
+    Замена date_hierarchy: тот строит список лет через SELECT DISTINCT по всей
+    таблице переводов. Годы берутся из агрегатов и кешируются
+    """
+    title = 'году'
+    parameter_name = 'year'
+    cache_timeout = 3600
+
+    def lookups(self, request, model_admin):
+        user = filter_user(request)
+        key = f'admin:years:{user.pk if user else "all"}'
+        years = cache.get(key)
+        if years is None:
+            rollups = TransferDailyRollup.objects.all()
+            if user:
+                rollups = rollups.filter(user=user)
+            years = [day.year for day in rollups.dates('day', 'year', order='DESC')]
+            cache.set(key, years, self.cache_timeout)
+        return [(str(year), str(year)) for year in years]
+
+    def queryset(self, request, queryset):
+        value = self.value()
+        if not value or not value.isdigit():
+            return queryset
+        year = int(value)
+        tz = timezone.get_current_timezone()
+        # диапазон по самому столбцу, чтобы работал BRIN-индекс по date_add
+        return queryset.filter(
+            date_add__gte=day_start(date(year, 1, 1), tz),
+            date_add__lt=day_start(date(year + 1, 1, 1), tz),
+        )
 
 
 class SubcategoryInline(admin.TabularInline):
@@ -16,59 +171,57 @@ class SubcategoryInline(admin.TabularInline):
 @admin.register(Status)
 class StatusAdmin(admin.ModelAdmin):
     """Админка для статусов"""
-    list_display = ['id', 'name', 'moneytransfers_count']
+    list_display = ['id', 'name', 'transfer_count']
     list_display_links = ['id', 'name']
     search_fields = ['name']
     ordering = ['name']
-    
-    def moneytransfers_count(self, obj):
-        return obj.moneytransfer_set.count()
-    moneytransfers_count.short_description = 'Кол-во переводов'
 
 
 @admin.register(OperationType)
 class OperationTypeAdmin(admin.ModelAdmin):
     """Админка для типов операций"""
-    list_display = ['id', 'name', 'moneytransfers_count']
+    list_display = ['id', 'name', 'transfer_count']
     list_display_links = ['id', 'name']
     search_fields = ['name']
     ordering = ['name']
-    
-    def moneytransfers_count(self, obj):
-        return obj.moneytransfer_set.count()
-    moneytransfers_count.short_description = 'Кол-во переводов'
 
 
 @admin.register(Category)
 class CategoryAdmin(admin.ModelAdmin):
     """Админка для категорий"""
-    list_display = ['id', 'name', 'subcategories_count', 'moneytransfers_count']
+    list_display = ['id', 'name', 'subcategories_count', 'transfer_count']
     list_display_links = ['id', 'name']
     search_fields = ['name']
     ordering = ['name']
     inlines = [SubcategoryInline]
     
+    def get_queryset(self, request):
+        # подкатегории - подзапросом: Count через JOIN перемножился бы с переводами
+        subcategories = (
+            Subcategory.objects.filter(category=OuterRef('pk'))
+            .order_by().values('category').annotate(total=Count('pk')).values('total')
+        )
+        return super().get_queryset(request).annotate(
+            subcategories_total=Coalesce(Subquery(subcategories, output_field=IntegerField()), 0),
+        )
+    
     def subcategories_count(self, obj):
-        return obj.subcategories.count()
+        return obj.subcategories_total
     subcategories_count.short_description = 'Подкатегорий'
-    
-    def moneytransfers_count(self, obj):
-        return MoneyTransfer.objects.filter(category=obj).count()
-    moneytransfers_count.short_description = 'Переводов'
+    subcategories_count.admin_order_field = 'subcategories_total'
 
 
 @admin.register(Subcategory)
 class SubcategoryAdmin(admin.ModelAdmin):
     """Админка для подкатегорий"""
-    list_display = ['id', 'name', 'category', 'moneytransfers_count']
+    list_display = ['id', 'name', 'category', 'transfer_count']
     list_display_links = ['id', 'name']
-    list_filter = ['category']
+    list_select_related = ['category']
+    autocomplete_fields = ['category']
+    # категории всех пользователей в одном списке не помещаются: сначала выбирается пользователь
+    list_filter = [UserFilter, CategoryFilter]
     search_fields = ['name', 'category__name']
     ordering = ['category__name', 'name']
-    
-    def moneytransfers_count(self, obj):
-        return obj.moneytransfer_set.count()
-    moneytransfers_count.short_description = 'Переводов'
 
 
 class MoneyTransferForm(forms.ModelForm):
@@ -76,6 +229,7 @@ class MoneyTransferForm(forms.ModelForm):
     class Meta:
         model = MoneyTransfer
         fields = '__all__'
+        field_classes = {'summ': AmountField}
     
     def clean(self):
         cleaned_data = super().clean()
@@ -109,26 +263,42 @@ class MoneyTransferAdmin(admin.ModelAdmin):
     ]
     
     list_display_links = ['id', 'date_add_display']
+    list_select_related = ['status', 'type', 'category', 'subcategory']
+    # выпадающие списки справочников всех пользователей слишком велики
+    autocomplete_fields = ['status', 'type', 'category', 'subcategory']
     
+    # Фильтры не перебирают таблицу переводов: справочники берутся у выбранного
+    # пользователя, годы - из агрегатов, а вместо date_hierarchy (SELECT DISTINCT
+    # по всем датам) - фильтр по году
     list_filter = [
-        'status',
-        'type',
-        'category',
-        'subcategory',
-        'date_add'
+        UserFilter,
+        StatusFilter,
+        TypeFilter,
+        CategoryFilter,
+        SubcategoryFilter,
+        'date_add',
+        YearFilter,
     ]
     
-    search_fields = [
-        'comment',
-        'category__name',
-        'subcategory__name',
-        'status__name',
-        'type__name'
-    ]
+    # только комментарий: ILIKE по нему обслуживает триграммный индекс,
+    # а OR по названиям из четырех таблиц каждый раз перебирал все переводы
+    search_fields = ['comment']
     
-    date_hierarchy = 'date_add'
-    ordering = ['-date_add']
     list_per_page = 25
+    # COUNT(*) по всей таблице на каждой странице; количество с фильтрами
+    # оценивает paginator
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+    
+    def get_queryset(self, request):
+        return super().get_queryset(request).defer('search_vector')
+    
+    def get_ordering(self, request):
+        # с пользователем - по дате, по индексу (user, -date_add, -id);
+        # по всей таблице индекса по дате нет, и порядок добавления берется по id
+        if filter_user(request):
+            return ['-date_add']
+        return ['-id']
     
     fieldsets = (
         ('Основная информация', {
@@ -136,7 +306,8 @@ class MoneyTransferAdmin(admin.ModelAdmin):
                 'date_add',
                 'type',
                 'status', 
-                'summ'
+                'summ',
+                'currency',
             )
         }),
         ('Категории', {
@@ -168,7 +339,7 @@ class MoneyTransferAdmin(admin.ModelAdmin):
     subcategory_display.admin_order_field = 'subcategory__name'
     
     def summ_display(self, obj):
-        return f"{obj.summ} руб."
+        return format_money(obj.summ, obj.currency)
     summ_display.short_description = 'Сумма'
     summ_display.admin_order_field = 'summ'
     
@@ -181,21 +352,122 @@ class MoneyTransferAdmin(admin.ModelAdmin):
     # Действия для админки
     actions = ['mark_as_business', 'mark_as_personal']
     
+    def reassign(self, request, queryset, field, target_name):
+        """Переназначение пачками; статус с таким названием ищется у каждого пользователя"""
+        try:
+            selection = reassign.selection_ids(queryset, settings.REASSIGN_MAX_IDS)
+            job = reassign.create_job(selection, field, target_name, created_by=request.user)
+        except reassign.ReassignError as e:
+            self.message_user(request, str(e), messages.ERROR)
+            return
+        job = reassign.run(job, time_limit=settings.REASSIGN_TIME_LIMIT)
+        report_job(self, request, job)
+    
     def mark_as_business(self, request, queryset):
         """Пометить выбранные переводы как бизнес"""
-        business_status = Status.objects.get(name='Бизнес')
-        updated = queryset.update(status=business_status)
-        self.message_user(request, f'{updated} переводов помечены как "Бизнес"')
+        self.reassign(request, queryset, 'status', 'Бизнес')
     mark_as_business.short_description = 'Пометить как "Бизнес"'
     
     def mark_as_personal(self, request, queryset):
         """Пометить выбранные переводы как личные"""
-        personal_status = Status.objects.get(name='Личное')
-        updated = queryset.update(status=personal_status)
-        self.message_user(request, f'{updated} переводов помечены как "Личное"')
+        self.reassign(request, queryset, 'status', 'Личное')
     mark_as_personal.short_description = 'Пометить как "Личное"'
 
 
+def report_job(model_admin, request, job):
+    message = (
+        f'Задание #{job.pk} "{job.get_field_display()} -> {job.target_name}": '
+        f'обработано {job.processed} из {job.total}, изменено {job.updated}'
+    )
+    if job.skipped:
+        message += f', пропущено {job.skipped} (у владельца нет такого значения)'
+    if job.state == ReassignJob.STATE_DONE:
+        model_admin.message_user(request, message)
+    else:
+        model_admin.message_user(
+            request,
+            f'{message}. Продолжить можно в разделе "Массовые переназначения" '
+            f'или командой manage.py reassign_transfers --resume {job.pk}',
+            messages.WARNING,
+        )
+
+
+@admin.register(ReassignJob)
+class ReassignJobAdmin(admin.ModelAdmin):
+    """Задания массового переназначения: ход выполнения и продолжение"""
+    list_display = [
+        'id', 'field', 'target_name', 'subcategory_name', 'state', 'progress',
+        'updated', 'skipped', 'created_by', 'created_at', 'finished_at',
+    ]
+    list_filter = ['state', 'field']
+    list_select_related = ['created_by']
+    ordering = ['-id']
+    exclude = ['selection']
+    readonly_fields = [
+        'field', 'target_name', 'subcategory_name', 'state', 'last_id', 'total',
+        'processed', 'updated', 'skipped', 'created_by', 'created_at', 'finished_at',
+    ]
+    actions = ['resume_jobs']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def progress(self, obj):
+        if not obj.total:
+            return '-'
+        return f'{min(obj.processed * 100 // obj.total, 100)}%'
+    progress.short_description = 'Выполнено'
+    
+    def resume_jobs(self, request, queryset):
+        """Продолжить незавершенные задания в пределах REASSIGN_TIME_LIMIT"""
+        deadline = time.monotonic() + settings.REASSIGN_TIME_LIMIT
+        for job in queryset.exclude(state=ReassignJob.STATE_DONE).order_by('pk'):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            report_job(self, request, reassign.run(job, time_limit=remaining))
+    resume_jobs.short_description = 'Продолжить выполнение'
+
+
+@admin.register(ArchivedTransfer)
+class ArchivedTransferAdmin(admin.ModelAdmin):
+    """Архив переводов: только просмотр, строки переносит команда archive_transfers"""
+    list_display = ['id', 'user', 'date_add', 'status', 'type', 'category', 'subcategory', 'summ_display']
+    list_select_related = ['user', 'status', 'type', 'category', 'subcategory']
+    list_filter = [UserFilter, YearFilter]
+    list_per_page = 25
+    show_full_result_count = False
+    paginator = EstimatedCountPaginator
+
+    def get_ordering(self, request):
+        # индекс архива - (user, -date_add, -id)
+        return ['-date_add'] if filter_user(request) else ['-id']
+
+    def has_add_permission(self, request):
+        return False
+
+    def has_change_permission(self, request, obj=None):
+        return False
+
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+    def summ_display(self, obj):
+        return format_money(obj.summ, obj.currency)
+    summ_display.short_description = 'Сумма'
+    summ_display.admin_order_field = 'summ'
+
+
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    """Курсы валют к рублю: изменения сразу сбрасывают итоги и отчеты в рублях"""
+    list_display = ['currency', 'date', 'rate']
+    list_filter = ['currency']
+    date_hierarchy = 'date'
+    ordering = ['currency', '-date']
+    list_per_page = 50
+
+
 # Настройка заголовков админки
 admin.site.site_header = "💰 Управление денежными переводами"
 admin.site.site_title = "Money Transfer Admin"
@@ -0,0 +1,192 @@
+"""
+REST API переводов и справочников.
+
+Все наборы данных ограничены текущим пользователем. Список переводов
+строится из values() без вызова сериализатора на каждую строку, а
+списки справочников берутся из кеша справочников.
+"""
+from django.db.models import F, ProtectedError
+from rest_framework import permissions, serializers as drf_serializers, viewsets
+from rest_framework.decorators import action
+from rest_framework.pagination import CursorPagination
+from rest_framework.response import Response
+
+from . import lookups, reports
+from .batch import MAX_OPERATIONS, TransferBatch
+from .caching import ARCHIVE, RATES, REFERENCES, TRANSFERS, get_references
+from .conditional import conditional_list
+from .filtering import filters_from_query, parse_id
+from .filters import MoneyTransferFilter
+from .merge import MergeError, merge as merge_references
+from .models import Category, MoneyTransfer, OperationType, Status, Subcategory
+from .serializers import (
+    CategorySerializer, MoneyTransferSerializer, OperationTypeSerializer,
+    StatusSerializer, SubcategorySerializer, TRANSFER_LIST_FIELDS, transfer_list_rows,
+)
+
+
+class TransferCursorPagination(CursorPagination):
+    # порядок совпадает с индексом mt_user_date_idx
+    ordering = ('-date_add', '-id')
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 500
+
+
+class UserScopedViewSet(viewsets.ModelViewSet):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get_queryset(self):
+        return self.queryset.filter(user=self.request.user)
+
+    def perform_create(self, serializer):
+        serializer.save(user=self.request.user)
+
+    def perform_destroy(self, instance):
+        try:
+            instance.delete()
+        except ProtectedError:
+            raise drf_serializers.ValidationError(
+                "Объект используется в переводах и не может быть удален: объедините его с другим (merge)"
+            )
+
+
+class MoneyTransferViewSet(UserScopedViewSet):
+    queryset = MoneyTransfer.objects.select_related('category', 'subcategory')
+    serializer_class = MoneyTransferSerializer
+    filterset_class = MoneyTransferFilter
+    pagination_class = TransferCursorPagination
+
+    def filter_queryset(self, queryset):
+        # сборка FilterSet с формой стоит дороже самого запроса - без фильтров она не нужна
+        if MoneyTransferFilter.base_filters.keys() & self.request.query_params.keys():
+            return super().filter_queryset(queryset)
+        return queryset
+
+    @conditional_list(TRANSFERS, REFERENCES, ARCHIVE)
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset.values(*TRANSFER_LIST_FIELDS.values()))
+        return self.get_paginated_response(transfer_list_rows(page))
+
+    @action(detail=False, methods=['post'])
+    def batch(self, request):
+        """
+        Пакет операций: {"operations": [{"op": "create", "data": {...}},
+        {"op": "update", "id": 1, "data": {...}}, {"op": "delete", "id": 2}]}
+        """
+        operations = request.data.get('operations') if isinstance(request.data, dict) else None
+        if not isinstance(operations, list):
+            raise drf_serializers.ValidationError({'operations': ["Ожидается список операций"]})
+        if len(operations) > MAX_OPERATIONS:
+            raise drf_serializers.ValidationError(
+                {'operations': [f"Не больше {MAX_OPERATIONS} операций в одном запросе"]}
+            )
+        return Response({'results': TransferBatch(request.user).run(operations)})
+
+
+class ReferenceViewSet(UserScopedViewSet):
+    """Справочник: список из кеша справочников, без пагинации"""
+    pagination_class = None
+    filter_backends = []
+    reference = None
+    # поля строк lookup
+    lookup_values = ('id', 'name')
+    lookup_annotations = {}
+
+    @conditional_list(REFERENCES)
+    def list(self, request, *args, **kwargs):
+        objects = getattr(get_references(request.user), self.reference)
+        return Response(self.get_serializer(objects, many=True).data)
+
+    def get_lookup_queryset(self):
+        return self.get_queryset()
+
+    @action(detail=False)
+    @conditional_list(REFERENCES)
+    def lookup(self, request):
+        """Варианты для выпадающего списка: ?q=начало или часть названия&limit=20"""
+        limit = request.query_params.get('limit', str(lookups.DEFAULT_LIMIT))
+        if not limit.isdigit() or not 1 <= int(limit) <= lookups.MAX_LIMIT:
+            raise drf_serializers.ValidationError({'limit': [f"Ожидается число от 1 до {lookups.MAX_LIMIT}"]})
+        rows, more = lookups.search(
+            self.get_lookup_queryset().values(*self.lookup_values, **self.lookup_annotations),
+            request.query_params.get('q', ''), int(limit),
+        )
+        return Response({'results': rows, 'more': more})
+
+    @action(detail=True, methods=['post'])
+    def merge(self, request, pk=None):
+        """{"target": id}: переводы переходят на target того же справочника, элемент удаляется"""
+        source = self.get_object()
+        target_id = parse_id(request.data.get('target')) if isinstance(request.data, dict) else None
+        target = self.get_queryset().filter(pk=target_id).first() if target_id is not None else None
+        if target is None:
+            raise drf_serializers.ValidationError({'target': ["Нет такого объекта в справочнике"]})
+        try:
+            moved = merge_references(source, target)
+        except MergeError as e:
+            raise drf_serializers.ValidationError({'detail': [str(e)]})
+        return Response({'target': target.pk, 'moved': moved})
+
+
+class StatusViewSet(ReferenceViewSet):
+    queryset = Status.objects.all()
+    serializer_class = StatusSerializer
+    reference = 'statuses'
+
+
+class OperationTypeViewSet(ReferenceViewSet):
+    queryset = OperationType.objects.all()
+    serializer_class = OperationTypeSerializer
+    reference = 'types'
+
+
+class CategoryViewSet(ReferenceViewSet):
+    queryset = Category.objects.all()
+    serializer_class = CategorySerializer
+    reference = 'categories'
+
+
+class SubcategoryViewSet(ReferenceViewSet):
+    queryset = Subcategory.objects.select_related('category')
+    serializer_class = SubcategorySerializer
+    reference = 'subcategories'
+    lookup_values = ('id', 'name', 'category')
+    lookup_annotations = {'category_name': F('category__name')}
+
+    def get_lookup_queryset(self):
+        # ?category=id - подкатегории одной категории
+        queryset = super().get_lookup_queryset()
+        category = self.request.query_params.get('category')
+        if category:
+            category_id = parse_id(category)
+            if category_id is None:
+                raise drf_serializers.ValidationError({'category': ["Ожидается id категории"]})
+            queryset = queryset.filter(category_id=category_id)
+        return queryset
+
+
+class ReportViewSet(viewsets.ViewSet):
+    """
+    Отчет по периодам: ?dimension=category&dimension=type&unit=month и
+    фильтры списка переводов. Несколько разрезов - в одном ответе; limit
+    оставляет в каждом столько строк, остальные сворачиваются в одну.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    @conditional_list(TRANSFERS, REFERENCES, ARCHIVE, RATES)
+    def list(self, request):
+        unit = request.query_params.get('unit', reports.DEFAULT_UNIT)
+        dimensions = request.query_params.getlist('dimension') or ['category']
+        limit = request.query_params.get('limit')
+        if limit is not None and (not limit.isdigit() or int(limit) < 1):
+            raise drf_serializers.ValidationError({'limit': ["Ожидается положительное число"]})
+        try:
+            breakdowns = reports.build(
+                request.user, filters_from_query(request.query_params), dimensions, unit,
+                limit=int(limit) if limit else None,
+            )
+        except reports.ReportError as e:
+            raise drf_serializers.ValidationError({'detail': [str(e)]})
+        return Response({'unit': unit, 'breakdowns': [breakdown.as_dict() for breakdown in breakdowns]})
@@ -4,4 +4,12 @@ from django.apps import AppConfig
 class MainConfig(AppConfig):
     verbose_name = "Движение денежных средств"
     default_auto_field = 'django.db.models.BigAutoField'
-    name = 'main'
\ No newline at end of file
+    name = 'main'
+
+    def ready(self):
+        from django.db.backends.signals import connection_created
+
+        from . import signals
+        from .metrics import install_query_wrapper
+
+        connection_created.connect(install_query_wrapper)
@@ -0,0 +1,89 @@
+"""
+Архив старых переводов.
+
+Команда archive_transfers переносит переводы старше
+TRANSFERS_ARCHIVE_AFTER_DAYS из MoneyTransfer в ArchivedTransfer: там один
+индекс и нет search_vector, а основная таблица и ее индексы остаются
+небольшими. Дневные агрегаты перенос не меняет, поэтому итоги и отчеты по
+TransferDailyRollup по-прежнему учитывают архивные строки.
+
+Списки, выгрузка и отчеты по самим переводам берут строки из представления
+TransferRecord (обе таблицы) только тогда, когда диапазон дат начинается не
+позже последнего архивного перевода пользователя; иначе - только MoneyTransfer.
+"""
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .caching import ARCHIVE, bump_version, get_version
+from .filtering import date_range, day_start
+from .models import ArchivedTransfer, MoneyTransfer, TransferRecord
+
+DEFAULT_BATCH_SIZE = 5000
+COLUMNS = ('id', 'user_id', 'date_add', 'status_id', 'type_id', 'category_id', 'subcategory_id', 'summ', 'currency', 'comment')
+
+
+def archive_end(user):
+    """Время последнего архивного перевода пользователя или None"""
+    key = f'{ARCHIVE}:{user.pk}:{get_version(ARCHIVE, user.pk)}'
+    cached = cache.get(key)
+    if cached is None:
+        # кортеж, чтобы закешировать и отсутствие архива
+        cached = (
+            ArchivedTransfer.objects.filter(user=user).order_by('-date_add')
+            .values_list('date_add', flat=True).first(),
+        )
+        cache.set(key, cached, timeout=None)
+    return cached[0]
+
+
+def needs_archive(user, filters):
+    end = archive_end(user)
+    if end is None:
+        return False
+    tz = timezone.get_current_timezone()
+    start, _ = date_range(filters.get('date_from'), filters.get('date_to'), filters.get('period'), tz)
+    return start is None or day_start(start, tz) <= end
+
+
+def transfers(user, filters):
+    """Переводы пользователя; архивные - только если их требует диапазон дат фильтров"""
+    model = TransferRecord if needs_archive(user, filters) else MoneyTransfer
+    return model.objects.filter(user=user)
+
+
+def archive_batch(before, user_ids=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Переносит в архив до batch_size переводов с date_add раньше before одной
+    транзакцией; возвращает количество перенесенных
+    """
+    table = MoneyTransfer._meta.db_table
+    columns = ', '.join(COLUMNS)
+    condition, params = "date_add < %s", [before]
+    if user_ids:
+        condition += " AND user_id = ANY(%s)"
+        params.append(list(user_ids))
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        # пачка блокируется при выборе id; переводы, которые сейчас меняют
+        # или удаляют другие транзакции, пропускаются до следующего запуска,
+        # и перенос не ждет их и не удерживает их блокировки
+        cursor.execute(
+            f"""
+            WITH moved AS (
+                DELETE FROM {table}
+                WHERE id IN (
+                    SELECT id FROM {table} WHERE {condition} LIMIT %s FOR UPDATE SKIP LOCKED
+                )
+                RETURNING {columns}
+            )
+            INSERT INTO {ArchivedTransfer._meta.db_table} ({columns})
+            SELECT {columns} FROM moved
+            RETURNING user_id
+            """,
+            [*params, batch_size],
+        )
+        users = [row[0] for row in cursor.fetchall()]
+        for user_id in set(users):
+            bump_version(ARCHIVE, user_id)
+    return len(users)
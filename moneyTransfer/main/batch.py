@@ -0,0 +1,187 @@
+"""
+Пакетное создание, изменение и удаление переводов.
+
+Все операции проверяются за один проход по справочникам пользователя из
+кеша, без запросов на каждое поле. Корректные операции применяются в одной
+транзакции через bulk_create, bulk_update и один DELETE; для каждой операции
+возвращается свой результат. summ - целое в минимальных единицах currency
+(по умолчанию рубли), как в MoneyTransferSerializer.
+"""
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .caching import get_references
+from .models import MoneyTransfer
+from .money import CURRENCIES, SUMM_MAX, SUMM_MIN
+
+MAX_OPERATIONS = 1000
+REFERENCE_FIELDS = ('category', 'subcategory', 'status', 'type')
+FIELDS = REFERENCE_FIELDS + ('summ', 'currency', 'comment')
+REQUIRED_FIELDS = REFERENCE_FIELDS + ('summ',)
+
+
+class OperationError(Exception):
+    def __init__(self, errors):
+        super().__init__(errors)
+        self.errors = errors
+
+
+def _int(value):
+    if isinstance(value, bool):
+        raise ValueError
+    if isinstance(value, str):
+        value = value.strip()
+    if isinstance(value, float) and not value.is_integer():
+        raise ValueError
+    return int(value)
+
+
+class TransferBatch:
+    def __init__(self, user):
+        self.user = user
+        references = get_references(user)
+        self.references = {
+            'category': {obj.pk for obj in references.categories},
+            'status': {obj.pk for obj in references.statuses},
+            'type': {obj.pk for obj in references.types},
+        }
+        # подкатегория -> категория
+        self.subcategories = {obj.pk: obj.category_id for obj in references.subcategories}
+
+    def run(self, operations):
+        results = [None] * len(operations)
+        parsed = []
+        seen = set()
+        for index, operation in enumerate(operations):
+            try:
+                op, pk, data = self.parse(operation)
+                if pk is not None:
+                    if pk in seen:
+                        raise OperationError({'id': ["Перевод уже изменяется в этом пакете"]})
+                    seen.add(pk)
+                parsed.append((index, op, pk, data))
+            except OperationError as e:
+                results[index] = self.result(index, operation, errors=e.errors)
+
+        with transaction.atomic():
+            # строки блокируются в порядке id, как и в rollups.apply
+            existing = {
+                obj.pk: obj for obj in MoneyTransfer.objects
+                .filter(user=self.user, pk__in=seen)
+                .order_by('pk')
+                .select_for_update()
+            }
+            created, updated, update_fields, deleted = [], [], set(), []
+            for index, op, pk, data in parsed:
+                try:
+                    if op == 'create':
+                        obj = self.build(MoneyTransfer(user=self.user), data)
+                        created.append((index, obj))
+                        continue
+                    obj = existing.get(pk)
+                    if obj is None:
+                        raise OperationError({'id': ["Перевод не найден"]})
+                    if op == 'update':
+                        updated.append((index, self.build(obj, data)))
+                        update_fields.update(data)
+                    else:
+                        deleted.append((index, obj))
+                except OperationError as e:
+                    results[index] = self.result(index, operations[index], errors=e.errors)
+
+            MoneyTransfer.objects.bulk_create([obj for _, obj in created])
+            if updated:
+                MoneyTransfer.objects.bulk_update(
+                    [obj for _, obj in updated], [field_name(name) for name in sorted(update_fields)]
+                )
+            if deleted:
+                MoneyTransfer.objects.filter(pk__in=[obj.pk for _, obj in deleted]).delete()
+
+        for status, items in (('created', created), ('updated', updated), ('deleted', deleted)):
+            for index, obj in items:
+                results[index] = {'index': index, 'status': status, 'id': obj.pk}
+        return results
+
+    def result(self, index, operation, errors):
+        pk = operation.get('id') if isinstance(operation, dict) else None
+        return {'index': index, 'status': 'error', 'id': pk, 'errors': errors}
+
+    def parse(self, operation):
+        if not isinstance(operation, dict):
+            raise OperationError({'non_field_errors': ["Операция должна быть объектом"]})
+        op = operation.get('op')
+        if op not in ('create', 'update', 'delete'):
+            raise OperationError({'op': ["Ожидается create, update или delete"]})
+
+        pk = None
+        if op != 'create':
+            try:
+                pk = _int(operation.get('id'))
+            except (TypeError, ValueError):
+                raise OperationError({'id': ["Не указан id перевода"]})
+        if op == 'delete':
+            return op, pk, {}
+
+        data = operation.get('data')
+        if not isinstance(data, dict):
+            raise OperationError({'data': ["Ожидается объект с полями перевода"]})
+        errors = {}
+        cleaned = {}
+        for name, value in data.items():
+            if name == 'date_add' and op == 'create':
+                parsed = parse_datetime(value) if isinstance(value, str) else None
+                if parsed is None:
+                    errors[name] = ["Некорректная дата"]
+                    continue
+                cleaned[name] = timezone.make_aware(parsed) if timezone.is_naive(parsed) else parsed
+            elif name in REFERENCE_FIELDS or name == 'summ':
+                try:
+                    cleaned[name] = _int(value)
+                except (TypeError, ValueError):
+                    errors[name] = ["Ожидается целое число"]
+            elif name == 'currency':
+                if value not in CURRENCIES:
+                    errors[name] = [f"Ожидается одна из валют: {', '.join(CURRENCIES)}"]
+                else:
+                    cleaned[name] = value
+            elif name == 'comment':
+                if not isinstance(value, str) or len(value) > 255:
+                    errors[name] = ["Ожидается строка не длиннее 255 символов"]
+                else:
+                    cleaned[name] = value
+            else:
+                errors[name] = ["Неизвестное поле"]
+        if op == 'create':
+            for name in REQUIRED_FIELDS:
+                if name not in data:
+                    errors.setdefault(name, ["Обязательное поле"])
+        elif not cleaned and not errors:
+            errors['data'] = ["Нет полей для изменения"]
+        if errors:
+            raise OperationError(errors)
+        return op, pk, cleaned
+
+    def build(self, obj, data):
+        """Переносит данные в объект и проверяет его по справочникам"""
+        for name, value in data.items():
+            setattr(obj, field_name(name), value)
+
+        errors = {}
+        for name, ids in self.references.items():
+            if getattr(obj, f'{name}_id') not in ids:
+                errors[name] = ["Нет такого объекта в справочнике"]
+        category_id = self.subcategories.get(obj.subcategory_id)
+        if category_id is None:
+            errors['subcategory'] = ["Нет такого объекта в справочнике"]
+        elif category_id != obj.category_id and 'category' not in errors:
+            errors['subcategory'] = ["Подкатегория не принадлежит выбранной категории"]
+        if not SUMM_MIN <= obj.summ <= SUMM_MAX:
+            errors['summ'] = ["Сумма вне допустимого диапазона"]
+        if errors:
+            raise OperationError(errors)
+        return obj
+
+
+def field_name(name):
+    return f'{name}_id' if name in REFERENCE_FIELDS else name
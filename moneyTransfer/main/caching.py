@@ -0,0 +1,86 @@
+"""
+Версионированный кеш данных пользователя.
+
+Для каждого пользователя и пространства имен хранится номер версии. Ключи
+данных включают версию, поэтому инвалидация - это увеличение версии, а
+устаревшие записи просто вытесняются из кеша.
+"""
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+REFERENCES = 'references'
+# переводы и агрегаты: версию увеличивает rollups.apply
+TRANSFERS = 'transfers'
+# граница архива пользователя: версию увеличивает archive.archive_batch
+ARCHIVE = 'archive'
+# курсы валют: общие для всех пользователей, версию увеличивают сигналы ExchangeRate
+RATES = 'rates'
+SHARED_NAMESPACES = {RATES}
+
+
+def _version_key(namespace, user_id):
+    if namespace in SHARED_NAMESPACES:
+        return f'{namespace}:version'
+    return f'{namespace}:version:{user_id}'
+
+
+def get_version(namespace, user_id):
+    key = _version_key(namespace, user_id)
+    version = cache.get(key)
+    if version is None:
+        # начальная версия по времени, чтобы не совпасть с ключами до сброса кеша
+        version = time.time_ns()
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key, version)
+    return version
+
+
+def get_versions(namespaces, user_id):
+    """Версии нескольких пространств одним обращением к кешу"""
+    keys = [_version_key(namespace, user_id) for namespace in namespaces]
+    found = cache.get_many(keys)
+    return [
+        found[key] if key in found else get_version(namespace, user_id)
+        for namespace, key in zip(namespaces, keys)
+    ]
+
+
+def bump_version(namespace, user_id, using=None):
+    key = _version_key(namespace, user_id)
+
+    def bump():
+        # новое значение, а не incr: у файлового кеша incr не атомарен, и две
+        # одновременные инвалидации могли бы получить одну и ту же версию
+        cache.set(key, time.time_ns(), timeout=None)
+
+    # до коммита другой запрос может снова закешировать старые данные
+    transaction.on_commit(bump, using=using)
+
+
+class References:
+    """Справочники пользователя: списки уже загруженных объектов"""
+
+    def __init__(self, categories, subcategories, statuses, types):
+        self.categories = categories
+        self.subcategories = subcategories
+        self.statuses = statuses
+        self.types = types
+
+
+def get_references(user):
+    from .models import Category, OperationType, Status, Subcategory
+
+    key = f'{REFERENCES}:{user.pk}:{get_version(REFERENCES, user.pk)}'
+    references = cache.get(key)
+    if references is None:
+        references = References(
+            categories=list(Category.objects.filter(user=user).order_by('pk')),
+            subcategories=list(Subcategory.objects.select_related('category').filter(user=user).order_by('pk')),
+            statuses=list(Status.objects.filter(user=user).order_by('pk')),
+            types=list(OperationType.objects.filter(user=user).order_by('pk')),
+        )
+        cache.set(key, references, timeout=settings.REFERENCE_CACHE_TIMEOUT)
+    return references
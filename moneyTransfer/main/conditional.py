@@ -0,0 +1,115 @@
+"""
+Условные GET для страниц и списков API по версиям данных пользователя.
+
+ETag строится из версий пространств кеша (caching.get_versions) и адреса
+запроса, поэтому повторный запрос с If-None-Match получает 304 до любых
+запросов к данным. Версии увеличиваются при каждом изменении переводов и
+справочников, а текущий день и часовой пояс входят в ETag, потому что от
+них зависят периоды вроде this_month. Из тех же значений строятся ключи
+кешированных фрагментов шаблонов (fragment_version).
+"""
+import hashlib
+from functools import wraps
+
+from asgiref.sync import iscoroutinefunction
+from django.http import HttpResponseNotModified
+from django.utils import timezone
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags
+
+from .caching import get_versions
+
+
+def request_versions(request, user_id, namespaces):
+    """
+    Все, от чего зависит страница пользователя, кроме адреса: версии данных,
+    часовой пояс и текущий день (периоды вроде this_month) и ключ сессии -
+    токен CSRF в формах страницы меняется при входе вместе с ним
+    """
+    session = getattr(request, 'session', None)
+    return [
+        user_id, *get_versions(namespaces, user_id),
+        timezone.get_current_timezone_name(), timezone.localdate().isoformat(),
+        session.session_key if session is not None else None,
+    ]
+
+
+def fragment_version(request, user_id, *namespaces):
+    """Часть ключа фрагментов шаблона ({% cache %}), которая меняется вместе с данными"""
+    return hashlib.md5(repr(request_versions(request, user_id, namespaces)).encode()).hexdigest()
+
+
+def user_etag(request, user_id, namespaces, *parts):
+    values = [*request_versions(request, user_id, namespaces), request.get_full_path(), *parts]
+    # слабый ETag: nginx все равно ослабляет сильные при сжатии ответа
+    return 'W/"%s"' % hashlib.md5(repr(values).encode()).hexdigest()
+
+
+def etag_matches(request, etag):
+    if request.method not in ('GET', 'HEAD'):
+        return False
+    etags = parse_etags(request.headers.get('If-None-Match', ''))
+    # сравнение слабое: W/"x" и "x" считаются одним ETag
+    return '*' in etags or etag.removeprefix('W/') in [tag.removeprefix('W/') for tag in etags]
+
+
+def has_messages(request):
+    # сообщение, показанное страницей, не должно потеряться в ответе 304
+    storage = getattr(request, '_messages', None)
+    return storage is not None and len(storage) > 0
+
+
+def not_modified(etag):
+    return finish(HttpResponseNotModified(), etag)
+
+
+def finish(response, etag):
+    if response.status_code in (200, 304) and not response.has_header('ETag'):
+        response.headers['ETag'] = etag
+        # браузер хранит страницу, но каждый раз переспрашивает сервер
+        patch_cache_control(response, private=True, no_cache=True)
+        patch_vary_headers(response, ['Cookie'])
+    return response
+
+
+def conditional_page(*namespaces):
+    """
+    Декоратор представления страницы (обычного или async) под login_required:
+    GET с совпавшим If-None-Match получает 304, остальные запросы проходят как есть
+    """
+    def decorator(view):
+        if iscoroutinefunction(view):
+            @wraps(view)
+            async def wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return await view(request, *args, **kwargs)
+                user = await request.auser()
+                etag = user_etag(request, user.pk, namespaces)
+                if etag_matches(request, etag) and not has_messages(request):
+                    return not_modified(etag)
+                return finish(await view(request, *args, **kwargs), etag)
+        else:
+            @wraps(view)
+            def wrapper(request, *args, **kwargs):
+                if request.method not in ('GET', 'HEAD'):
+                    return view(request, *args, **kwargs)
+                etag = user_etag(request, request.user.pk, namespaces)
+                if etag_matches(request, etag) and not has_messages(request):
+                    return not_modified(etag)
+                return finish(view(request, *args, **kwargs), etag)
+        return wrapper
+    return decorator
+
+
+def conditional_list(*namespaces):
+    """Декоратор метода list у ViewSet: то же для ответов API"""
+    def decorator(method):
+        @wraps(method)
+        def wrapper(self, request, *args, **kwargs):
+            # JSON и браузерный интерфейс API - разные ответы
+            etag = user_etag(request, request.user.pk, namespaces, request.accepted_renderer.format)
+            if etag_matches(request, etag):
+                return not_modified(etag)
+            return finish(method(self, request, *args, **kwargs), etag)
+        return wrapper
+    return decorator
@@ -0,0 +1,197 @@
+"""
+Потоковая выгрузка переводов в CSV, JSONL и XLSX.
+
+Строки читаются через values().iterator(), поэтому в памяти находится
+только текущая пачка, а первые байты уходят клиенту сразу. Суммы
+выгружаются в основных единицах валюты, как их читает импорт.
+XLSX пишется как zip-архив в поток, без сторонних библиотек.
+"""
+import csv
+import json
+import re
+import zipfile
+from datetime import datetime
+from decimal import Decimal
+from xml.sax.saxutils import escape
+
+from django.utils import timezone
+
+from .importer import COLUMNS
+from .money import to_major
+
+CHUNK_SIZE = 2000
+
+# колонки выгрузки совпадают с колонками импорта
+VALUES = {
+    'date': 'date_add',
+    'category': 'category__name',
+    'subcategory': 'subcategory__name',
+    'status': 'status__name',
+    'type': 'type__name',
+    'summ': 'summ',
+    'currency': 'currency',
+    'comment': 'comment',
+}
+SUMM_INDEX = COLUMNS.index('summ')
+
+
+def export_rows(queryset):
+    fields = [VALUES[column] for column in COLUMNS]
+    for row in queryset.values_list(*fields).iterator(chunk_size=CHUNK_SIZE):
+        row = list(row)
+        row[0] = timezone.localtime(row[0])
+        row[SUMM_INDEX] = to_major(row[SUMM_INDEX])
+        yield row
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def _batched(lines, size=500):
+    # отдельный yield на каждую строку слишком мелко для сокета
+    batch = []
+    for line in lines:
+        batch.append(line)
+        if len(batch) >= size:
+            yield ''.join(batch)
+            batch = []
+    if batch:
+        yield ''.join(batch)
+
+
+def stream_csv(rows):
+    writer = csv.writer(Echo())
+    yield '\ufeff' + writer.writerow(COLUMNS)
+
+    def lines():
+        for row in rows:
+            row[0] = row[0].isoformat()
+            yield writer.writerow(row)
+
+    yield from _batched(lines())
+
+
+def stream_jsonl(rows):
+    def lines():
+        for row in rows:
+            row[0] = row[0].isoformat()
+            # сумма строкой: без двоичного округления float
+            row[SUMM_INDEX] = str(row[SUMM_INDEX])
+            yield json.dumps(dict(zip(COLUMNS, row)), ensure_ascii=False) + '\n'
+
+    yield from _batched(lines())
+
+
+class _ZipBuffer:
+    """Файлоподобный объект для zipfile: накапливает байты до следующего drain()"""
+
+    def __init__(self):
+        self.parts = []
+
+    def write(self, data):
+        self.parts.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self.parts)
+        self.parts = []
+        return data
+
+
+XLSX_NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+XLSX_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+XLSX_PKG_REL = 'http://schemas.openxmlformats.org/package/2006/relationships'
+XML_HEADER = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+XLSX_PARTS = {
+    '[Content_Types].xml': (
+        '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+        '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+        '<Default Extension="xml" ContentType="application/xml"/>'
+        '<Override PartName="/xl/workbook.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+        '<Override PartName="/xl/worksheets/sheet1.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'
+        '<Override PartName="/xl/styles.xml" '
+        'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+        '</Types>'
+    ),
+    '_rels/.rels': (
+        f'<Relationships xmlns="{XLSX_PKG_REL}">'
+        f'<Relationship Id="rId1" Type="{XLSX_REL}/officeDocument" Target="xl/workbook.xml"/>'
+        '</Relationships>'
+    ),
+    'xl/workbook.xml': (
+        f'<workbook xmlns="{XLSX_NS}" xmlns:r="{XLSX_REL}">'
+        '<sheets><sheet name="Переводы" sheetId="1" r:id="rId1"/></sheets>'
+        '</workbook>'
+    ),
+    'xl/_rels/workbook.xml.rels': (
+        f'<Relationships xmlns="{XLSX_PKG_REL}">'
+        f'<Relationship Id="rId1" Type="{XLSX_REL}/worksheet" Target="worksheets/sheet1.xml"/>'
+        f'<Relationship Id="rId2" Type="{XLSX_REL}/styles" Target="styles.xml"/>'
+        '</Relationships>'
+    ),
+    # стиль 1 - формат даты и времени для первой колонки
+    'xl/styles.xml': (
+        f'<styleSheet xmlns="{XLSX_NS}">'
+        '<numFmts count="1"><numFmt numFmtId="164" formatCode="dd.mm.yyyy hh:mm"/></numFmts>'
+        '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+        '<fills count="2"><fill><patternFill patternType="none"/></fill>'
+        '<fill><patternFill patternType="gray125"/></fill></fills>'
+        '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+        '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+        '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+        '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+        '<cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles>'
+        '</styleSheet>'
+    ),
+}
+
+EXCEL_EPOCH = datetime(1899, 12, 30)
+# управляющие символы, недопустимые в XML
+ILLEGAL_XML = re.compile('[\x00-\x08\x0b\x0c\x0e-\x1f]')
+
+
+def _xlsx_cell(value):
+    if isinstance(value, datetime):
+        serial = (value.replace(tzinfo=None) - EXCEL_EPOCH).total_seconds() / 86400
+        return f'<c s="1"><v>{serial:.8f}</v></c>'
+    if isinstance(value, (int, Decimal)):
+        return f'<c><v>{value}</v></c>'
+    text = escape(ILLEGAL_XML.sub('', str(value)))
+    return f'<c t="inlineStr"><is><t xml:space="preserve">{text}</t></is></c>'
+
+
+def stream_xlsx(rows):
+    buffer = _ZipBuffer()
+    with zipfile.ZipFile(buffer, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, content in XLSX_PARTS.items():
+            archive.writestr(name, XML_HEADER + content)
+        yield buffer.drain()
+
+        with archive.open('xl/worksheets/sheet1.xml', 'w', force_zip64=True) as sheet:
+            sheet.write(f'{XML_HEADER}<worksheet xmlns="{XLSX_NS}"><sheetData>'.encode())
+            sheet.write(('<row>' + ''.join(_xlsx_cell(column) for column in COLUMNS) + '</row>').encode())
+            lines = []
+            for row in rows:
+                lines.append('<row>' + ''.join(_xlsx_cell(value) for value in row) + '</row>')
+                if len(lines) >= CHUNK_SIZE:
+                    sheet.write(''.join(lines).encode())
+                    lines = []
+                    yield buffer.drain()
+            sheet.write(''.join(lines).encode())
+            sheet.write(b'</sheetData></worksheet>')
+    yield buffer.drain()
+
+
+EXPORT_FORMATS = {
+    'csv': (stream_csv, 'text/csv; charset=utf-8'),
+    'jsonl': (stream_jsonl, 'application/x-ndjson; charset=utf-8'),
+    'xlsx': (stream_xlsx, 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+}
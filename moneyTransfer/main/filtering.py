@@ -0,0 +1,147 @@
+"""
+Перевод параметров фильтров переводов в условия запроса.
+
+Даты и периоды превращаются в полуоткрытый диапазон меток времени
+[начало дня с, начало дня после по) в часовом поясе пользователя. Условие
+сравнивает сам столбец date_add с константами, без приведения к дате, поэтому
+Postgres использует составные индексы (user, -date_add, ...).
+
+Поиск по комментарию объединяет полнотекстовое совпадение по search_vector
+и вхождение подстроки (icontains) для частей слов; оба условия обслуживают
+GIN-индексы (user, ...) из миграции 0007.
+"""
+from calendar import monthrange
+from datetime import date, datetime, time, timedelta
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db.models import F, Q
+from django.utils import timezone
+
+PERIODS = {
+    'today': "Сегодня",
+    'this_month': "Этот месяц",
+    'last_month': "Прошлый месяц",
+    'last_90_days': "Последние 90 дней",
+    'this_year': "Этот год",
+}
+
+ID_FIELDS = ('category', 'subcategory', 'status', 'type')
+FILTER_NAMES = (*ID_FIELDS, 'date_from', 'date_to', 'period', 'search', 'sum_order')
+
+# конфигурация to_tsvector в триггере search_vector (миграция 0007)
+SEARCH_CONFIG = 'russian'
+SEARCH_MAX_LENGTH = 200
+# короче - триграммный индекс не помогает, остается только полнотекстовый поиск
+SUBSTRING_MIN_LENGTH = 3
+
+
+def parse_date(value):
+    if isinstance(value, date):
+        return value
+    try:
+        return date.fromisoformat(str(value).strip())
+    except ValueError:
+        return None
+
+
+def next_day(day):
+    """День после day; после date.max дней нет, и граница остается открытой (None)"""
+    return day + timedelta(days=1) if day < date.max else None
+
+
+def period_range(period, today):
+    """Границы периода в днях: (первый день, день после последнего)"""
+    if period == 'today':
+        return today, next_day(today)
+    if period == 'this_month':
+        start = today.replace(day=1)
+        return start, next_day(today.replace(day=monthrange(today.year, today.month)[1]))
+    if period == 'last_month':
+        end = today.replace(day=1)
+        return (end - timedelta(days=1)).replace(day=1), end
+    if period == 'last_90_days':
+        return today - timedelta(days=89), next_day(today)
+    if period == 'this_year':
+        return today.replace(month=1, day=1), next_day(today.replace(month=12, day=31))
+    return None, None
+
+
+def date_range(date_from=None, date_to=None, period=None, tz=None):
+    """
+    Полуоткрытый диапазон дней (start, end): start включительно, end - нет.
+    Явные даты и период пересекаются; некорректные значения не учитываются.
+    """
+    tz = tz or timezone.get_current_timezone()
+    start = parse_date(date_from) if date_from else None
+    to = parse_date(date_to) if date_to else None
+    end = next_day(to) if to else None
+
+    if period in PERIODS:
+        period_start, period_end = period_range(period, timezone.localtime(timezone.now(), tz).date())
+        start = max(start, period_start) if start else period_start
+        end = min(end, period_end) if end and period_end else end or period_end
+    return start, end
+
+
+def day_start(day, tz):
+    return timezone.make_aware(datetime.combine(day, time.min), tz)
+
+
+def date_range_q(field, date_from=None, date_to=None, period=None, tz=None):
+    tz = tz or timezone.get_current_timezone()
+    start, end = date_range(date_from, date_to, period, tz)
+    q = Q()
+    if start:
+        q &= Q(**{f'{field}__gte': day_start(start, tz)})
+    if end:
+        q &= Q(**{f'{field}__lt': day_start(end, tz)})
+    return q
+
+
+def parse_id(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def clean_search(value):
+    return ' '.join(str(value or '').split())[:SEARCH_MAX_LENGTH]
+
+
+def search_query(text):
+    return SearchQuery(text, config=SEARCH_CONFIG, search_type='websearch')
+
+
+def search_q(text):
+    text = clean_search(text)
+    if not text:
+        return Q()
+    q = Q(search_vector=search_query(text))
+    if len(text) >= SUBSTRING_MIN_LENGTH:
+        q |= Q(comment__icontains=text)
+    return q
+
+
+def search_rank(text):
+    return SearchRank(F('search_vector'), search_query(clean_search(text)))
+
+
+def filters_from_query(query):
+    """Словарь фильтров переводов из параметров GET-запроса"""
+    filters = {name: query.get(name, '') for name in FILTER_NAMES}
+    filters['search'] = clean_search(filters['search'])
+    return filters
+
+
+def compile_transfer_filters(filters, tz=None):
+    """Условие для MoneyTransfer по словарю get_transfer_filters"""
+    q = search_q(filters.get('search'))
+    for name in ID_FIELDS:
+        if filters.get(name):
+            # нечисловой id не совпадает ни с одной записью
+            value = parse_id(filters[name])
+            q &= Q(**{f'{name}_id': value}) if value is not None else Q(pk__in=[])
+    return q & date_range_q(
+        'date_add', filters.get('date_from'), filters.get('date_to'), filters.get('period'), tz,
+    )
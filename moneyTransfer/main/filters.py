@@ -1,15 +1,42 @@
 import django_filters
-from .models import MoneyTransfer
+from .filtering import PERIODS, date_range_q, search_q
+from .models import Category, MoneyTransfer, OperationType, Status, Subcategory
+
+
+def user_references(model):
+    """Значения фильтра - только справочник текущего пользователя"""
+    def queryset(request):
+        if request is None or not request.user.is_authenticated:
+            return model.objects.none()
+        return model.objects.filter(user=request.user)
+    return queryset
+
 
 class MoneyTransferFilter(django_filters.FilterSet):
-    date_from = django_filters.DateFilter(field_name='date_add', lookup_expr='gte')
-    date_to = django_filters.DateFilter(field_name='date_add', lookup_expr='lte')
-    
+    # даты и период применяются вместе, одним диапазоном в filter_queryset
+    date_from = django_filters.DateFilter(method='filter_dates')
+    date_to = django_filters.DateFilter(method='filter_dates')
+    period = django_filters.ChoiceFilter(choices=list(PERIODS.items()), method='filter_dates')
+    search = django_filters.CharFilter(method='filter_search')
+    # чужие id не проходят проверку, а форма фильтров не показывает чужие названия
+    category = django_filters.ModelChoiceFilter(queryset=user_references(Category))
+    subcategory = django_filters.ModelChoiceFilter(queryset=user_references(Subcategory))
+    status = django_filters.ModelChoiceFilter(queryset=user_references(Status))
+    type = django_filters.ModelChoiceFilter(queryset=user_references(OperationType))
+
     class Meta:
         model = MoneyTransfer
-        fields = {
-            'category': ['exact'],
-            'subcategory': ['exact'],
-            'status': ['exact'],
-            'type': ['exact'],
-        }
\ No newline at end of file
+        fields = ['category', 'subcategory', 'status', 'type']
+
+    def filter_dates(self, queryset, name, value):
+        return queryset
+
+    def filter_search(self, queryset, name, value):
+        return queryset.filter(search_q(value))
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        data = self.form.cleaned_data
+        return queryset.filter(
+            date_range_q('date_add', data.get('date_from'), data.get('date_to'), data.get('period'))
+        )
@@ -1,29 +1,190 @@
 from django import forms
+from django.forms.models import ModelChoiceIterator
 from django.core.exceptions import ValidationError
+from django.urls import reverse_lazy
 
+from .caching import get_references
 from .models import MoneyTransfer, Category, OperationType, Status, Subcategory
+from .money import BASE_CURRENCY, MINOR_UNITS, to_major, to_minor
 
 
-class MoneyTransferForm(forms.ModelForm):
+class AmountField(forms.DecimalField):
+    """Сумма в форме - в основных единицах валюты, в модели - в минимальных (main.money)"""
+
+    def __init__(self, *, min_value=None, max_value=None, **kwargs):
+        # границы BigIntegerField относятся к минимальным единицам: их проверяет to_minor
+        kwargs.setdefault('max_digits', None)
+        kwargs.setdefault('decimal_places', len(str(MINOR_UNITS)) - 1)
+        super().__init__(**kwargs)
+
+    def to_python(self, value):
+        if isinstance(value, str):
+            value = value.replace(' ', '').replace('\xa0', '').replace(',', '.')
+        return super().to_python(value)
+
+    def prepare_value(self, value):
+        # целое - значение из модели, строка - введенное пользователем
+        if isinstance(value, int):
+            return to_major(value)
+        return value
+
+    def clean(self, value):
+        value = super().clean(value)
+        if value is None:
+            return None
+        try:
+            return to_minor(value)
+        except ValueError as e:
+            raise ValidationError(str(e))
+
+    def has_changed(self, initial, data):
+        return super().has_changed(self.prepare_value(initial), data)
+
+
+class CachedChoiceIterator(ModelChoiceIterator):
+    def __iter__(self):
+        if self.field.objects is None:
+            yield from super().__iter__()
+            return
+        if self.field.empty_label is not None:
+            yield ("", self.field.empty_label)
+        for obj in self.field.objects.values():
+            yield self.choice(obj)
+
+    def __len__(self):
+        if self.field.objects is None:
+            return super().__len__()
+        return len(self.field.objects) + (self.field.empty_label is not None)
+
+    def __bool__(self):
+        if self.field.objects is None:
+            return super().__bool__()
+        return self.field.empty_label is not None or bool(self.field.objects)
+
+
+class CachedModelChoiceField(forms.ModelChoiceField):
+    """
+    ModelChoiceField, который после set_objects() берет варианты из готового
+    списка объектов (кеша справочников) и не обращается к БД
+    """
+    iterator = CachedChoiceIterator
+    objects = None
+
+    def set_objects(self, objects):
+        self.objects = {str(obj.pk): obj for obj in objects}
+
+    def to_python(self, value):
+        if self.objects is None:
+            return super().to_python(value)
+        if value in self.empty_values:
+            return None
+        if isinstance(value, self.queryset.model):
+            value = value.pk
+        try:
+            return self.objects[str(value)]
+        except KeyError:
+            raise ValidationError(
+                self.error_messages['invalid_choice'],
+                code='invalid_choice',
+                params={'value': value},
+            )
+
+
+class LookupSelect(forms.Select):
+    """
+    Список, в котором выводятся только пустой и выбранный варианты; остальные
+    загружает static/main/js/lookup.js из lookup (см. main.lookups).
+    parent - имя поля, значение которого передается как ?category=
+    """
+
+    def __init__(self, lookup, parent=None, attrs=None):
+        attrs = {'data-lookup': lookup, **(attrs or {})}
+        if parent:
+            attrs['data-lookup-parent'] = parent
+        super().__init__(attrs)
+
+    def optgroups(self, name, value, attrs=None):
+        selected = {str(v) for v in value if v not in (None, '')}
+        field = getattr(self.choices, 'field', None)
+        if getattr(field, 'objects', None) is not None:
+            # варианты из кеша справочников: выбранные берутся по id, без обхода всех
+            choices = [("", field.empty_label)] if field.empty_label is not None else []
+            choices += [self.choices.choice(field.objects[pk]) for pk in selected if pk in field.objects]
+        else:
+            choices = [(key, label) for key, label in self.choices if key == "" or str(key) in selected]
+        all_choices, self.choices = self.choices, choices
+        try:
+            return super().optgroups(name, value, attrs)
+        finally:
+            self.choices = all_choices
+
+
+class CachedChoicesMixin:
+    """Заполняет CachedModelChoiceField справочниками пользователя из кеша"""
+    cached_fields = {}
+
+    def __init__(self, *args, user=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        if user is not None:
+            references = get_references(user)
+            for name, attr in self.cached_fields.items():
+                self.fields[name].set_objects(getattr(references, attr))
+
+    def _get_validation_exclusions(self):
+        # принадлежность объектов пользователю уже проверена по кешу,
+        # повторная проверка существования в модели дала бы запрос на каждое поле
+        exclude = super()._get_validation_exclusions()
+        for name, field in self.fields.items():
+            if getattr(field, 'objects', None) is not None:
+                exclude.add(name)
+        return exclude
+
+
+class MoneyTransferForm(CachedChoicesMixin, forms.ModelForm):
+    cached_fields = {
+        'category': 'categories',
+        'subcategory': 'subcategories',
+        'type': 'types',
+        'status': 'statuses',
+    }
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.fields['category'].empty_label = "Выберите категорию (или подкатегорию)"
         self.fields['subcategory'].empty_label = "Выберите подкатегорию"
         self.fields['type'].empty_label = "Выберите тип"
         self.fields['status'].empty_label = "Выберите статус"
+        # формы без поля валюты (сохраненные страницы, скрипты) создают рублевые переводы
+        self.fields['currency'].required = False
+
+    def clean_currency(self):
+        return self.cleaned_data['currency'] or BASE_CURRENCY
+
     class Meta:
         model = MoneyTransfer
-        fields = ['type', 'status', 'subcategory', 'category', 'summ', 'comment']
+        fields = ['type', 'status', 'subcategory', 'category', 'summ', 'currency', 'comment']
+        field_classes = {
+            'summ': AmountField,
+            'type': CachedModelChoiceField,
+            'status': CachedModelChoiceField,
+            'category': CachedModelChoiceField,
+            'subcategory': CachedModelChoiceField,
+        }
         
         widgets = {
             'type': forms.Select(attrs={'class': 'form-select'}),
             'status': forms.Select(attrs={'class': 'form-select'}),
-            'category': forms.Select(attrs={'class': 'form-select'}),
-            'subcategory': forms.Select(attrs={'class': 'form-select'}),
+            # категорий и подкатегорий у пользователя могут быть тысячи
+            'category': LookupSelect(reverse_lazy('api-category-lookup'), attrs={'class': 'form-select'}),
+            'subcategory': LookupSelect(
+                reverse_lazy('api-subcategory-lookup'), parent='category', attrs={'class': 'form-select'},
+            ),
             'summ': forms.NumberInput(attrs={
                 'class': 'form-control',
-                'placeholder': 'Сумма'
+                'placeholder': 'Сумма',
+                'step': '0.01',
             }),
+            'currency': forms.Select(attrs={'class': 'form-select'}),
             'comment': forms.Textarea(attrs={
                 'class': 'form-control',
                 'rows': 3,
@@ -36,6 +197,7 @@ class MoneyTransferForm(forms.ModelForm):
             'status': 'Статус',
             'category': 'Категория / Подкатегория',
             'summ': 'Сумма',
+            'currency': 'Валюта',
             'comment': 'Комментарий',
         }
 
@@ -79,7 +241,9 @@ class TypeForm(forms.ModelForm):
         }
 
 
-class SubcategoryForm(forms.ModelForm):
+class SubcategoryForm(CachedChoicesMixin, forms.ModelForm):
+    cached_fields = {'category': 'categories'}
+
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         
@@ -88,11 +252,65 @@ class SubcategoryForm(forms.ModelForm):
     class Meta:
         model = Subcategory
         fields = ['category', 'name']
+        field_classes = {'category': CachedModelChoiceField}
         
         widgets = {
-            'category': forms.Select(attrs={'class': 'form-select'}),
+            'category': LookupSelect(reverse_lazy('api-category-lookup'), attrs={'class': 'form-select'}),
             'name': forms.TextInput(attrs={
                 'class': 'form-control',
                 'placeholder': 'Новая подкатегория'
             }),
         }
+
+
+class ReferenceMergeForm(forms.Form):
+    """Выбор элемента того же справочника, в который объединяется source (main.merge)"""
+    # вид справочника -> (список в кеше справочников, lookup для длинных списков)
+    REFERENCES = {
+        'status': ('statuses', None),
+        'type': ('types', None),
+        'category': ('categories', 'api-category-lookup'),
+        'subcategory': ('subcategories', 'api-subcategory-lookup'),
+    }
+
+    target = CachedModelChoiceField(
+        queryset=Status.objects.none(), label="Объединить с", empty_label="Выберите, с чем объединить",
+    )
+
+    def __init__(self, *args, source, kind, user, **kwargs):
+        super().__init__(*args, **kwargs)
+        attr, lookup = self.REFERENCES[kind]
+        field = self.fields['target']
+        field.queryset = type(source).objects.none()
+        field.set_objects(obj for obj in getattr(get_references(user), attr) if obj.pk != source.pk)
+        attrs = {'class': 'form-select'}
+        if lookup is None:
+            field.widget = forms.Select(attrs=attrs)
+        else:
+            if kind == 'subcategory':
+                attrs['data-lookup-label'] = 'full'
+            field.widget = LookupSelect(reverse_lazy(lookup), attrs=attrs)
+        field.widget.choices = field.choices
+
+
+class TransferImportForm(forms.Form):
+    file = forms.FileField(
+        label='Файл',
+        widget=forms.ClearableFileInput(attrs={'class': 'form-control', 'accept': '.csv,.jsonl'}),
+    )
+    format = forms.ChoiceField(
+        label='Формат',
+        choices=[('', 'По расширению файла'), ('csv', 'CSV'), ('jsonl', 'JSONL')],
+        required=False,
+        widget=forms.Select(attrs={'class': 'form-select'}),
+    )
+
+    def clean(self):
+        cleaned_data = super().clean()
+        upload = cleaned_data.get('file')
+        if upload and not cleaned_data.get('format'):
+            extension = upload.name.rsplit('.', 1)[-1].lower()
+            if extension not in ('csv', 'jsonl'):
+                raise ValidationError({'format': 'Не удалось определить формат, выберите его явно.'})
+            cleaned_data['format'] = extension
+        return cleaned_data
@@ -0,0 +1,211 @@
+"""
+Потоковый импорт переводов из CSV и JSONL.
+
+Файл читается построчно, названия справочников переводятся в id по
+словарям, построенным один раз из кеша справочников, а строки пишутся
+пачками через bulk_create, каждая пачка - в своей транзакции. Суммы в
+файле - в основных единицах валюты (рубли с копейками), валюта - код
+ISO 4217, по умолчанию рубль. Если файл не удается дочитать (не та
+кодировка, испорченный CSV), импорт останавливается: записанные пачки
+остаются, а в отчет попадает строка, на которой чтение прервалось.
+"""
+import csv
+import json
+import time
+from datetime import datetime
+
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import get_references
+from .models import MoneyTransfer
+from .money import BASE_CURRENCY, CURRENCIES, to_minor
+
+COLUMNS = ['date', 'category', 'subcategory', 'status', 'type', 'summ', 'currency', 'comment']
+DATE_FORMATS = ['%d.%m.%Y %H:%M:%S', '%d.%m.%Y %H:%M', '%d.%m.%Y']
+
+
+class RowError(Exception):
+    pass
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.created = 0
+        self.errors = []
+        # (строка, сообщение), если файл не удалось дочитать
+        self.stopped = None
+        self.started = time.monotonic()
+        self.elapsed = 0.0
+
+    @property
+    def rows_per_second(self):
+        elapsed = self.elapsed or time.monotonic() - self.started
+        return self.rows / elapsed if elapsed else 0.0
+
+    def finish(self):
+        self.elapsed = time.monotonic() - self.started
+
+
+def name_key(name):
+    return ' '.join(str(name).split()).casefold()
+
+
+def read_csv(stream):
+    for line, row in enumerate(csv.DictReader(stream), start=2):
+        yield line, row
+
+
+def read_jsonl(stream):
+    for line, text in enumerate(stream, start=1):
+        if not text.strip():
+            continue
+        try:
+            row = json.loads(text)
+        except ValueError as e:
+            yield line, RowError(f"некорректный JSON: {e}")
+            continue
+        if not isinstance(row, dict):
+            yield line, RowError("строка должна быть JSON-объектом")
+            continue
+        yield line, row
+
+
+READERS = {'csv': read_csv, 'jsonl': read_jsonl}
+
+
+def read_error(e):
+    if isinstance(e, UnicodeDecodeError):
+        return (
+            f"файл не в кодировке {e.encoding}, чтение прервано; "
+            f"сохраните его в UTF-8 (в Excel - «CSV UTF-8»)"
+        )
+    return f"некорректный CSV, чтение прервано: {e}"
+
+
+class TransferImporter:
+    def __init__(self, user, batch_size=1000, max_errors=1000):
+        self.user = user
+        self.batch_size = batch_size
+        self.max_errors = max_errors
+
+        references = get_references(user)
+        # при совпадении названий берется первый объект
+        self.categories = {}
+        for obj in references.categories:
+            self.categories.setdefault(name_key(obj.name), obj.pk)
+        self.subcategories = {}
+        for obj in references.subcategories:
+            self.subcategories.setdefault((obj.category_id, name_key(obj.name)), obj.pk)
+        self.statuses = {}
+        for obj in references.statuses:
+            self.statuses.setdefault(name_key(obj.name), obj.pk)
+        self.types = {}
+        for obj in references.types:
+            self.types.setdefault(name_key(obj.name), obj.pk)
+
+    def run(self, stream, fmt, progress=None):
+        report = ImportReport()
+        batch = []
+        rows = READERS[fmt](stream)
+        line = 0
+        while True:
+            try:
+                line, row = next(rows)
+            except StopIteration:
+                break
+            except (UnicodeDecodeError, csv.Error) as e:
+                # строки до ошибки уже разобраны и записываются ниже
+                report.stopped = (line + 1, read_error(e))
+                report.errors.append(report.stopped)
+                break
+            report.rows += 1
+            try:
+                if isinstance(row, RowError):
+                    raise row
+                batch.append(self.build(row))
+            except RowError as e:
+                if len(report.errors) < self.max_errors:
+                    report.errors.append((line, str(e)))
+                continue
+            if len(batch) >= self.batch_size:
+                report.created += self.write(batch)
+                batch = []
+                if progress:
+                    progress(report)
+        if batch:
+            report.created += self.write(batch)
+        report.finish()
+        if progress:
+            progress(report)
+        return report
+
+    def write(self, batch):
+        with transaction.atomic():
+            MoneyTransfer.objects.bulk_create(batch)
+        return len(batch)
+
+    def lookup(self, mapping, value, label):
+        if not value:
+            raise RowError(f"не указано поле {label}")
+        try:
+            return mapping[name_key(value)]
+        except KeyError:
+            raise RowError(f"{label} «{value}» не найден(а) в справочнике")
+
+    def build(self, row):
+        category_id = self.lookup(self.categories, row.get('category'), 'категория')
+        if not row.get('subcategory'):
+            raise RowError("не указано поле подкатегория")
+        try:
+            subcategory_id = self.subcategories[(category_id, name_key(row['subcategory']))]
+        except KeyError:
+            raise RowError(f"подкатегория «{row['subcategory']}» не найдена в категории «{row['category']}»")
+
+        return MoneyTransfer(
+            user=self.user,
+            date_add=self.parse_date(row.get('date')),
+            category_id=category_id,
+            subcategory_id=subcategory_id,
+            status_id=self.lookup(self.statuses, row.get('status'), 'статус'),
+            type_id=self.lookup(self.types, row.get('type'), 'тип'),
+            summ=self.parse_summ(row.get('summ')),
+            currency=self.parse_currency(row.get('currency')),
+            comment=str(row.get('comment') or '')[:255],
+        )
+
+    def parse_date(self, value):
+        if not value:
+            return timezone.now()
+        value = str(value).strip()
+        try:
+            parsed = datetime.fromisoformat(value)
+        except ValueError:
+            for fmt in DATE_FORMATS:
+                try:
+                    parsed = datetime.strptime(value, fmt)
+                    break
+                except ValueError:
+                    pass
+            else:
+                raise RowError(f"некорректная дата «{value}»")
+        if timezone.is_naive(parsed):
+            parsed = timezone.make_aware(parsed)
+        return parsed
+
+    def parse_summ(self, value):
+        if value is None or value == '':
+            raise RowError("не указана сумма")
+        try:
+            return to_minor(value)
+        except ValueError as e:
+            raise RowError(str(e))
+
+    def parse_currency(self, value):
+        if not value:
+            return BASE_CURRENCY
+        currency = str(value).strip().upper()
+        if currency not in CURRENCIES:
+            raise RowError(f"неизвестная валюта «{value}»")
+        return currency
@@ -0,0 +1,35 @@
+"""
+Поиск по справочникам для выпадающих списков с подгрузкой (static/main/js/lookup.js).
+
+Страницы выводят в списках категорий и подкатегорий только выбранные
+значения, а остальные варианты браузер запрашивает у /api/<справочник>/lookup/.
+Короткая строка ищется как начало названия, длиннее - как вхождение
+подстроки; оба условия сравнивают UPPER(name) и обслуживаются индексами
+(user, UPPER(name)) из миграции 0010. Подкатегории одной категории выбираются
+по уникальному индексу (category, name) уже в порядке названий.
+"""
+from django.db.models import Case, IntegerField, Value, When
+
+from .filtering import SUBSTRING_MIN_LENGTH, clean_search
+
+# вариантов в одном ответе
+DEFAULT_LIMIT = 20
+MAX_LIMIT = 100
+
+
+def search(queryset, term, limit=DEFAULT_LIMIT):
+    """
+    (строки, есть ли еще) для queryset.values(...): варианты, начинающиеся
+    с term, идут первыми, дальше - по названию
+    """
+    term = clean_search(term)
+    if len(term) >= SUBSTRING_MIN_LENGTH:
+        starts = Case(When(name__istartswith=term, then=Value(0)), default=Value(1), output_field=IntegerField())
+        queryset = queryset.filter(name__icontains=term).order_by(starts, 'name', 'pk')
+    else:
+        if term:
+            queryset = queryset.filter(name__istartswith=term)
+        queryset = queryset.order_by('name', 'pk')
+    rows = list(queryset[:limit + 1])
+    return rows[:limit], len(rows) > limit
+
@@ -0,0 +1,58 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.utils import timezone
+
+from main import archive
+from main.models import ArchivedTransfer, MoneyTransfer
+
+
+class Command(BaseCommand):
+    help = (
+        "Переносит старые переводы в архивную таблицу пачками. Дневные итоги не "
+        "меняются, а списки, выгрузка и отчеты читают архив, когда его требует период"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.TRANSFERS_ARCHIVE_AFTER_DAYS,
+                            help="Архивировать переводы старше стольких дней")
+        parser.add_argument('--user', action='append', dest='users', help="Имя пользователя (можно несколько раз)")
+        parser.add_argument('--batch-size', type=int, default=archive.DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        if options['days'] < 1:
+            raise CommandError("--days должно быть положительным")
+        user_ids = None
+        if options['users']:
+            users = User.objects.filter(username__in=options['users'])
+            missing = set(options['users']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Пользователи не найдены: {', '.join(sorted(missing))}")
+            user_ids = list(users.values_list('pk', flat=True))
+
+        before = timezone.now() - timedelta(days=options['days'])
+        self.stdout.write(f"Архивирование переводов раньше {timezone.localtime(before):%Y-%m-%d %H:%M}")
+        started = time.monotonic()
+        total = 0
+        try:
+            while True:
+                moved = archive.archive_batch(before, user_ids, options['batch_size'])
+                if not moved:
+                    break
+                total += moved
+                elapsed = time.monotonic() - started
+                self.stdout.write(f"{total} перенесено, {total / elapsed if elapsed else 0:.0f} строк/с")
+        except KeyboardInterrupt:
+            # каждая пачка - своя транзакция: перенесенное остается в архиве
+            raise CommandError(f"Прервано после {total} переводов; повторный запуск продолжит")
+        if total:
+            # удаленные строки занимают место в основной таблице и ее индексах до VACUUM
+            self.stdout.write("VACUUM ANALYZE...")
+            with connection.cursor() as cursor:
+                cursor.execute(f"VACUUM (ANALYZE) {MoneyTransfer._meta.db_table}")
+                cursor.execute(f"ANALYZE {ArchivedTransfer._meta.db_table}")
+        self.stdout.write(self.style.SUCCESS(f"Готово: перенесено {total}"))
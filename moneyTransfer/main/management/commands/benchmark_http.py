@@ -0,0 +1,98 @@
+import http.client
+import statistics
+import threading
+import time
+from urllib.parse import urlsplit
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+
+
+class Command(BaseCommand):
+    help = (
+        "Нагрузочный тест запущенного сервера: несколько потоков с keepalive-"
+        "соединениями запрашивают страницы от имени пользователя, печатаются "
+        "запросы в секунду и задержки"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000', help="Адрес сервера")
+        parser.add_argument('--user', help="Имя пользователя (по умолчанию - первый с переводами)")
+        parser.add_argument(
+            '--path', action='append', dest='paths',
+            help="Путь для запросов, можно указать несколько раз (по умолчанию / и /api/transfers/)",
+        )
+        parser.add_argument('--concurrency', type=int, default=8)
+        parser.add_argument('--duration', type=float, default=10.0, help="Длительность каждого теста, секунды")
+
+    def handle(self, *args, **options):
+        url = urlsplit(options['url'])
+        user = self.get_user(options['user'])
+        client = Client()
+        client.force_login(user)
+        cookie = f"sessionid={client.cookies['sessionid'].value}"
+
+        for path in options['paths'] or ['/', '/api/transfers/']:
+            result = self.run(url, path, cookie, options['concurrency'], options['duration'])
+            latencies = sorted(result['latencies'])
+            if not latencies:
+                raise CommandError(f"{path}: нет успешных ответов ({result['errors']} ошибок)")
+            p99 = latencies[int(len(latencies) * 0.99) - 1] if len(latencies) >= 100 else latencies[-1]
+            self.stdout.write(
+                f"{path}: {len(latencies) / result['elapsed']:.0f} запросов/с, "
+                f"p50 {statistics.median(latencies) * 1000:.1f} мс, p99 {p99 * 1000:.1f} мс, "
+                f"ошибок {result['errors']}"
+            )
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f"Пользователь {username} не найден")
+        user = User.objects.filter(moneytransfer__isnull=False).first()
+        if user is None:
+            raise CommandError("Нет пользователей с переводами")
+        return user
+
+    def run(self, url, path, cookie, concurrency, duration):
+        result = {'latencies': [], 'errors': 0}
+        lock = threading.Lock()
+        deadline = time.monotonic() + duration
+        headers = {'Cookie': cookie, 'Host': url.netloc, 'Connection': 'keep-alive'}
+
+        def worker():
+            latencies, errors = [], 0
+            connection = http.client.HTTPConnection(url.hostname, url.port or 80, timeout=30)
+            while time.monotonic() < deadline:
+                started = time.perf_counter()
+                try:
+                    connection.request('GET', path, headers=headers)
+                    response = connection.getresponse()
+                    response.read()
+                    if response.status != 200:
+                        errors += 1
+                        continue
+                    latencies.append(time.perf_counter() - started)
+                    if response.getheader('Connection', '').lower() == 'close':
+                        connection.close()
+                except (OSError, http.client.HTTPException):
+                    errors += 1
+                    connection.close()
+                    if not latencies and errors >= 100:
+                        # сервер недоступен
+                        break
+            connection.close()
+            with lock:
+                result['latencies'].extend(latencies)
+                result['errors'] += errors
+
+        threads = [threading.Thread(target=worker) for _ in range(concurrency)]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        result['elapsed'] = time.monotonic() - started
+        return result
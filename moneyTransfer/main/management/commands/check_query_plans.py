@@ -0,0 +1,177 @@
+import json
+import re
+from zoneinfo import ZoneInfo
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from main import views
+from main.filters import MoneyTransferFilter
+from main.models import MoneyTransfer, TransferRecord
+from main.pagination import KeysetPaginator
+
+TABLE = MoneyTransfer._meta.db_table
+RECORDS = TransferRecord._meta.db_table
+DATE_PARAMS = ('date_from', 'date_to', 'period')
+# приведение date_add к дате или к другому поясу не дает использовать индекс
+NON_SARGABLE = re.compile(r'"date_add"\)?::date|AT TIME ZONE|DATE\("main_moneytransfer"\."date_add"', re.IGNORECASE)
+# подзапрос курса в итогах (main.money.converted_sum) приводит date_add к дате
+# только для поиска курса, а его ORDER BY ... LIMIT 1 не делает итог страницей
+RATE_SUBQUERY = re.compile(r'\(SELECT U\d+\."rate" .*?LIMIT 1\)')
+
+
+class Command(BaseCommand):
+    help = (
+        "Выполняет index для разных фильтров, строит EXPLAIN для каждого запроса "
+        "к main_moneytransfer и проверяет, что используются составные индексы"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Имя пользователя (по умолчанию - первый с переводами)")
+        parser.add_argument('--verbose-plans', action='store_true', help="Печатать планы целиком")
+        parser.add_argument(
+            '--timezone', default='Asia/Vladivostok',
+            help="Часовой пояс пользователя для проверки фильтров по датам",
+        )
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        sample = MoneyTransfer.objects.filter(user=user).order_by('-date_add').first()
+        if sample is None:
+            raise CommandError(f"У пользователя {user} нет переводов")
+
+        day = sample.date_add.date().isoformat()
+        variants = [
+            ({}, {'mt_user_date_idx'}),
+            ({'sum_order': 'asc'}, {'mt_user_summ_idx'}),
+            ({'sum_order': 'desc'}, {'mt_user_summ_idx'}),
+            ({'category': sample.category_id}, {'mt_user_cat_date_idx'}),
+            ({'subcategory': sample.subcategory_id}, {'mt_user_subcat_date_idx'}),
+            ({'status': sample.status_id}, {'mt_user_date_idx'}),
+            ({'type': sample.type_id}, {'mt_user_date_idx'}),
+            ({'date_from': day, 'date_to': day}, {'mt_user_date_idx'}),
+            ({'period': 'last_90_days'}, {'mt_user_date_idx'}),
+            ({'category': sample.category_id, 'date_from': day}, {'mt_user_cat_date_idx'}),
+        ]
+
+        failures = []
+        for params, expected in variants:
+            for keyset in (False, True):
+                failures += self.check_variant(user, params, expected, keyset, options['verbose_plans'])
+
+        # границы дней в поясе пользователя: другой часовой пояс, итог уже не из агрегатов
+        with timezone.override(ZoneInfo(options['timezone'])):
+            for params, expected in variants:
+                if DATE_PARAMS & params.keys():
+                    failures += self.check_variant(user, params, expected, False, options['verbose_plans'])
+                    failures += self.check_filterset(user, params, expected, options['verbose_plans'])
+
+        if failures:
+            raise CommandError("Планы без индексов:\n" + "\n".join(failures))
+        self.stdout.write(self.style.SUCCESS("Все запросы index используют индексы"))
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f"Пользователь {username} не найден")
+        user = User.objects.filter(moneytransfer__isnull=False).first()
+        if user is None:
+            raise CommandError("Нет пользователей с переводами")
+        return user
+
+    def run_index(self, user, params):
+        request = RequestFactory().get('/', params)
+        request.user = user
+        with CaptureQueriesContext(connection) as queries:
+            response = views.index(request)
+        # с архивом список читает представление TransferRecord
+        return response, [q['sql'] for q in queries if TABLE in q['sql'] or RECORDS in q['sql']]
+
+    def check_variant(self, user, params, expected, keyset, verbose):
+        params = dict(params)
+        if keyset:
+            # вторая страница: запрос с курсором
+            filters = {key: str(value) for key, value in params.items()}
+            queryset = views.apply_transfer_filters(views.get_user_transfers(user, filters), filters)
+            field, descending = views.get_transfer_ordering(filters)
+            page = KeysetPaginator(queryset, 10, field, descending).page()
+            params['cursor'] = page.next_cursor or ''
+        _, sqls = self.run_index(user, params)
+
+        shown = {key: value for key, value in params.items() if key != 'cursor'}
+        label = f"{shown} ({'keyset' if keyset else 'page'}, {timezone.get_current_timezone_name()})"
+        return self.check_sqls(label, sqls, expected, bool(DATE_PARAMS & params.keys()), verbose)
+
+    def check_filterset(self, user, params, expected, verbose):
+        # тот же диапазон через MoneyTransferFilter, как в API; справочники фильтра - из запроса
+        request = RequestFactory().get('/')
+        request.user = user
+        filterset = MoneyTransferFilter(params, queryset=MoneyTransfer.objects.filter(user=user), request=request)
+        if not filterset.is_valid():
+            return [f"MoneyTransferFilter {params}: {filterset.errors}"]
+        queryset = filterset.qs.order_by('-date_add', '-id')[:50]
+        sql, sql_params = queryset.query.sql_with_params()
+        with connection.cursor() as cursor:
+            sql = cursor.mogrify(sql, sql_params).decode()
+        label = f"{params} (api, {timezone.get_current_timezone_name()})"
+        return self.check_sqls(label, [sql], expected, True, verbose)
+
+    def check_sqls(self, label, sqls, expected, dates, verbose):
+        failures = []
+        for sql in sqls:
+            plan = self.explain(sql)
+            nodes = list(self.walk(plan))
+            indexes = {self.root(n['Index Name']) for n in nodes if 'Index Name' in n}
+            seq_scans = [
+                n for n in nodes if n['Node Type'] == 'Seq Scan' and self.root(n.get('Relation Name', '')) == TABLE
+            ]
+            sorts = [n for n in nodes if n['Node Type'] in ('Sort', 'Incremental Sort')]
+            own_sql = RATE_SUBQUERY.sub('', sql)
+            is_page = 'ORDER BY' in own_sql and 'LIMIT' in own_sql
+
+            ok = not seq_scans
+            if is_page:
+                ok = ok and bool(indexes & expected) and not sorts
+            if dates:
+                ok = ok and not NON_SARGABLE.search(own_sql) and re.search(r'"date_add" (>=|<) ', own_sql)
+            status = self.style.SUCCESS('OK') if ok else self.style.ERROR('FAIL')
+            kind = 'page' if is_page else 'aggregate'
+            self.stdout.write(f"{status} {label} {kind}: {', '.join(sorted(indexes)) or '-'}")
+            if verbose:
+                self.stdout.write(json.dumps(plan, indent=2, ensure_ascii=False))
+            if not ok:
+                failures.append(f"{label} {kind}: {sql}")
+        return failures
+
+    def root(self, name):
+        # в секционированной таблице (main.partitioning) у каждой секции свои
+        # индексы, унаследованные от индексов родительской таблицы
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT p.relname FROM pg_inherits i JOIN pg_class p ON p.oid = i.inhparent "
+                "WHERE i.inhrelid = to_regclass(%s)",
+                [name],
+            )
+            row = cursor.fetchone()
+        return row[0] if row else name
+
+    def explain(self, sql):
+        # На маленьких наборах данных планировщику все равно, сканировать таблицу
+        # или сортировать, поэтому Seq Scan и Sort штрафуются: проверяется, что
+        # есть индекс, который сам отдает строки в нужном порядке
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute("SET LOCAL enable_seqscan = off")
+            cursor.execute("SET LOCAL enable_sort = off")
+            cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+            return cursor.fetchone()[0][0]['Plan']
+
+    def walk(self, node):
+        yield node
+        for child in node.get('Plans', []):
+            yield from self.walk(child)
@@ -0,0 +1,64 @@
+import gzip
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# текстовые форматы; картинки и шрифты woff/woff2 уже сжаты
+EXTENSIONS = ('.css', '.js', '.mjs', '.map', '.json', '.svg', '.txt', '.xml', '.html', '.ico', '.ttf', '.otf', '.eot')
+# меньшие файлы nginx отдает как есть (gzip_min_length)
+MIN_SIZE = 1024
+
+
+class Command(BaseCommand):
+    help = (
+        "Сжимает файлы STATIC_ROOT после collectstatic: рядом с каждым кладет .gz и .br, "
+        "которые nginx отдает через gzip_static/brotli_static без сжатия на лету"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help="Сжать заново и уже сжатые файлы")
+
+    def handle(self, *args, **options):
+        root = settings.STATIC_ROOT
+        if not root or not os.path.isdir(root):
+            raise CommandError(f"Каталог {root} не найден, сначала выполните collectstatic")
+        encoders = [('.gz', lambda data: gzip.compress(data, compresslevel=9, mtime=0))]
+        if brotli is not None:
+            encoders.append(('.br', lambda data: brotli.compress(data, quality=11)))
+        else:
+            self.stderr.write(self.style.WARNING("Пакет brotli не установлен, создаются только .gz"))
+
+        written = skipped = 0
+        for directory, _, names in os.walk(root):
+            for name in names:
+                if not name.endswith(EXTENSIONS):
+                    continue
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                if stat.st_size < MIN_SIZE:
+                    continue
+                data = None
+                for suffix, encode in encoders:
+                    target = path + suffix
+                    # сжатый файл получает время исходного: совпадение значит, что он актуален
+                    if not options['force'] and os.path.exists(target) and os.stat(target).st_mtime == stat.st_mtime:
+                        skipped += 1
+                        continue
+                    if data is None:
+                        with open(path, 'rb') as source:
+                            data = source.read()
+                    compressed = encode(data)
+                    if len(compressed) >= len(data):
+                        continue
+                    with open(target, 'wb') as output:
+                        output.write(compressed)
+                    os.utime(target, (stat.st_atime, stat.st_mtime))
+                    written += 1
+
+        self.stdout.write(self.style.SUCCESS(f"Сжато файлов: {written}, уже актуальных: {skipped}"))
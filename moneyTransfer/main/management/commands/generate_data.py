@@ -0,0 +1,185 @@
+import io
+import random
+import time
+from datetime import timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from main import rollups
+from main.caching import REFERENCES, bump_version
+from main.models import Category, MoneyTransfer, OperationType, Status, Subcategory, TransferRecord
+from main.money import MINOR_UNITS, SUMM_MAX
+
+CATEGORY_NAMES = [
+    'Продукты', 'Транспорт', 'Жилье', 'Связь', 'Здоровье', 'Образование', 'Одежда',
+    'Развлечения', 'Путешествия', 'Подарки', 'Зарплата', 'Инвестиции', 'Налоги', 'Кредиты',
+]
+STATUS_NAMES = ['Выполнен', 'В обработке', 'Отменен', 'Отклонен', 'Черновик']
+TYPE_NAMES = ['Списание', 'Пополнение', 'Перевод', 'Возврат']
+COMMENTS = ['', '', '', 'Оплата картой', 'Наличные', 'По договору', 'Ежемесячный платеж', 'Кешбэк']
+
+TRANSFER_COLUMNS = ('user_id', 'date_add', 'category_id', 'subcategory_id', 'status_id', 'type_id', 'summ', 'comment')
+
+
+def zipf_weights(n, skew):
+    """Накопленные веса распределения Ципфа: первые элементы встречаются чаще"""
+    total, cumulative = 0.0, []
+    for rank in range(1, n + 1):
+        total += 1 / rank ** skew
+        cumulative.append(total)
+    return cumulative
+
+
+class Command(BaseCommand):
+    help = (
+        "Создает пользователей со справочниками и переводами для нагрузочных тестов. "
+        "Распределения неравномерные: категории и пользователи по Ципфу, даты - "
+        "чаще недавние, суммы - логнормальные"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=3)
+        parser.add_argument('--prefix', default='bench', help="Префикс имен пользователей")
+        parser.add_argument('--password', default='bench', help="Пароль созданных пользователей")
+        parser.add_argument('--categories', type=int, default=200, help="Категорий на пользователя")
+        parser.add_argument('--subcategories', type=int, default=3, help="Подкатегорий на категорию")
+        parser.add_argument(
+            '--transfers', type=int, default=100_000,
+            help="Переводов у первого пользователя; у k-го - transfers / k^skew",
+        )
+        parser.add_argument('--skew', type=float, default=1.0, help="Показатель распределения Ципфа")
+        parser.add_argument('--days', type=int, default=730, help="Глубина истории в днях")
+        parser.add_argument('--method', choices=['copy', 'bulk'], default='copy',
+                            help="copy - COPY FROM STDIN и пересчет агрегатов, bulk - bulk_create")
+        parser.add_argument('--batch-size', type=int, default=100_000)
+        parser.add_argument('--seed', type=int, default=1)
+        parser.add_argument('--clear', action='store_true', help="Удалить пользователей с этим префиксом перед созданием")
+        parser.add_argument('--admin', action='store_true', help="Создать также суперпользователя <prefix>_admin")
+
+    def handle(self, *args, **options):
+        self.random = random.Random(options['seed'])
+        prefix = options['prefix']
+
+        existing = User.objects.filter(username__startswith=f'{prefix}_')
+        if existing.exists():
+            if not options['clear']:
+                raise CommandError(f"Пользователи {prefix}_* уже есть, используйте --clear")
+            with transaction.atomic():
+                MoneyTransfer.objects.filter(user__in=existing).delete()
+                existing.delete()
+
+        started = time.monotonic()
+        password = make_password(options['password'])
+        users = User.objects.bulk_create([
+            User(username=f'{prefix}_{n}', password=password) for n in range(1, options['users'] + 1)
+        ])
+        if options['admin']:
+            User.objects.create(username=f'{prefix}_admin', password=password, is_staff=True, is_superuser=True)
+        total = 0
+        for rank, user in enumerate(users, start=1):
+            count = max(1, int(options['transfers'] / rank ** options['skew']))
+            references = self.create_references(user, options['categories'], options['subcategories'])
+            self.create_transfers(user, references, count, options)
+            bump_version(REFERENCES, user.pk)
+            total += count
+            self.stdout.write(f"{user.username}: {count} переводов")
+
+        if options['method'] == 'copy':
+            self.stdout.write("Пересчет агрегатов...")
+            with transaction.atomic():
+                rollups.rebuild(TransferRecord.objects.all(), users)
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {MoneyTransfer._meta.db_table}")
+
+        elapsed = time.monotonic() - started
+        self.stdout.write(self.style.SUCCESS(
+            f"Создано {len(users)} пользователей и {total} переводов за {elapsed:.1f} с "
+            f"({total / elapsed:.0f} строк/с)"
+        ))
+
+    def create_references(self, user, categories, subcategories):
+        statuses = Status.objects.bulk_create([Status(user=user, name=name) for name in STATUS_NAMES])
+        types = OperationType.objects.bulk_create([OperationType(user=user, name=name) for name in TYPE_NAMES])
+        category_objs = Category.objects.bulk_create([
+            Category(user=user, name=f'{CATEGORY_NAMES[n % len(CATEGORY_NAMES)]} {n // len(CATEGORY_NAMES) + 1}')
+            for n in range(categories)
+        ])
+        subcategory_objs = Subcategory.objects.bulk_create([
+            Subcategory(user=user, category=category, name=f'{category.name}.{n + 1}')
+            for category in category_objs for n in range(subcategories)
+        ])
+        by_category = {}
+        for subcategory in subcategory_objs:
+            by_category.setdefault(subcategory.category_id, []).append(subcategory.pk)
+        return {
+            'statuses': [obj.pk for obj in statuses],
+            'types': [obj.pk for obj in types],
+            'categories': [obj.pk for obj in category_objs],
+            'subcategories': by_category,
+        }
+
+    def rows(self, user, references, count, days):
+        rnd = self.random
+        categories = references['categories']
+        subcategories = references['subcategories']
+        category_weights = zipf_weights(len(categories), 1.1)
+        status_weights = zipf_weights(len(references['statuses']), 2.5)
+        type_weights = zipf_weights(len(references['types']), 1.5)
+        now = timezone.now()
+        span = days * 86400
+
+        chosen_categories = rnd.choices(categories, cum_weights=category_weights, k=count)
+        chosen_statuses = rnd.choices(references['statuses'], cum_weights=status_weights, k=count)
+        chosen_types = rnd.choices(references['types'], cum_weights=type_weights, k=count)
+        for n in range(count):
+            category = chosen_categories[n]
+            # квадрат равномерного распределения: недавних операций больше
+            seconds_ago = int(span * rnd.random() ** 2)
+            yield (
+                user.pk,
+                now - timedelta(seconds=seconds_ago),
+                category,
+                rnd.choice(subcategories[category]),
+                chosen_statuses[n],
+                chosen_types[n],
+                # в копейках; валюта - рубль по умолчанию столбца
+                min(int(rnd.lognormvariate(7, 1.3) * MINOR_UNITS), SUMM_MAX),
+                rnd.choice(COMMENTS),
+            )
+
+    def create_transfers(self, user, references, count, options):
+        rows = self.rows(user, references, count, options['days'])
+        batch_size = options['batch_size']
+        if options['method'] == 'bulk':
+            batch = []
+            for row in rows:
+                batch.append(MoneyTransfer(**dict(zip(TRANSFER_COLUMNS, row))))
+                if len(batch) >= batch_size:
+                    MoneyTransfer.objects.bulk_create(batch, batch_size=5000)
+                    batch = []
+            MoneyTransfer.objects.bulk_create(batch, batch_size=5000)
+            return
+
+        columns = ', '.join(TRANSFER_COLUMNS)
+        sql = f"COPY {MoneyTransfer._meta.db_table} ({columns}) FROM STDIN"
+        buffer = io.StringIO()
+        written = 0
+        with transaction.atomic(), connection.cursor() as cursor:
+            # синтетические данные: не ждать сброса WAL на диск при коммите
+            cursor.execute("SET LOCAL synchronous_commit = off")
+            for row in rows:
+                buffer.write(
+                    f'{row[0]}\t{row[1].isoformat()}\t{row[2]}\t{row[3]}\t{row[4]}\t{row[5]}\t{row[6]}\t{row[7]}\n'
+                )
+                written += 1
+                if written % batch_size == 0:
+                    buffer.seek(0)
+                    cursor.copy_expert(sql, buffer)
+                    buffer = io.StringIO()
+            buffer.seek(0)
+            cursor.copy_expert(sql, buffer)
@@ -0,0 +1,45 @@
+from pathlib import Path
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+
+from main.importer import COLUMNS, READERS, TransferImporter
+
+
+class Command(BaseCommand):
+    help = (
+        "Импортирует переводы пользователя из CSV или JSONL. "
+        f"Поля: {', '.join(COLUMNS)}; справочники указываются названиями"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help="Путь к файлу")
+        parser.add_argument('--user', required=True, help="Имя пользователя")
+        parser.add_argument('--format', choices=sorted(READERS), help="Формат (по умолчанию - по расширению)")
+        parser.add_argument('--batch-size', type=int, default=1000, help="Строк в одной транзакции")
+        parser.add_argument('--encoding', default='utf-8-sig')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        fmt = options['format'] or path.suffix.lstrip('.').lower()
+        if fmt not in READERS:
+            raise CommandError(f"Неизвестный формат «{fmt}», укажите --format")
+        try:
+            user = User.objects.get(username=options['user'])
+        except User.DoesNotExist:
+            raise CommandError(f"Пользователь {options['user']} не найден")
+
+        importer = TransferImporter(user, batch_size=options['batch_size'])
+        with path.open(encoding=options['encoding'], newline='') as stream:
+            report = importer.run(stream, fmt, progress=self.progress)
+
+        for line, message in report.errors:
+            self.stderr.write(f"строка {line}: {message}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Прочитано {report.rows}, создано {report.created}, ошибок {report.rows - report.created} "
+            f"за {report.elapsed:.1f} с ({report.rows_per_second:.0f} строк/с)"
+        ))
+
+    def progress(self, report):
+        self.stdout.write(f"... {report.created} записано ({report.rows_per_second:.0f} строк/с)", ending='\r')
+        self.stdout.flush()
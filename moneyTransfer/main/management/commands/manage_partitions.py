@@ -0,0 +1,60 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from main import partitioning
+from main.filtering import parse_date
+
+
+class Command(BaseCommand):
+    help = (
+        "Обслуживает секции таблицы переводов: создает секции на месяцы вперед и "
+        "отсоединяет старые. Без параметров только создает недостающие секции"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help="Секционировать таблицу, если миграция 0008 прошла без TRANSFERS_PARTITIONING")
+        parser.add_argument('--ahead', type=int, default=partitioning.DEFAULT_AHEAD,
+                            help="На сколько месяцев вперед создать секции")
+        parser.add_argument('--detach-before', metavar='ГГГГ-ММ',
+                            help="Отсоединить секции месяцев раньше указанного")
+        parser.add_argument('--list', action='store_true', help="Показать секции")
+
+    def handle(self, *args, **options):
+        if options['convert']:
+            self.stdout.write("Секционирование таблицы переводов...")
+            if partitioning.convert(connection, options['ahead']):
+                self.stdout.write(self.style.SUCCESS("Таблица секционирована"))
+            else:
+                self.stdout.write("Таблица уже секционирована")
+
+        with connection.cursor() as cursor:
+            if not partitioning.is_partitioned(cursor):
+                raise CommandError("Таблица переводов не секционирована, см. --convert")
+
+        if options['list']:
+            with connection.cursor() as cursor:
+                for name, month, rows in partitioning.partitions(cursor):
+                    self.stdout.write(f"{name}: ~{rows} строк")
+            return
+
+        with transaction.atomic(), connection.cursor() as cursor:
+            for name in partitioning.create_ahead(cursor, options['ahead']):
+                self.stdout.write(f"Создана секция {name}")
+
+        if options['detach_before']:
+            before = parse_date(f"{options['detach_before']}-01")
+            if before is None:
+                raise CommandError("--detach-before ожидает месяц в виде ГГГГ-ММ")
+            with connection.cursor() as cursor:
+                old = [
+                    (name, month) for name, month, _ in partitioning.partitions(cursor)
+                    if month is not None and month < before
+                ]
+            for name, month in old:
+                # каждая секция - своя транзакция: отсоединение блокирует таблицу
+                with transaction.atomic(), connection.cursor() as cursor:
+                    partitioning.detach(cursor, month)
+                self.stdout.write(f"Отсоединена секция {name}")
+
+        self.stdout.write(self.style.SUCCESS("Готово"))
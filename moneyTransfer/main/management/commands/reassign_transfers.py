@@ -0,0 +1,102 @@
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from main import reassign
+from main.filtering import date_range, day_start
+from main.models import ReassignJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Массово меняет статус, тип, категорию или подкатегорию у переводов. "
+        "Новое значение задается названием и ищется у владельца каждого перевода; "
+        "переводы обрабатываются пачками, прерванное задание продолжается через --resume"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--field', choices=[name for name, _ in ReassignJob.FIELD_CHOICES])
+        parser.add_argument('--to', dest='target', help="Название нового значения")
+        parser.add_argument('--to-subcategory', default='', help="Подкатегория новой категории (для --field category)")
+        parser.add_argument('--user', action='append', dest='users', help="Имя пользователя (можно несколько раз)")
+        parser.add_argument('--from-id', action='append', type=int, dest='from_ids',
+                            help="id текущего значения поля (можно несколько раз)")
+        parser.add_argument('--from-name', help="Название текущего значения поля")
+        parser.add_argument('--date-from', help="Начальная дата, ГГГГ-ММ-ДД")
+        parser.add_argument('--date-to', help="Конечная дата включительно, ГГГГ-ММ-ДД")
+        parser.add_argument('--all', action='store_true', help="Разрешить выборку без фильтров")
+        parser.add_argument('--chunk-size', type=int, default=reassign.DEFAULT_CHUNK_SIZE)
+        parser.add_argument('--resume', type=int, metavar='JOB_ID', help="Продолжить задание")
+        parser.add_argument('--list', action='store_true', help="Показать незавершенные задания")
+
+    def handle(self, *args, **options):
+        if options['list']:
+            for job in ReassignJob.objects.exclude(state=ReassignJob.STATE_DONE).order_by('pk'):
+                self.stdout.write(f"#{job.pk} {job}")
+            return
+
+        if options['resume']:
+            try:
+                job = ReassignJob.objects.get(pk=options['resume'])
+            except ReassignJob.DoesNotExist:
+                raise CommandError(f"Задание {options['resume']} не найдено")
+        else:
+            job = self.create_job(options)
+        self.stdout.write(f"Задание #{job.pk}: {job.total} переводов")
+
+        started = time.monotonic()
+        processed = job.processed
+
+        def progress(job):
+            if job.state == ReassignJob.STATE_DONE:
+                return
+            elapsed = time.monotonic() - started
+            rate = (job.processed - processed) / elapsed if elapsed else 0
+            self.stdout.write(
+                f"{job.processed}/{job.total}: изменено {job.updated}, "
+                f"пропущено {job.skipped}, {rate:.0f} строк/с"
+            )
+
+        try:
+            job = reassign.run(job, chunk_size=options['chunk_size'], progress=progress)
+        except KeyboardInterrupt:
+            raise CommandError(f"Прервано; продолжить: manage.py reassign_transfers --resume {job.pk}")
+        message = f"Готово: изменено {job.updated}"
+        if job.skipped:
+            message += f", пропущено {job.skipped} (у владельца нет значения \"{job.target_name}\")"
+        self.stdout.write(self.style.SUCCESS(message))
+
+    def create_job(self, options):
+        field = options['field']
+        if not field or not options['target']:
+            raise CommandError("Нужны --field и --to (или --resume)")
+
+        selection = {}
+        if options['users']:
+            users = dict(User.objects.filter(username__in=options['users']).values_list('username', 'pk'))
+            missing = set(options['users']) - users.keys()
+            if missing:
+                raise CommandError(f"Пользователи не найдены: {', '.join(sorted(missing))}")
+            selection['users'] = sorted(users.values())
+        if options['from_ids']:
+            selection['from_ids'] = options['from_ids']
+        if options['from_name']:
+            selection['from_name'] = options['from_name']
+        if options['date_from'] or options['date_to']:
+            # границы сохраняются моментами времени: продолжение задания
+            # не зависит от часового пояса, в котором его запустили
+            tz = timezone.get_current_timezone()
+            start, end = date_range(options['date_from'], options['date_to'], tz=tz)
+            if start:
+                selection['date_gte'] = day_start(start, tz).isoformat()
+            if end:
+                selection['date_lt'] = day_start(end, tz).isoformat()
+        if not selection and not options['all']:
+            raise CommandError("Выборка не ограничена: задайте фильтры или --all")
+
+        try:
+            return reassign.create_job(selection, field, options['target'], options['to_subcategory'])
+        except reassign.ReassignError as e:
+            raise CommandError(str(e))
@@ -0,0 +1,34 @@
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from main import rollups
+from main.models import ArchivedTransfer, MoneyTransfer, TransferRecord
+
+
+class Command(BaseCommand):
+    help = "Пересчитывает таблицу дневных итогов TransferDailyRollup по переводам и их архиву"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', action='append', dest='users', help="Имя пользователя (можно несколько раз)")
+
+    def handle(self, *args, **options):
+        users = User.objects.order_by('pk')
+        if options['users']:
+            users = users.filter(username__in=options['users'])
+            missing = set(options['users']) - set(users.values_list('username', flat=True))
+            if missing:
+                raise CommandError(f"Пользователи не найдены: {', '.join(sorted(missing))}")
+
+        for user in users.iterator():
+            # SHARE-блокировка не дает записывать переводы, пока итоги пересчитываются
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    cursor.execute(
+                        f"LOCK TABLE {MoneyTransfer._meta.db_table}, {ArchivedTransfer._meta.db_table} IN SHARE MODE"
+                    )
+                # архивные переводы учитываются в итогах наравне с остальными
+                rollups.rebuild(TransferRecord.objects.all(), [user])
+            self.stdout.write(f"{user.username}: готово")
+
+        self.stdout.write(self.style.SUCCESS("Итоги пересчитаны"))
@@ -0,0 +1,236 @@
+import json
+import platform
+import statistics
+import subprocess
+import time
+from datetime import timedelta
+
+import django
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, reset_queries, transaction
+from django.db.models import Count
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from main.models import Category, MoneyTransfer, OperationType, Status, Subcategory
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        "Прогоняет страницы, API и админку с разными фильтрами от имени пользователя "
+        "и печатает JSON с перцентилями задержки и количеством запросов"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--user', help="Имя пользователя (по умолчанию - с наибольшим числом переводов)")
+        parser.add_argument('--admin', help="Суперпользователь для сценариев админки (по умолчанию - первый)")
+        parser.add_argument('--iterations', type=int, default=30)
+        parser.add_argument('--warmup', type=int, default=3)
+        parser.add_argument('--only', action='append', help="Запускать только сценарии, в имени которых есть подстрока")
+        parser.add_argument('--output', help="Файл для JSON (по умолчанию - stdout)")
+        parser.add_argument('--compare', help="JSON предыдущего запуска: напечатать изменение p50")
+
+    def handle(self, *args, **options):
+        user = self.get_user(options['user'])
+        admin = self.get_admin(options['admin'])
+
+        results = []
+        with override_settings(ALLOWED_HOSTS=[*settings.ALLOWED_HOSTS, 'testserver']):
+            for name, client_user, method, path, data in self.scenarios(user, admin):
+                if options['only'] and not any(part in name for part in options['only']):
+                    continue
+                # debug_toolbar включается по INTERNAL_IPS - запросы идут с другого адреса
+                client = Client(REMOTE_ADDR='10.0.0.1')
+                client.force_login(client_user)
+                result = self.measure(client, method, path, data, options['iterations'], options['warmup'])
+                result.update(name=name, method=method, path=path, params=data)
+                results.append(result)
+                self.stderr.write(
+                    f"{name}: p50 {result['p50_ms']} мс, p99 {result['p99_ms']} мс, "
+                    f"запросов {result['queries']}"
+                )
+
+        report = {
+            'started': timezone.now().isoformat(),
+            'environment': self.environment(user),
+            'results': results,
+        }
+        output = json.dumps(report, ensure_ascii=False, indent=2)
+        if options['output']:
+            with open(options['output'], 'w', encoding='utf-8') as f:
+                f.write(output)
+        else:
+            self.stdout.write(output)
+
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def get_user(self, username):
+        if username:
+            try:
+                return User.objects.get(username=username)
+            except User.DoesNotExist:
+                raise CommandError(f"Пользователь {username} не найден")
+        row = (
+            MoneyTransfer.objects.values('user').annotate(count=Count('id')).order_by('-count').first()
+        )
+        if row is None:
+            raise CommandError("Нет пользователей с переводами, см. generate_data")
+        return User.objects.get(pk=row['user'])
+
+    def get_admin(self, username):
+        admins = User.objects.filter(is_superuser=True, is_active=True)
+        if username:
+            admins = admins.filter(username=username)
+        return admins.order_by('pk').first()
+
+    def scenarios(self, user, admin):
+        """(имя, пользователь, метод, путь, параметры)"""
+        top = (
+            MoneyTransfer.objects.filter(user=user).values('category', 'subcategory', 'status', 'type')
+            .annotate(count=Count('id')).order_by('-count').first()
+        ) or {}
+        today = timezone.localdate()
+        month_ago = (today - timedelta(days=30)).isoformat()
+
+        scenarios = [
+            ('index', {}),
+            ('index_sum_asc', {'sum_order': 'asc'}),
+            ('index_sum_desc', {'sum_order': 'desc'}),
+            ('index_category', {'category': top.get('category')}),
+            ('index_subcategory', {'subcategory': top.get('subcategory')}),
+            ('index_status', {'status': top.get('status')}),
+            ('index_type', {'type': top.get('type')}),
+            ('index_date_range', {'date_from': month_ago, 'date_to': today.isoformat()}),
+            ('index_period_this_month', {'period': 'this_month'}),
+            ('index_category_period', {'category': top.get('category'), 'period': 'last_90_days'}),
+            ('index_per_page_100', {'per_page': 100}),
+            ('index_deep_page', {'page': 500}),
+            ('index_keyset', {'cursor': ''}),
+        ]
+        result = [(name, user, 'get', '/', params) for name, params in scenarios]
+
+        category = Category.objects.filter(user=user, pk=top.get('category')).first()
+        result += [
+            ('reference', user, 'get', '/reference/', {}),
+            ('reference_deep_page', user, 'get', '/reference/', {'cat_page': 20, 'sub_page': 60}),
+            ('transfer_add_form', user, 'get', '/transfer/add/', {}),
+        ]
+        if category:
+            result.append(('transfer_add_post', user, 'post', '/transfer/add/', {
+                'category': category.pk,
+                'subcategory': Subcategory.objects.filter(category=category).values_list('pk', flat=True).first(),
+                'status': Status.objects.filter(user=user).values_list('pk', flat=True).first(),
+                'type': OperationType.objects.filter(user=user).values_list('pk', flat=True).first(),
+                'summ': 100,
+                'comment': 'benchmark',
+            }))
+        result += [
+            ('api_transfers', user, 'get', '/api/transfers/', {}),
+            ('api_transfers_filtered', user, 'get', '/api/transfers/',
+             {'category': top.get('category'), 'period': 'last_90_days'}),
+            ('api_categories', user, 'get', '/api/categories/', {}),
+            ('export_csv_month', user, 'get', '/transfer/export/',
+             {'format': 'csv', 'subcategory': top.get('subcategory'), 'period': 'this_month'}),
+        ]
+        if admin:
+            result += [
+                ('admin_transfers', admin, 'get', '/admin/main/moneytransfer/', {}),
+                ('admin_transfers_search', admin, 'get', '/admin/main/moneytransfer/', {'q': 'договор'}),
+                ('admin_categories', admin, 'get', '/admin/main/category/', {}),
+                ('admin_subcategories', admin, 'get', '/admin/main/subcategory/', {}),
+                ('admin_statuses', admin, 'get', '/admin/main/status/', {}),
+            ]
+        return [
+            (name, client_user, method, path, {key: value for key, value in data.items() if value is not None})
+            for name, client_user, method, path, data in result
+        ]
+
+    def request(self, client, method, path, data):
+        # POST выполняется в транзакции с откатом, чтобы не менять данные между запусками
+        if method == 'post':
+            try:
+                with transaction.atomic():
+                    response = client.post(path, data)
+                    raise Rollback(response)
+            except Rollback as e:
+                return e.args[0]
+        response = client.get(path, data)
+        if response.streaming:
+            for _ in response.streaming_content:
+                pass
+        return response
+
+    def measure(self, client, method, path, data, iterations, warmup):
+        for _ in range(warmup):
+            self.request(client, method, path, data)
+
+        # запросы считаются отдельным прогоном: CaptureQueriesContext сам замедляет выполнение.
+        # request_started очищает журнал запросов, поэтому он очищается и до замера
+        reset_queries()
+        with CaptureQueriesContext(connection) as queries:
+            response = self.request(client, method, path, data)
+
+        timings = []
+        for _ in range(iterations):
+            started = time.perf_counter()
+            self.request(client, method, path, data)
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+
+        def percentile(p):
+            return round(timings[min(len(timings) - 1, int(len(timings) * p))], 2)
+
+        return {
+            'status': response.status_code,
+            'queries': len(queries),
+            'iterations': iterations,
+            'mean_ms': round(statistics.mean(timings), 2),
+            'min_ms': round(timings[0], 2),
+            'p50_ms': percentile(0.5),
+            'p90_ms': percentile(0.9),
+            'p99_ms': percentile(0.99),
+            'max_ms': round(timings[-1], 2),
+        }
+
+    def environment(self, user):
+        try:
+            commit = subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, timeout=5,
+            ).stdout.strip() or None
+        except OSError:
+            commit = None
+        with connection.cursor() as cursor:
+            cursor.execute("SELECT version()")
+            database = cursor.fetchone()[0]
+        return {
+            'commit': commit,
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'database': database,
+            'debug': settings.DEBUG,
+            'pagination': settings.TRANSFERS_PAGINATION,
+            'user': user.username,
+            'user_transfers': MoneyTransfer.objects.filter(user=user).count(),
+            'total_transfers': MoneyTransfer.objects.count(),
+        }
+
+    def compare(self, path, results):
+        with open(path, encoding='utf-8') as f:
+            previous = {item['name']: item for item in json.load(f)['results']}
+        for item in results:
+            before = previous.get(item['name'])
+            if not before:
+                continue
+            change = (item['p50_ms'] - before['p50_ms']) / before['p50_ms'] * 100 if before['p50_ms'] else 0
+            self.stderr.write(
+                f"{item['name']}: p50 {before['p50_ms']} -> {item['p50_ms']} мс ({change:+.0f}%), "
+                f"запросов {before['queries']} -> {item['queries']}"
+            )
@@ -0,0 +1,136 @@
+"""
+Объединение элементов справочника: все переводы статуса, типа, категории или
+подкатегории переходят на другой элемент того же пользователя, а опустевший
+удаляется.
+
+Переводы, архив и дневные агрегаты переносятся несколькими UPDATE по всей
+выборке в одной транзакции: строки не читаются в приложение, поэтому
+объединение элемента с миллионами переводов - это несколько запросов, а не
+миллионы. Счетчик transfer_count источника прибавляется к цели без пересчета.
+Источник блокируется FOR UPDATE: новые переводы не могут сослаться на него,
+пока объединение не закончится (проверка внешнего ключа ждет блокировку).
+
+У категории вместе с переводами переходят подкатегории: одноименные с
+подкатегориями цели объединяются с ними, остальные переносятся в цель.
+"""
+from django.db import connections, transaction
+from django.db.models import F
+
+from . import rollups
+from .caching import REFERENCES, bump_version
+from .models import (
+    ArchivedTransfer, Category, MoneyTransfer, OperationType, Status, Subcategory, TransferDailyRollup,
+)
+
+# вид справочника в адресах -> модель
+MODELS = {
+    'status': Status,
+    'type': OperationType,
+    'category': Category,
+    'subcategory': Subcategory,
+}
+
+
+class MergeError(Exception):
+    pass
+
+
+def merge(source, target, using='default'):
+    """Переносит переводы source в target и удаляет source; возвращает число перенесенных переводов"""
+    model = type(source)
+    if model not in MODELS.values() or type(target) is not model:
+        raise MergeError("Объединять можно только элементы одного справочника")
+    if source.pk == target.pk:
+        raise MergeError("Нельзя объединить элемент с самим собой")
+    if source.user_id != target.user_id:
+        raise MergeError("Элементы принадлежат разным пользователям")
+
+    with transaction.atomic(using=using):
+        locked = {
+            obj.pk: obj for obj in model.objects.using(using)
+            .select_for_update().filter(pk__in=[source.pk, target.pk]).order_by('pk')
+        }
+        if len(locked) < 2:
+            raise MergeError("Элемент уже удален")
+        source, target = locked[source.pk], locked[target.pk]
+
+        if model is Category:
+            merge_category(source, target, using)
+        elif model is Subcategory:
+            merge_subcategory(source, target, using)
+            if source.category_id != target.category_id:
+                # переводы перешли в категорию цели
+                move_count(Category, source.category_id, target.category_id, source.transfer_count, using)
+        else:
+            field = 'status_id' if model is Status else 'type_id'
+            move(field, source.pk, {field: target.pk}, using)
+            move_count(model, source.pk, target.pk, source.transfer_count, using)
+            source.delete(using=using)
+
+        rollups.touch([source.user_id], using=using)
+        bump_version(REFERENCES, source.user_id, using=using)
+    return source.transfer_count
+
+
+def merge_subcategory(source, target, using):
+    move('subcategory_id', source.pk, {'subcategory_id': target.pk, 'category_id': target.category_id}, using)
+    move_count(Subcategory, source.pk, target.pk, source.transfer_count, using)
+    source.delete(using=using)
+
+
+def merge_category(source, target, using):
+    twins = {obj.name: obj for obj in Subcategory.objects.using(using).filter(category=target)}
+    subcategories = list(
+        Subcategory.objects.using(using).select_for_update().filter(category=source).order_by('pk')
+    )
+    for subcategory in subcategories:
+        twin = twins.get(subcategory.name)
+        if twin is not None:
+            merge_subcategory(subcategory, twin, using)
+    # остальные подкатегории переходят в цель вместе со своими переводами
+    Subcategory.objects.using(using).filter(category=source).update(category=target)
+    move('category_id', source.pk, {'category_id': target.pk}, using)
+    move_count(Category, source.pk, target.pk, source.transfer_count, using)
+    source.delete(using=using)
+
+
+def move(field, source_id, values, using):
+    """Переводы, архив и агрегаты с field = source_id получают значения values"""
+    for model in (MoneyTransfer, ArchivedTransfer):
+        # _base_manager - обычный QuerySet.update: агрегаты переносятся ниже одним запросом
+        model._base_manager.using(using).filter(**{field: source_id}).update(**values)
+    move_rollups(field, source_id, values, using)
+
+
+def move_rollups(field, source_id, values, using):
+    """
+    Строки агрегатов источника складываются со строками цели по новому
+    ключу (INSERT ... SELECT ... ON CONFLICT) и удаляются
+    """
+    table = TransferDailyRollup._meta.db_table
+    columns = ', '.join(rollups.KEY_FIELDS)
+    selected = ', '.join('%s' if name in values else name for name in rollups.KEY_FIELDS)
+    groups = ', '.join(str(index) for index in range(1, len(rollups.KEY_FIELDS) + 1))
+    params = [values[name] for name in rollups.KEY_FIELDS if name in values]
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} ({columns}, summ_total, count)
+            SELECT {selected}, SUM(summ_total), SUM(count) FROM {table}
+            WHERE {field} = %s
+            GROUP BY {groups}
+            ON CONFLICT ({columns}) DO UPDATE SET
+                summ_total = {table}.summ_total + EXCLUDED.summ_total,
+                count = {table}.count + EXCLUDED.count
+            """,
+            [*params, source_id],
+        )
+        cursor.execute(f"DELETE FROM {table} WHERE {field} = %s", [source_id])
+
+
+def move_count(model, source_id, target_id, count, using):
+    if not count:
+        return
+    # в порядке id, как и в rollups.update_counters
+    for pk, delta in sorted([(source_id, -count), (target_id, count)]):
+        model.objects.using(using).filter(pk=pk).update(transfer_count=F('transfer_count') + delta)
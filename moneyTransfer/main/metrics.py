@@ -0,0 +1,359 @@
+"""
+Метрики запросов в текстовом формате Prometheus.
+
+Middleware замеряет время ответа, количество запросов к базе и время в базе
+для каждого имени URL. Запросы к базе считает обертка execute_wrappers,
+которая ставится на каждое соединение при его создании; данные текущего
+запроса она находит через contextvar, поэтому учитываются и запросы из
+потоков sync_to_async (см. views.index_async).
+
+Каждый процесс копит метрики в памяти, а фоновый поток раз в
+METRICS_FLUSH_INTERVAL секунд записывает их в свой файл в METRICS_DIR.
+Эндпоинт /metrics/ складывает файлы всех воркеров; файлы завершившихся процессов сливаются в один архивный,
+чтобы счетчики не уменьшались после перезапуска воркера. Без METRICS_DIR
+видны только метрики процесса, который отвечает на запрос.
+"""
+import atexit
+import contextvars
+import fcntl
+import json
+import os
+import threading
+import time
+from functools import partial
+
+from django.conf import settings
+
+# границы корзин гистограмм (значения <= границы)
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200)
+
+METRICS = {
+    'moneytransfer_http_requests_total': (
+        'counter', "Количество ответов по имени URL, методу и статусу", None,
+    ),
+    'moneytransfer_http_request_duration_seconds': (
+        'histogram', "Время ответа по имени URL", DURATION_BUCKETS,
+    ),
+    'moneytransfer_db_queries_per_request': (
+        'histogram', "Количество запросов к базе на один ответ", QUERY_BUCKETS,
+    ),
+    'moneytransfer_db_duration_seconds_total': (
+        'counter', "Суммарное время запросов к базе по имени URL", None,
+    ),
+}
+
+ARCHIVE_FILE = 'archive.json'
+LOCK_FILE = '.lock'
+UNRESOLVED_VIEW = '<unresolved>'
+
+_current = contextvars.ContextVar('metrics_request', default=None)
+
+
+class RequestStats:
+    """Запросы к базе одного HTTP-запроса"""
+    __slots__ = ('queries', 'db_time', 'lock')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        # запросы index_async идут из нескольких потоков одновременно
+        self.lock = threading.Lock()
+
+    def add(self, duration):
+        with self.lock:
+            self.queries += 1
+            self.db_time += duration
+
+
+def query_wrapper(execute, sql, params, many, context):
+    stats = _current.get()
+    if stats is None:
+        return execute(sql, params, many, context)
+    started = time.perf_counter()
+    try:
+        return execute(sql, params, many, context)
+    finally:
+        stats.add(time.perf_counter() - started)
+
+
+def install_query_wrapper(sender, connection, **kwargs):
+    """Обработчик connection_created: список оберток живет в объекте соединения"""
+    if query_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(query_wrapper)
+
+
+def _bucket(value, bounds):
+    for index, bound in enumerate(bounds):
+        if value <= bound:
+            return index
+    return len(bounds)
+
+
+class Registry:
+    """
+    Метрики процесса: {(имя, метки): значение}. Значение счетчика - число,
+    гистограммы - [счетчики корзин..., +Inf, сумма]; корзины не накопленные,
+    накопление делается при выводе.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.samples = {}
+
+    def inc(self, name, labels, value=1):
+        key = (name, labels)
+        with self.lock:
+            self.samples[key] = self.samples.get(key, 0) + value
+
+    def observe(self, name, labels, value):
+        bounds = METRICS[name][2]
+        key = (name, labels)
+        with self.lock:
+            sample = self.samples.get(key)
+            if sample is None:
+                sample = self.samples[key] = [0] * (len(bounds) + 2)
+            sample[_bucket(value, bounds)] += 1
+            sample[-1] += value
+
+    def dump(self):
+        with self.lock:
+            return [
+                [name, list(labels), list(value) if isinstance(value, list) else value]
+                for (name, labels), value in self.samples.items()
+            ]
+
+
+registry = Registry()
+
+
+def record(view, method, status, duration, stats):
+    registry.inc('moneytransfer_http_requests_total', (view, method, str(status)))
+    registry.observe('moneytransfer_http_request_duration_seconds', (view,), duration)
+    registry.observe('moneytransfer_db_queries_per_request', (view,), stats.queries)
+    registry.inc('moneytransfer_db_duration_seconds_total', (view,), stats.db_time)
+    start_flusher()
+
+
+def merge(total, samples):
+    for name, labels, value in samples:
+        if name not in METRICS:
+            continue
+        key = (name, tuple(labels))
+        current = total.get(key)
+        if current is None:
+            total[key] = list(value) if isinstance(value, list) else value
+        elif isinstance(current, list):
+            if len(current) == len(value):
+                total[key] = [a + b for a, b in zip(current, value)]
+        else:
+            total[key] = current + value
+    return total
+
+
+# Файлы процессов
+
+# время старта в имени: pid может достаться новому процессу раньше,
+# чем файл старого будет слит в архив
+_process_file = f'{os.getpid()}-{time.time_ns()}.json'
+_flush_lock = threading.Lock()
+
+
+def _process_path(directory):
+    # после fork у дочернего процесса свой pid и свой файл
+    global _process_file
+    if not _process_file.startswith(f'{os.getpid()}-'):
+        _process_file = f'{os.getpid()}-{time.time_ns()}.json'
+    return os.path.join(directory, _process_file)
+
+
+def _write_json(path, data):
+    tmp = f'{path}.tmp'
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(data, f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(tmp, path)
+
+
+def _read_json(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def flush():
+    directory = settings.METRICS_DIR
+    if not directory:
+        return
+    # один поток пишет, остальные не ждут
+    if not _flush_lock.acquire(blocking=False):
+        return
+    try:
+        os.makedirs(directory, exist_ok=True)
+        _write_json(_process_path(directory), registry.dump())
+    finally:
+        _flush_lock.release()
+
+
+def _flush_periodically():
+    while True:
+        time.sleep(settings.METRICS_FLUSH_INTERVAL)
+        flush()
+
+
+_flusher_pid = None
+_flusher_lock = threading.Lock()
+
+
+def start_flusher():
+    """Фоновая запись: метрики простаивающего воркера не должны отставать"""
+    global _flusher_pid
+    if not settings.METRICS_DIR or _flusher_pid == os.getpid():
+        return
+    with _flusher_lock:
+        if _flusher_pid != os.getpid():
+            _flusher_pid = os.getpid()
+            threading.Thread(target=_flush_periodically, name='metrics-flush', daemon=True).start()
+
+
+atexit.register(flush)
+
+
+def _is_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def collect():
+    """Сумма метрик всех процессов"""
+    directory = settings.METRICS_DIR
+    if not directory:
+        return merge({}, registry.dump())
+
+    flush()
+    os.makedirs(directory, exist_ok=True)
+    with open(os.path.join(directory, LOCK_FILE), 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        archive_path = os.path.join(directory, ARCHIVE_FILE)
+        archive = merge({}, _read_json(archive_path))
+        total = {}
+        dead = []
+        for filename in os.listdir(directory):
+            pid = filename.split('-', 1)[0]
+            if not filename.endswith('.json') or not pid.isdigit():
+                continue
+            path = os.path.join(directory, filename)
+            if _is_alive(int(pid)):
+                merge(total, _read_json(path))
+            else:
+                merge(archive, _read_json(path))
+                dead.append(path)
+        if dead:
+            _write_json(archive_path, [[name, list(labels), value] for (name, labels), value in archive.items()])
+            for path in dead:
+                os.remove(path)
+    return merge(total, [[name, list(labels), value] for (name, labels), value in archive.items()])
+
+
+# Текстовый формат
+
+LABEL_NAMES = {
+    'moneytransfer_http_requests_total': ('view', 'method', 'status'),
+    'moneytransfer_http_request_duration_seconds': ('view',),
+    'moneytransfer_db_queries_per_request': ('view',),
+    'moneytransfer_db_duration_seconds_total': ('view',),
+}
+
+
+def _escape(value):
+    return value.replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    return '{' + ','.join(f'{name}="{_escape(str(value))}"' for name, value in pairs) + '}'
+
+
+def _number(value):
+    if isinstance(value, float):
+        return repr(round(value, 6))
+    return str(value)
+
+
+def render(samples):
+    lines = []
+    for name, (kind, help_text, bounds) in METRICS.items():
+        lines.append(f'# HELP {name} {help_text}')
+        lines.append(f'# TYPE {name} {kind}')
+        label_names = LABEL_NAMES[name]
+        for (sample_name, labels), value in sorted(samples.items()):
+            if sample_name != name:
+                continue
+            if kind == 'counter':
+                lines.append(f'{name}{_labels(label_names, labels)} {_number(value)}')
+                continue
+            cumulative = 0
+            for bound, count in zip((*bounds, '+Inf'), value):
+                cumulative += count
+                le = bound if bound == '+Inf' else _number(float(bound))
+                lines.append(f'{name}_bucket{_labels(label_names, labels, [("le", le)])} {cumulative}')
+            lines.append(f'{name}_sum{_labels(label_names, labels)} {_number(value[-1])}')
+            lines.append(f'{name}_count{_labels(label_names, labels)} {cumulative}')
+    return '\n'.join(lines) + '\n'
+
+
+# Middleware
+
+def _view_name(request):
+    match = getattr(request, 'resolver_match', None)
+    return match.view_name if match else UNRESOLVED_VIEW
+
+
+class RequestTimer:
+    def __init__(self, request):
+        self.request = request
+        self.started = time.perf_counter()
+        self.stats = RequestStats()
+        # не сбрасывается после ответа: содержимое потокового ответа
+        # формируется уже после выхода из middleware
+        _current.set(self.stats)
+
+    def finish(self, response):
+        record(
+            _view_name(self.request), self.request.method, response.status_code,
+            time.perf_counter() - self.started, self.stats,
+        )
+
+
+def _observe_stream(content, done):
+    try:
+        yield from content
+    finally:
+        done()
+
+
+async def _observe_async_stream(content, done):
+    try:
+        async for chunk in content:
+            yield chunk
+    finally:
+        done()
+
+
+def finish_response(timer, response):
+    if not response.streaming:
+        timer.finish(response)
+        return response
+    # выгрузка идет, пока клиент читает ответ: замер заканчивается вместе с ней
+    done = partial(timer.finish, response)
+    if response.is_async:
+        response.streaming_content = _observe_async_stream(response.streaming_content, done)
+    else:
+        response.streaming_content = _observe_stream(response.streaming_content, done)
+    return response
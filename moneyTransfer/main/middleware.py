@@ -0,0 +1,56 @@
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+
+from asgiref.sync import iscoroutinefunction
+from django.utils import timezone
+from django.utils.decorators import sync_and_async_middleware
+
+from . import metrics
+
+# cookie выставляет base.html из Intl.DateTimeFormat
+TIMEZONE_COOKIE = 'tz'
+
+
+def get_request_timezone(request):
+    name = request.COOKIES.get(TIMEZONE_COOKIE)
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError):
+        return None
+
+
+def activate_request_timezone(request):
+    tz = get_request_timezone(request)
+    if tz:
+        timezone.activate(tz)
+    else:
+        timezone.deactivate()
+
+
+@sync_and_async_middleware
+def user_timezone_middleware(get_response):
+    """Включает часовой пояс браузера: по нему считаются границы дней в фильтрах"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            activate_request_timezone(request)
+            return await get_response(request)
+    else:
+        def middleware(request):
+            activate_request_timezone(request)
+            return get_response(request)
+    return middleware
+
+
+@sync_and_async_middleware
+def request_metrics_middleware(get_response):
+    """Время ответа и запросы к базе по имени URL, см. main.metrics"""
+    if iscoroutinefunction(get_response):
+        async def middleware(request):
+            timer = metrics.RequestTimer(request)
+            return metrics.finish_response(timer, await get_response(request))
+    else:
+        def middleware(request):
+            timer = metrics.RequestTimer(request)
+            return metrics.finish_response(timer, get_response(request))
+    return middleware
@@ -0,0 +1,40 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:46
+
+import django.db.models.deletion
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    # индексы строятся CONCURRENTLY, чтобы не блокировать запись в большую таблицу
+    atomic = False
+
+    dependencies = [
+        ('main', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='moneytransfer',
+            name='user',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь'),
+        ),
+        AddIndexConcurrently(
+            model_name='moneytransfer',
+            index=models.Index(fields=['user', '-date_add', '-id'], include=('summ', 'category', 'subcategory', 'status', 'type'), name='mt_user_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='moneytransfer',
+            index=models.Index(fields=['user', 'summ', 'id'], name='mt_user_summ_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='moneytransfer',
+            index=models.Index(fields=['user', 'category', '-date_add', '-id'], name='mt_user_cat_date_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='moneytransfer',
+            index=models.Index(fields=['user', 'subcategory', '-date_add', '-id'], name='mt_user_subcat_date_idx'),
+        ),
+    ]
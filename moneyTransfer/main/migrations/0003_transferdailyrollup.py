@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def fill_rollups(apps, schema_editor):
+    MoneyTransfer = apps.get_model('main', 'MoneyTransfer')
+    TransferDailyRollup = apps.get_model('main', 'TransferDailyRollup')
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {TransferDailyRollup._meta.db_table}
+                (user_id, day, category_id, subcategory_id, status_id, type_id, summ_total, count)
+            SELECT user_id, (date_add AT TIME ZONE %s)::date, category_id, subcategory_id, status_id, type_id,
+                   SUM(summ), COUNT(*)
+            FROM {MoneyTransfer._meta.db_table}
+            GROUP BY 1, 2, 3, 4, 5, 6
+            """,
+            [settings.TIME_ZONE],
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_moneytransfer_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TransferDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('day', models.DateField(verbose_name='День')),
+                ('summ_total', models.BigIntegerField(default=0, verbose_name='Сумма')),
+                ('count', models.BigIntegerField(default=0, verbose_name='Количество')),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.category', verbose_name='Категория')),
+                ('status', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.status', verbose_name='Статус')),
+                ('subcategory', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.subcategory', verbose_name='Подкатегория')),
+                ('type', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.operationtype', verbose_name='Тип')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Дневной итог',
+                'verbose_name_plural': 'Дневные итоги',
+                'constraints': [models.UniqueConstraint(fields=('user', 'day', 'category', 'subcategory', 'status', 'type'), name='rollup_key')],
+            },
+        ),
+        migrations.RunPython(fill_rollups, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.8 on 2026-10-18 18:52
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0003_transferdailyrollup'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='moneytransfer',
+            name='date_add',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False, verbose_name='Время создания записи'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:28
+
+from django.contrib.postgres.indexes import BrinIndex
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.conf import settings
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # индекс строится CONCURRENTLY, чтобы не блокировать запись в большую таблицу
+    atomic = False
+
+    dependencies = [
+        ('main', '0004_moneytransfer_date_add_default'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='moneytransfer',
+            index=BrinIndex(fields=['date_add'], name='mt_date_brin'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:29
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_moneytransfer_date_brin'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReassignJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('field', models.CharField(choices=[('status', 'Статус'), ('type', 'Тип'), ('category', 'Категория'), ('subcategory', 'Подкатегория')], max_length=20, verbose_name='Поле')),
+                ('target_name', models.CharField(max_length=255, verbose_name='Новое значение')),
+                ('subcategory_name', models.CharField(blank=True, max_length=255, verbose_name='Новая подкатегория')),
+                ('selection', models.JSONField(verbose_name='Выборка')),
+                ('state', models.CharField(choices=[('pending', 'Ожидает'), ('running', 'Выполняется'), ('done', 'Завершено')], default='pending', max_length=20, verbose_name='Состояние')),
+                ('last_id', models.BigIntegerField(default=0, verbose_name='Последний id')),
+                ('total', models.BigIntegerField(default=0, verbose_name='Всего')),
+                ('processed', models.BigIntegerField(default=0, verbose_name='Обработано')),
+                ('updated', models.BigIntegerField(default=0, verbose_name='Изменено')),
+                ('skipped', models.BigIntegerField(default=0, verbose_name='Пропущено')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создано')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Завершено')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL, verbose_name='Создал')),
+            ],
+            options={
+                'verbose_name': 'Массовое переназначение',
+                'verbose_name_plural': 'Массовые переназначения',
+            },
+        ),
+    ]
@@ -0,0 +1,81 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:32
+
+import django.contrib.postgres.search
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.operations import AddIndexConcurrently, BtreeGinExtension, TrigramExtension
+from django.db import migrations, models
+from django.db.models.functions import Upper
+
+# конфигурация должна совпадать с main.filtering.SEARCH_CONFIG
+CREATE_TRIGGER = """
+CREATE FUNCTION main_moneytransfer_search_vector() RETURNS trigger AS $$
+BEGIN
+    NEW.search_vector := to_tsvector('russian', COALESCE(NEW.comment, ''));
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+
+CREATE TRIGGER main_moneytransfer_search_vector
+    BEFORE INSERT OR UPDATE OF comment ON main_moneytransfer
+    FOR EACH ROW EXECUTE FUNCTION main_moneytransfer_search_vector();
+"""
+
+DROP_TRIGGER = """
+DROP TRIGGER IF EXISTS main_moneytransfer_search_vector ON main_moneytransfer;
+DROP FUNCTION IF EXISTS main_moneytransfer_search_vector();
+"""
+
+BATCH_SIZE = 50000
+
+
+def fill_search_vector(apps, schema_editor):
+    # существующие строки - диапазонами id, каждый в своей транзакции,
+    # чтобы не держать блокировки на всю таблицу
+    MoneyTransfer = apps.get_model('main', 'MoneyTransfer')
+    bounds = MoneyTransfer.objects.aggregate(low=models.Min('pk'), high=models.Max('pk'))
+    if bounds['low'] is None:
+        return
+    with schema_editor.connection.cursor() as cursor:
+        for start in range(bounds['low'], bounds['high'] + 1, BATCH_SIZE):
+            cursor.execute(
+                """
+                UPDATE main_moneytransfer
+                SET search_vector = to_tsvector('russian', COALESCE(comment, ''))
+                WHERE id >= %s AND id < %s AND search_vector IS NULL
+                """,
+                [start, start + BATCH_SIZE],
+            )
+
+
+class Migration(migrations.Migration):
+    # индексы строятся CONCURRENTLY, заполнение идет пачками вне общей транзакции
+    atomic = False
+
+    dependencies = [
+        ('main', '0006_reassignjob'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        BtreeGinExtension(),
+        TrigramExtension(),
+        migrations.AddField(
+            model_name='moneytransfer',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.RunSQL(CREATE_TRIGGER, DROP_TRIGGER),
+        migrations.RunPython(fill_search_vector, migrations.RunPython.noop, elidable=True),
+        AddIndexConcurrently(
+            model_name='moneytransfer',
+            index=GinIndex(fields=['user', 'search_vector'], name='mt_user_search_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='moneytransfer',
+            index=GinIndex(
+                models.F('user'), OpClass(Upper('comment'), name='gin_trgm_ops'),
+                name='mt_user_comment_trgm_idx',
+            ),
+        ),
+    ]
@@ -0,0 +1,22 @@
+from django.conf import settings
+from django.db import migrations
+
+from main import partitioning
+
+
+def partition_transfers(apps, schema_editor):
+    # секционирование включается явно: без настройки таблица остается обычной,
+    # и ее можно секционировать позже командой manage_partitions --convert
+    if settings.TRANSFERS_PARTITIONING:
+        partitioning.convert(schema_editor.connection)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_moneytransfer_search'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_transfers, migrations.RunPython.noop),
+    ]
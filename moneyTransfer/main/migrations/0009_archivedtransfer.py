@@ -0,0 +1,67 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:43
+
+import django.contrib.postgres.search
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+# поиск по архивным строкам без сохраненного вектора; конфигурация должна
+# совпадать с main.filtering.SEARCH_CONFIG
+CREATE_VIEW = """
+CREATE VIEW main_transferrecord AS
+SELECT id, user_id, date_add, status_id, type_id, category_id, subcategory_id,
+       summ, comment, search_vector, false AS archived
+FROM main_moneytransfer
+UNION ALL
+SELECT id, user_id, date_add, status_id, type_id, category_id, subcategory_id,
+       summ, comment, to_tsvector('russian', comment), true
+FROM main_archivedtransfer
+"""
+
+DROP_VIEW = "DROP VIEW IF EXISTS main_transferrecord"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0008_moneytransfer_partitioning'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ArchivedTransfer',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('date_add', models.DateTimeField(verbose_name='Время создания записи')),
+                ('summ', models.IntegerField(verbose_name='Сумма')),
+                ('comment', models.TextField(blank=True, verbose_name='Комментарий')),
+                ('category', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='main.category', verbose_name='Категория')),
+                ('status', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='main.status', verbose_name='Статус')),
+                ('subcategory', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='main.subcategory', verbose_name='Подкатегория')),
+                ('type', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.PROTECT, related_name='+', to='main.operationtype', verbose_name='Тип')),
+                ('user', models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Архивный перевод',
+                'verbose_name_plural': 'Архив переводов',
+                'indexes': [models.Index(fields=['user', '-date_add', '-id'], name='archive_user_date_idx'), models.Index(fields=['user', 'summ', 'id'], name='archive_user_summ_idx')],
+            },
+        ),
+        migrations.RunSQL(CREATE_VIEW, DROP_VIEW),
+        migrations.CreateModel(
+            name='TransferRecord',
+            fields=[
+                ('id', models.BigIntegerField(primary_key=True, serialize=False)),
+                ('date_add', models.DateTimeField(verbose_name='Время создания записи')),
+                ('summ', models.IntegerField(verbose_name='Сумма')),
+                ('comment', models.TextField(blank=True, verbose_name='Комментарий')),
+                ('search_vector', django.contrib.postgres.search.SearchVectorField(null=True)),
+                ('archived', models.BooleanField()),
+            ],
+            options={
+                'db_table': 'main_transferrecord',
+                'managed': False,
+            },
+        ),
+    ]
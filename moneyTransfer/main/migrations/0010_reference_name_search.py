@@ -0,0 +1,34 @@
+# Generated by Django 5.2.8 on 2026-10-18 19:50
+
+from django.conf import settings
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+from django.db.models.functions import Upper
+
+
+class Migration(migrations.Migration):
+    # индексы строятся CONCURRENTLY; btree_gin и pg_trgm подключены в 0007
+    atomic = False
+
+    dependencies = [
+        ('main', '0009_archivedtransfer'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='category',
+            index=GinIndex(
+                models.F('user'), OpClass(Upper('name'), name='gin_trgm_ops'),
+                name='category_user_name_trgm_idx',
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name='subcategory',
+            index=GinIndex(
+                models.F('user'), OpClass(Upper('name'), name='gin_trgm_ops'),
+                name='subcategory_user_name_trgm_idx',
+            ),
+        ),
+    ]
@@ -0,0 +1,154 @@
+# Generated by Django 5.2.8 on 2026-10-18 20:05
+
+from django.conf import settings
+from django.db import migrations, models
+
+CURRENCY_CHOICES = [
+    ('RUB', 'RUB - Российский рубль'), ('USD', 'USD - Доллар США'), ('EUR', 'EUR - Евро'),
+    ('CNY', 'CNY - Китайский юань'), ('KZT', 'KZT - Казахстанский тенге'), ('BYN', 'BYN - Белорусский рубль'),
+]
+
+# Первая часть перехода на копейки, без долгих блокировок: рядом с summ
+# появляется bigint-столбец summ_minor, который заполняют пачки и триггер
+# (для строк, записанных во время миграции), а индексы по нему строятся
+# CONCURRENTLY. Столбцы меняются местами в 0012 - коротко, без перезаписи таблицы
+TABLES = ('main_moneytransfer', 'main_archivedtransfer')
+
+ADD_COLUMNS = """
+CREATE FUNCTION main_summ_minor() RETURNS trigger AS $$
+BEGIN
+    NEW.summ_minor := NEW.summ::bigint * 100;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+""" + ''.join(
+    f"""
+ALTER TABLE {table} ADD COLUMN summ_minor bigint;
+CREATE TRIGGER {table}_summ_minor
+    BEFORE INSERT OR UPDATE OF summ ON {table}
+    FOR EACH ROW EXECUTE FUNCTION main_summ_minor();
+"""
+    for table in TABLES
+)
+
+DROP_COLUMNS = ''.join(
+    f"""
+DROP TRIGGER IF EXISTS {table}_summ_minor ON {table};
+ALTER TABLE {table} DROP COLUMN IF EXISTS summ_minor;
+"""
+    for table in TABLES
+) + "DROP FUNCTION IF EXISTS main_summ_minor();"
+
+# индексы с summ повторяются для summ_minor и в 0012 получают прежние имена
+INDEXES = [
+    ('main_moneytransfer', 'mt_user_date_minor_idx',
+     '(user_id, date_add DESC, id DESC) INCLUDE (summ_minor, category_id, subcategory_id, status_id, type_id)'),
+    ('main_moneytransfer', 'mt_user_summ_minor_idx', '(user_id, summ_minor, id)'),
+    ('main_archivedtransfer', 'archive_user_summ_minor_idx', '(user_id, summ_minor, id)'),
+]
+
+BATCH_SIZE = 50000
+
+
+def fill_summ_minor(apps, schema_editor):
+    # диапазонами id, каждый в своей транзакции, как в 0007
+    with schema_editor.connection.cursor() as cursor:
+        for table in TABLES:
+            cursor.execute(f"SELECT min(id), max(id) FROM {table}")
+            low, high = cursor.fetchone()
+            if low is None:
+                continue
+            for start in range(low, high + 1, BATCH_SIZE):
+                cursor.execute(
+                    f"""
+                    UPDATE {table} SET summ_minor = summ::bigint * 100
+                    WHERE id >= %s AND id < %s AND summ_minor IS NULL
+                    """,
+                    [start, start + BATCH_SIZE],
+                )
+
+
+def create_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for table, name, columns in INDEXES:
+            cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [table])
+            if cursor.fetchone()[0] != 'p':
+                cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {table} {columns}")
+                continue
+            # у секционированной таблицы (0008) CONCURRENTLY строятся индексы
+            # секций, а индекс родителя становится действительным, когда
+            # к нему присоединены все
+            cursor.execute(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} {columns}")
+            cursor.execute(
+                "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid "
+                "WHERE i.inhparent = to_regclass(%s) ORDER BY c.relname",
+                [table],
+            )
+            for (partition,) in cursor.fetchall():
+                child = f'{partition}_{name}'
+                cursor.execute(f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child} ON {partition} {columns}")
+                cursor.execute(f"ALTER INDEX {name} ATTACH PARTITION {child}")
+
+
+def drop_indexes(apps, schema_editor):
+    with schema_editor.connection.cursor() as cursor:
+        for _, name, _ in INDEXES:
+            cursor.execute(f"DROP INDEX IF EXISTS {name}")
+
+
+# NOT NULL в 0012 ставится без проверки таблицы по уже проверенному ограничению;
+# VALIDATE не блокирует запись
+VALIDATE = ''.join(
+    f"""
+ALTER TABLE {table} ADD CONSTRAINT {table}_summ_minor_not_null CHECK (summ_minor IS NOT NULL) NOT VALID;
+ALTER TABLE {table} VALIDATE CONSTRAINT {table}_summ_minor_not_null;
+"""
+    for table in TABLES
+)
+
+DROP_VALIDATE = ''.join(
+    f"ALTER TABLE {table} DROP CONSTRAINT IF EXISTS {table}_summ_minor_not_null;\n"
+    for table in TABLES
+)
+
+
+class Migration(migrations.Migration):
+    # заполнение пачками и индексы CONCURRENTLY - вне общей транзакции
+    atomic = False
+
+    dependencies = [
+        ('main', '0010_reference_name_search'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(choices=CURRENCY_CHOICES, max_length=3, verbose_name='Валюта')),
+                ('date', models.DateField(verbose_name='Дата')),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18, verbose_name='Рублей за единицу')),
+            ],
+            options={
+                'verbose_name': 'Курс валюты',
+                'verbose_name_plural': 'Курсы валют',
+                'constraints': [models.UniqueConstraint(fields=('currency', 'date'), name='exchange_rate_key')],
+            },
+        ),
+        # постоянное значение по умолчанию: столбец добавляется без перезаписи таблицы
+        migrations.AddField(
+            model_name='moneytransfer',
+            name='currency',
+            field=models.CharField(choices=CURRENCY_CHOICES, db_default='RUB', default='RUB', max_length=3, verbose_name='Валюта'),
+        ),
+        migrations.AddField(
+            model_name='archivedtransfer',
+            name='currency',
+            field=models.CharField(choices=CURRENCY_CHOICES, db_default='RUB', default='RUB', max_length=3, verbose_name='Валюта'),
+        ),
+        migrations.RunSQL(ADD_COLUMNS, DROP_COLUMNS),
+        migrations.RunPython(fill_summ_minor, migrations.RunPython.noop, elidable=True),
+        migrations.RunPython(create_indexes, drop_indexes),
+        migrations.RunSQL(VALIDATE, DROP_VALIDATE),
+    ]
@@ -0,0 +1,159 @@
+from django.db import migrations, models
+
+CURRENCY_CHOICES = [
+    ('RUB', 'RUB - Российский рубль'), ('USD', 'USD - Доллар США'), ('EUR', 'EUR - Евро'),
+    ('CNY', 'CNY - Китайский юань'), ('KZT', 'KZT - Казахстанский тенге'), ('BYN', 'BYN - Белорусский рубль'),
+]
+
+# Вторая часть перехода на копейки (первая - 0011): заполненный summ_minor
+# занимает место summ. Только изменения каталога и UPDATE небольшой таблицы
+# агрегатов, поэтому таблицы переводов блокируются ненадолго
+SWAP = """
+DROP TRIGGER main_moneytransfer_summ_minor ON main_moneytransfer;
+DROP TRIGGER main_archivedtransfer_summ_minor ON main_archivedtransfer;
+DROP FUNCTION main_summ_minor();
+
+UPDATE main_transferdailyrollup SET summ_total = summ_total * 100;
+
+-- вместе со столбцом удаляются индексы mt_user_date_idx, mt_user_summ_idx и archive_user_summ_idx
+ALTER TABLE main_moneytransfer DROP COLUMN summ;
+ALTER TABLE main_moneytransfer RENAME COLUMN summ_minor TO summ;
+ALTER TABLE main_moneytransfer ALTER COLUMN summ SET NOT NULL;
+ALTER TABLE main_moneytransfer DROP CONSTRAINT main_moneytransfer_summ_minor_not_null;
+ALTER INDEX mt_user_date_minor_idx RENAME TO mt_user_date_idx;
+ALTER INDEX mt_user_summ_minor_idx RENAME TO mt_user_summ_idx;
+
+ALTER TABLE main_archivedtransfer DROP COLUMN summ;
+ALTER TABLE main_archivedtransfer RENAME COLUMN summ_minor TO summ;
+ALTER TABLE main_archivedtransfer ALTER COLUMN summ SET NOT NULL;
+ALTER TABLE main_archivedtransfer DROP CONSTRAINT main_archivedtransfer_summ_minor_not_null;
+ALTER INDEX archive_user_summ_minor_idx RENAME TO archive_user_summ_idx;
+"""
+
+# откат возвращает состояние после 0011 и перезаписывает таблицы целиком
+UNSWAP = """
+UPDATE main_transferdailyrollup SET summ_total = round(summ_total / 100.0);
+
+ALTER TABLE main_moneytransfer RENAME COLUMN summ TO summ_minor;
+ALTER TABLE main_moneytransfer ALTER COLUMN summ_minor DROP NOT NULL;
+ALTER INDEX mt_user_date_idx RENAME TO mt_user_date_minor_idx;
+ALTER INDEX mt_user_summ_idx RENAME TO mt_user_summ_minor_idx;
+ALTER TABLE main_moneytransfer ADD COLUMN summ integer;
+UPDATE main_moneytransfer SET summ = round(summ_minor / 100.0);
+ALTER TABLE main_moneytransfer ALTER COLUMN summ SET NOT NULL;
+ALTER TABLE main_moneytransfer ADD CONSTRAINT main_moneytransfer_summ_minor_not_null CHECK (summ_minor IS NOT NULL);
+CREATE INDEX mt_user_date_idx ON main_moneytransfer
+    (user_id, date_add DESC, id DESC) INCLUDE (summ, category_id, subcategory_id, status_id, type_id);
+CREATE INDEX mt_user_summ_idx ON main_moneytransfer (user_id, summ, id);
+
+ALTER TABLE main_archivedtransfer RENAME COLUMN summ TO summ_minor;
+ALTER TABLE main_archivedtransfer ALTER COLUMN summ_minor DROP NOT NULL;
+ALTER INDEX archive_user_summ_idx RENAME TO archive_user_summ_minor_idx;
+ALTER TABLE main_archivedtransfer ADD COLUMN summ integer;
+UPDATE main_archivedtransfer SET summ = round(summ_minor / 100.0);
+ALTER TABLE main_archivedtransfer ALTER COLUMN summ SET NOT NULL;
+ALTER TABLE main_archivedtransfer ADD CONSTRAINT main_archivedtransfer_summ_minor_not_null CHECK (summ_minor IS NOT NULL);
+CREATE INDEX archive_user_summ_idx ON main_archivedtransfer (user_id, summ, id);
+
+CREATE FUNCTION main_summ_minor() RETURNS trigger AS $$
+BEGIN
+    NEW.summ_minor := NEW.summ::bigint * 100;
+    RETURN NEW;
+END
+$$ LANGUAGE plpgsql;
+CREATE TRIGGER main_moneytransfer_summ_minor
+    BEFORE INSERT OR UPDATE OF summ ON main_moneytransfer
+    FOR EACH ROW EXECUTE FUNCTION main_summ_minor();
+CREATE TRIGGER main_archivedtransfer_summ_minor
+    BEFORE INSERT OR UPDATE OF summ ON main_archivedtransfer
+    FOR EACH ROW EXECUTE FUNCTION main_summ_minor();
+"""
+
+# агрегаты без валюты: строки разных валют складываются, как считал прежний код
+MERGE_CURRENCIES = """
+WITH removed AS (DELETE FROM main_transferdailyrollup RETURNING *)
+INSERT INTO main_transferdailyrollup (user_id, day, category_id, subcategory_id, status_id, type_id, currency, summ_total, count)
+SELECT user_id, day, category_id, subcategory_id, status_id, type_id, 'RUB', SUM(summ_total), SUM(count)
+FROM removed GROUP BY user_id, day, category_id, subcategory_id, status_id, type_id;
+-- отложенные проверки внешних ключей - сразу, иначе следующий ALTER TABLE не пройдет
+SET CONSTRAINTS ALL IMMEDIATE;
+"""
+
+# представление зависит от summ, поэтому пересоздается вокруг замены
+CREATE_VIEW = """
+CREATE VIEW main_transferrecord AS
+SELECT id, user_id, date_add, status_id, type_id, category_id, subcategory_id,
+       summ, currency, comment, search_vector, false AS archived
+FROM main_moneytransfer
+UNION ALL
+SELECT id, user_id, date_add, status_id, type_id, category_id, subcategory_id,
+       summ, currency, comment, to_tsvector('russian', comment), true
+FROM main_archivedtransfer
+"""
+
+CREATE_OLD_VIEW = """
+CREATE VIEW main_transferrecord AS
+SELECT id, user_id, date_add, status_id, type_id, category_id, subcategory_id,
+       summ, comment, search_vector, false AS archived
+FROM main_moneytransfer
+UNION ALL
+SELECT id, user_id, date_add, status_id, type_id, category_id, subcategory_id,
+       summ, comment, to_tsvector('russian', comment), true
+FROM main_archivedtransfer
+"""
+
+DROP_VIEW = "DROP VIEW IF EXISTS main_transferrecord"
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0011_money_currency'),
+    ]
+
+    operations = [
+        migrations.RunSQL(DROP_VIEW, CREATE_OLD_VIEW),
+        migrations.RunSQL(
+            SWAP,
+            UNSWAP,
+            state_operations=[
+                migrations.AlterField(
+                    model_name='moneytransfer',
+                    name='summ',
+                    field=models.BigIntegerField(verbose_name='Сумма'),
+                ),
+                migrations.AlterField(
+                    model_name='archivedtransfer',
+                    name='summ',
+                    field=models.BigIntegerField(verbose_name='Сумма'),
+                ),
+            ],
+        ),
+        # ключ агрегатов меняется здесь, а не в 0011: пока идет заполнение,
+        # прежняя версия приложения пишет агрегаты по старому ключу
+        migrations.RemoveConstraint(
+            model_name='transferdailyrollup',
+            name='rollup_key',
+        ),
+        migrations.AddField(
+            model_name='transferdailyrollup',
+            name='currency',
+            field=models.CharField(choices=CURRENCY_CHOICES, db_default='RUB', default='RUB', max_length=3, verbose_name='Валюта'),
+        ),
+        migrations.RunSQL(migrations.RunSQL.noop, MERGE_CURRENCIES),
+        migrations.AddConstraint(
+            model_name='transferdailyrollup',
+            constraint=models.UniqueConstraint(fields=('user', 'day', 'category', 'subcategory', 'status', 'type', 'currency'), name='rollup_key'),
+        ),
+        migrations.RunSQL(CREATE_VIEW, DROP_VIEW),
+        migrations.AlterField(
+            model_name='transferrecord',
+            name='summ',
+            field=models.BigIntegerField(verbose_name='Сумма'),
+        ),
+        migrations.AddField(
+            model_name='transferrecord',
+            name='currency',
+            field=models.CharField(choices=CURRENCY_CHOICES, max_length=3, verbose_name='Валюта'),
+        ),
+    ]
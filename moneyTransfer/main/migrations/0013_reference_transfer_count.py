@@ -0,0 +1,53 @@
+# Generated by Django 5.2.8 on 2026-10-18 20:04
+
+from django.db import migrations, models
+
+
+def fill_counts(apps, schema_editor):
+    # по дневным агрегатам: в них учтены и архивные переводы
+    TransferDailyRollup = apps.get_model('main', 'TransferDailyRollup')
+    rollups = TransferDailyRollup._meta.db_table
+    with schema_editor.connection.cursor() as cursor:
+        for model_name, field in (
+            ('Status', 'status_id'), ('OperationType', 'type_id'),
+            ('Category', 'category_id'), ('Subcategory', 'subcategory_id'),
+        ):
+            table = apps.get_model('main', model_name)._meta.db_table
+            cursor.execute(
+                f"""
+                UPDATE {table} SET transfer_count = counts.total
+                FROM (SELECT {field} AS id, SUM(count) AS total FROM {rollups} GROUP BY {field}) AS counts
+                WHERE {table}.id = counts.id
+                """
+            )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0012_money_minor_units'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='category',
+            name='transfer_count',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Переводов'),
+        ),
+        migrations.AddField(
+            model_name='operationtype',
+            name='transfer_count',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Переводов'),
+        ),
+        migrations.AddField(
+            model_name='status',
+            name='transfer_count',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Переводов'),
+        ),
+        migrations.AddField(
+            model_name='subcategory',
+            name='transfer_count',
+            field=models.BigIntegerField(db_default=0, default=0, editable=False, verbose_name='Переводов'),
+        ),
+        migrations.RunPython(fill_counts, migrations.RunPython.noop),
+    ]
@@ -1,50 +1,247 @@
-from django.db import models
+from django.db import models, transaction, NotSupportedError
 from django.core.exceptions import ValidationError
 from django.contrib.auth.models import User
+from django.contrib.postgres.indexes import BrinIndex, GinIndex, OpClass
+from django.contrib.postgres.search import SearchVectorField
+from django.db.models.functions import Upper
+from django.utils import timezone
+
+from . import rollups
+from .money import BASE_CURRENCY, CURRENCY_CHOICES
 
 class Status(models.Model):
     name = models.TextField(max_length=255, verbose_name="Название")
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь")
+    # переводы вместе с архивом; поддерживает rollups.apply
+    transfer_count = models.BigIntegerField(default=0, db_default=0, editable=False, verbose_name="Переводов")
     def __str__(self):
         return self.name
 class OperationType(models.Model):
     name = models.TextField(max_length=255, verbose_name="Название")
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь")
+    # переводы вместе с архивом; поддерживает rollups.apply
+    transfer_count = models.BigIntegerField(default=0, db_default=0, editable=False, verbose_name="Переводов")
     def __str__(self):
         return self.name
+class MoneyTransferQuerySet(models.QuerySet):
+    """Массовые операции, которые поддерживают TransferDailyRollup в актуальном состоянии"""
+
+    def _locked(self):
+        # строки блокируются до подсчета дельт, чтобы агрегаты не разошлись с данными
+        return self.model._base_manager.using(self.db).filter(
+            pk__in=self.order_by().select_for_update().values('pk')
+        )
+
+    def update(self, **kwargs):
+        if not rollups.TRACKED_FIELDS.intersection(kwargs):
+            # агрегаты не меняются, но закешированные страницы показывают и другие поля
+            with transaction.atomic(using=self.db):
+                users = set(self.order_by().values_list('user_id', flat=True).distinct())
+                updated = super().update(**kwargs)
+                rollups.touch(users, using=self.db)
+            return updated
+
+        with transaction.atomic(using=self.db):
+            locked = self._locked()
+            deltas = rollups.Deltas()
+            constants = rollups.constant_replacements(self.model, kwargs)
+            if constants is not None:
+                # новые значения известны заранее: дельты считаются по группам, без выборки строк
+                replace, summ = constants
+                old = list(rollups.grouped(locked))
+                deltas.add_grouped(old, sign=-1)
+                deltas.add_grouped(old, replace=replace, summ=summ)
+                updated = super().update(**kwargs)
+            else:
+                # новые ключи - те же выражения, вычисленные по строкам до UPDATE
+                deltas.add_grouped(rollups.grouped(locked), sign=-1)
+                deltas.add_grouped(rollups.grouped_after_update(locked, kwargs))
+                updated = super().update(**kwargs)
+            rollups.apply(deltas, using=self.db)
+        return updated
+
+    update.alters_data = True
+
+    def delete(self):
+        with transaction.atomic(using=self.db):
+            deltas = rollups.Deltas()
+            deltas.add_grouped(rollups.grouped(self._locked()), sign=-1)
+            result = super().delete()
+            rollups.apply(deltas, using=self.db)
+        return result
+
+    delete.alters_data = True
+    delete.queryset_only = True
+
+    def bulk_create(self, objs, *args, **kwargs):
+        if kwargs.get('ignore_conflicts') or kwargs.get('update_conflicts'):
+            raise NotSupportedError("bulk_create с обработкой конфликтов не поддерживает агрегаты")
+        with transaction.atomic(using=self.db):
+            objs = super().bulk_create(objs, *args, **kwargs)
+            deltas = rollups.Deltas()
+            for obj in objs:
+                deltas.add_instance(obj)
+            rollups.apply(deltas, using=self.db)
+        return objs
+
+
 class MoneyTransfer(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь")
-    date_add = models.DateTimeField(auto_now_add = True, verbose_name = "Время создания записи")
+    # отдельный индекс по user_id не нужен: он является префиксом составных индексов ниже
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False, verbose_name="Пользователь")
+    # не auto_now_add: при импорте выписок дата берется из файла
+    date_add = models.DateTimeField(default=timezone.now, editable=False, verbose_name = "Время создания записи")
     status = models.ForeignKey("Status", verbose_name="Статус", on_delete=models.PROTECT)
     type = models.ForeignKey("OperationType", verbose_name="Тип", on_delete=models.PROTECT)
     category = models.ForeignKey("Category", on_delete=models.PROTECT, verbose_name="Категория")
     subcategory = models.ForeignKey("Subcategory", on_delete=models.PROTECT, verbose_name="Подкатегория")
-    summ = models.IntegerField(verbose_name="Сумма")
+    # в минимальных единицах валюты (копейках), см. main.money
+    summ = models.BigIntegerField(verbose_name="Сумма")
+    currency = models.CharField(
+        max_length=3, choices=CURRENCY_CHOICES, default=BASE_CURRENCY, db_default=BASE_CURRENCY,
+        verbose_name="Валюта",
+    )
     comment = models.TextField(max_length=255, blank=True, verbose_name="Комментарий")
+    # to_tsvector(SEARCH_CONFIG, comment); заполняет триггер при вставке и смене
+    # комментария (миграция 0007), поэтому значение в объекте может быть устаревшим
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = MoneyTransferQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            # Список по дате; INCLUDE позволяет считать сумму с фильтрами по index-only scan
+            models.Index(
+                fields=['user', '-date_add', '-id'],
+                include=['summ', 'category', 'subcategory', 'status', 'type'],
+                name='mt_user_date_idx',
+            ),
+            # Сортировка по сумме
+            models.Index(fields=['user', 'summ', 'id'], name='mt_user_summ_idx'),
+            # Самые частые фильтры вместе с сортировкой по дате
+            models.Index(fields=['user', 'category', '-date_add', '-id'], name='mt_user_cat_date_idx'),
+            models.Index(fields=['user', 'subcategory', '-date_add', '-id'], name='mt_user_subcat_date_idx'),
+            # Диапазоны дат по всей таблице (админка): BRIN занимает килобайты,
+            # потому что переводы добавляются примерно в порядке дат
+            BrinIndex(fields=['date_add'], name='mt_date_brin'),
+            # Поиск по комментарию: полнотекстовый и по части слова (icontains
+            # сравнивает UPPER(comment)); user в GIN-индексе через btree_gin
+            GinIndex(fields=['user', 'search_vector'], name='mt_user_search_idx'),
+            GinIndex(
+                models.F('user'), OpClass(Upper('comment'), name='gin_trgm_ops'),
+                name='mt_user_comment_trgm_idx',
+            ),
+        ]
 
     def clean(self):
-        if self.subcategory and self.category:
-            if self.subcategory.category != self.category:
+        # сравниваются id, чтобы не загружать категорию отдельным запросом
+        if self.subcategory_id and self.category_id:
+            if self.subcategory.category_id != self.category_id:
                 raise ValidationError({
                     'subcategory': 'Подкатегория должна принадлежать выбранной категории.'
                 })
-        elif self.subcategory and not self.category:
+        elif self.subcategory_id and not self.category_id:
             raise ValidationError({
                 'category': 'Сначала выберите категорию.'
             })
 
     def save(self, *args, **kwargs):
         self.clean()  # важно вызвать clean перед сохранением
-        super().save(*args, **kwargs)
+        using = kwargs.get('using') or self._state.db or 'default'
+        with transaction.atomic(using=using):
+            deltas = rollups.Deltas()
+            if self.pk is not None:
+                old = MoneyTransfer._base_manager.using(using).select_for_update().filter(pk=self.pk).first()
+                if old is not None:
+                    deltas.add_instance(old, sign=-1)
+            super().save(*args, **kwargs)
+            deltas.add_instance(self)
+            rollups.apply(deltas, using=using)
+
+    def delete(self, *args, **kwargs):
+        using = kwargs.get('using') or self._state.db or 'default'
+        with transaction.atomic(using=using):
+            deltas = rollups.Deltas()
+            deltas.add_instance(self, sign=-1)
+            result = super().delete(*args, **kwargs)
+            # строку мог удалить параллельный запрос: тогда ее дельту он уже применил
+            if result[0]:
+                rollups.apply(deltas, using=using)
+        return result
     
 
+class ArchivedTransfer(models.Model):
+    """
+    Переводы старше TRANSFERS_ARCHIVE_AFTER_DAYS, перенесенные командой
+    archive_transfers (см. main.archive). Строки меняет только объединение
+    справочников (main.merge), а в дневных агрегатах они учтены, как и до переноса
+    """
+    # id исходного перевода
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False, verbose_name="Пользователь")
+    date_add = models.DateTimeField(verbose_name="Время создания записи")
+    # без индексов по внешним ключам: таблица только растет, а справочники удаляются редко
+    status = models.ForeignKey("Status", on_delete=models.PROTECT, db_index=False, related_name='+', verbose_name="Статус")
+    type = models.ForeignKey("OperationType", on_delete=models.PROTECT, db_index=False, related_name='+', verbose_name="Тип")
+    category = models.ForeignKey("Category", on_delete=models.PROTECT, db_index=False, related_name='+', verbose_name="Категория")
+    subcategory = models.ForeignKey("Subcategory", on_delete=models.PROTECT, db_index=False, related_name='+', verbose_name="Подкатегория")
+    summ = models.BigIntegerField(verbose_name="Сумма")
+    currency = models.CharField(
+        max_length=3, choices=CURRENCY_CHOICES, default=BASE_CURRENCY, db_default=BASE_CURRENCY,
+        verbose_name="Валюта",
+    )
+    comment = models.TextField(blank=True, verbose_name="Комментарий")
+
+    class Meta:
+        verbose_name = "Архивный перевод"
+        verbose_name_plural = "Архив переводов"
+        # только список по дате и сортировка по сумме, как в index
+        indexes = [
+            models.Index(fields=['user', '-date_add', '-id'], name='archive_user_date_idx'),
+            models.Index(fields=['user', 'summ', 'id'], name='archive_user_summ_idx'),
+        ]
+
+
+class TransferRecord(models.Model):
+    """
+    Переводы вместе с архивом: представление UNION ALL таблиц MoneyTransfer и
+    ArchivedTransfer (миграция 0009). Только для чтения; archive.transfers
+    выбирает его, когда диапазон дат заходит в архив
+    """
+    id = models.BigIntegerField(primary_key=True)
+    user = models.ForeignKey(User, on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    date_add = models.DateTimeField(verbose_name="Время создания записи")
+    status = models.ForeignKey("Status", on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    type = models.ForeignKey("OperationType", on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    category = models.ForeignKey("Category", on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    subcategory = models.ForeignKey("Subcategory", on_delete=models.DO_NOTHING, db_constraint=False, related_name='+')
+    summ = models.BigIntegerField(verbose_name="Сумма")
+    currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES, verbose_name="Валюта")
+    comment = models.TextField(blank=True, verbose_name="Комментарий")
+    # у архивных строк вычисляется при чтении
+    search_vector = SearchVectorField(null=True)
+    archived = models.BooleanField()
+
+    class Meta:
+        managed = False
+        db_table = 'main_transferrecord'
+
+
 class Category(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name="Пользователь")
     name = models.CharField(max_length=100, verbose_name="Название категории")
+    # переводы вместе с архивом; поддерживает rollups.apply
+    transfer_count = models.BigIntegerField(default=0, db_default=0, editable=False, verbose_name="Переводов")
     
     class Meta:
         verbose_name = "Категория"
         verbose_name_plural = "Категории"
+        # поиск в выпадающих списках (main.lookups): начало и часть названия
+        indexes = [
+            GinIndex(
+                models.F('user'), OpClass(Upper('name'), name='gin_trgm_ops'),
+                name='category_user_name_trgm_idx',
+            ),
+        ]
     
     def __str__(self):
         return self.name
@@ -62,13 +259,109 @@ class Subcategory(models.Model):
     )
 
     name = models.CharField(max_length=100, verbose_name="Название подкатегории")
+    # переводы вместе с архивом; поддерживает rollups.apply
+    transfer_count = models.BigIntegerField(default=0, db_default=0, editable=False, verbose_name="Переводов")
     
     class Meta:
         verbose_name = "Подкатегория"
         verbose_name_plural = "Подкатегории"
         unique_together = ['category', 'name']
+        indexes = [
+            GinIndex(
+                models.F('user'), OpClass(Upper('name'), name='gin_trgm_ops'),
+                name='subcategory_user_name_trgm_idx',
+            ),
+        ]
     
     def __str__(self):
         return f"{self.name}"
-    
 
+
+class TransferDailyRollup(models.Model):
+    """Дневные суммы переводов, поддерживаются при каждой записи MoneyTransfer"""
+    user = models.ForeignKey(User, on_delete=models.CASCADE, db_index=False, verbose_name="Пользователь")
+    day = models.DateField(verbose_name="День")
+    category = models.ForeignKey("Category", on_delete=models.CASCADE, related_name='+', verbose_name="Категория")
+    subcategory = models.ForeignKey("Subcategory", on_delete=models.CASCADE, related_name='+', verbose_name="Подкатегория")
+    status = models.ForeignKey("Status", on_delete=models.CASCADE, related_name='+', verbose_name="Статус")
+    type = models.ForeignKey("OperationType", on_delete=models.CASCADE, related_name='+', verbose_name="Тип")
+    # суммы разных валют не складываются: в рубли они переводятся при чтении
+    currency = models.CharField(
+        max_length=3, choices=CURRENCY_CHOICES, default=BASE_CURRENCY, db_default=BASE_CURRENCY,
+        verbose_name="Валюта",
+    )
+    summ_total = models.BigIntegerField(default=0, verbose_name="Сумма")
+    count = models.BigIntegerField(default=0, verbose_name="Количество")
+
+    class Meta:
+        verbose_name = "Дневной итог"
+        verbose_name_plural = "Дневные итоги"
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'day', 'category', 'subcategory', 'status', 'type', 'currency'],
+                name='rollup_key',
+            ),
+        ]
+
+
+class ExchangeRate(models.Model):
+    """Курс валюты в рублях; действует с даты до следующего курса этой валюты"""
+    currency = models.CharField(max_length=3, choices=CURRENCY_CHOICES, verbose_name="Валюта")
+    date = models.DateField(verbose_name="Дата")
+    rate = models.DecimalField(max_digits=18, decimal_places=8, verbose_name="Рублей за единицу")
+
+    class Meta:
+        verbose_name = "Курс валюты"
+        verbose_name_plural = "Курсы валют"
+        constraints = [
+            # поиск последнего курса на дату (main.money.rate_expression)
+            models.UniqueConstraint(fields=['currency', 'date'], name='exchange_rate_key'),
+        ]
+
+    def __str__(self):
+        return f"{self.currency} {self.date:%d.%m.%Y}: {self.rate}"
+
+
+class ReassignJob(models.Model):
+    """Массовая смена справочника у переводов, выполняется пачками (main.reassign)"""
+    FIELD_CHOICES = [
+        ('status', "Статус"),
+        ('type', "Тип"),
+        ('category', "Категория"),
+        ('subcategory', "Подкатегория"),
+    ]
+    STATE_PENDING = 'pending'
+    STATE_RUNNING = 'running'
+    STATE_DONE = 'done'
+    STATE_CHOICES = [
+        (STATE_PENDING, "Ожидает"),
+        (STATE_RUNNING, "Выполняется"),
+        (STATE_DONE, "Завершено"),
+    ]
+
+    field = models.CharField(max_length=20, choices=FIELD_CHOICES, verbose_name="Поле")
+    # название нового значения; id у каждого пользователя свой
+    target_name = models.CharField(max_length=255, verbose_name="Новое значение")
+    # для смены категории - подкатегория внутри новой категории
+    subcategory_name = models.CharField(max_length=255, blank=True, verbose_name="Новая подкатегория")
+    # условия выборки переводов или их id (main.reassign.get_selection)
+    selection = models.JSONField(verbose_name="Выборка")
+    state = models.CharField(max_length=20, choices=STATE_CHOICES, default=STATE_PENDING, verbose_name="Состояние")
+    # переводы обрабатываются по возрастанию id; обработаны все с id <= last_id
+    last_id = models.BigIntegerField(default=0, verbose_name="Последний id")
+    total = models.BigIntegerField(default=0, verbose_name="Всего")
+    processed = models.BigIntegerField(default=0, verbose_name="Обработано")
+    updated = models.BigIntegerField(default=0, verbose_name="Изменено")
+    skipped = models.BigIntegerField(default=0, verbose_name="Пропущено")
+    created_by = models.ForeignKey(
+        User, null=True, blank=True, on_delete=models.SET_NULL, related_name='+', verbose_name="Создал",
+    )
+    created_at = models.DateTimeField(auto_now_add=True, verbose_name="Создано")
+    finished_at = models.DateTimeField(null=True, blank=True, verbose_name="Завершено")
+
+    class Meta:
+        verbose_name = "Массовое переназначение"
+        verbose_name_plural = "Массовые переназначения"
+
+    def __str__(self):
+        return f"{self.get_field_display()} -> {self.target_name} ({self.processed}/{self.total})"
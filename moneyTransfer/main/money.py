@@ -0,0 +1,137 @@
+"""
+Суммы и валюты переводов.
+
+Суммы хранятся целыми числами в минимальных единицах валюты (копейках,
+центах): у всех валют CURRENCIES их MINOR_UNITS в основной единице. Курсы
+ExchangeRate задают, сколько рублей стоит единица валюты с указанной даты
+до следующего курса. Итоги в рублях считаются в базе одним агрегатом
+(converted_sum), каждая сумма - по курсу на свой день; для вывода отдельных
+сумм курсы читаются через rate() из памяти процесса.
+"""
+import time
+from bisect import bisect_right
+from decimal import ROUND_HALF_UP, Decimal, InvalidOperation
+
+from django.conf import settings
+from django.db.models import (
+    BigIntegerField, Case, DecimalField, F, OuterRef, Subquery, Sum, Value, When,
+)
+from django.db.models.functions import Cast, Coalesce, Round
+
+BASE_CURRENCY = 'RUB'
+# код ISO 4217: (название, знак)
+CURRENCIES = {
+    'RUB': ("Российский рубль", "₽"),
+    'USD': ("Доллар США", "$"),
+    'EUR': ("Евро", "€"),
+    'CNY': ("Китайский юань", "¥"),
+    'KZT': ("Казахстанский тенге", "₸"),
+    'BYN': ("Белорусский рубль", "Br"),
+}
+CURRENCY_CHOICES = [(code, f"{code} - {name}") for code, (name, _) in CURRENCIES.items()]
+MINOR_UNITS = 100
+# границы BigIntegerField
+SUMM_MIN, SUMM_MAX = -2 ** 63, 2 ** 63 - 1
+
+RATE_FIELD = DecimalField(max_digits=18, decimal_places=8)
+CONVERTED_FIELD = DecimalField(max_digits=38, decimal_places=8)
+
+
+def to_minor(value):
+    """Сумма в основных единицах (строка, Decimal, int) -> целое в минимальных; ValueError при ошибке"""
+    if isinstance(value, bool):
+        raise ValueError(f"некорректная сумма «{value}»")
+    if isinstance(value, float):
+        # 12.34 -> '12.34', а не двоичное приближение
+        value = repr(value)
+    if isinstance(value, str):
+        value = value.replace(' ', '').replace('\xa0', '').replace(',', '.')
+    try:
+        amount = Decimal(value) * MINOR_UNITS
+    except (InvalidOperation, TypeError):
+        raise ValueError(f"некорректная сумма «{value}»")
+    if not amount.is_finite() or amount != amount.to_integral_value():
+        raise ValueError(f"не больше двух знаков после запятой: «{value}»")
+    if not SUMM_MIN <= amount <= SUMM_MAX:
+        raise ValueError(f"сумма вне допустимого диапазона: «{value}»")
+    return int(amount)
+
+
+def to_major(minor):
+    return (Decimal(minor) / MINOR_UNITS).quantize(Decimal('0.01'))
+
+
+def format_money(minor, currency=BASE_CURRENCY):
+    """1234567 -> '12 345,67 ₽'; без валюты (None) - только число"""
+    if minor is None:
+        return ''
+    text = f"{to_major(minor):,.2f}".replace(',', '\xa0').replace('.', ',')
+    if currency is None:
+        return text
+    return f"{text}\xa0{CURRENCIES.get(currency, ('', currency))[1]}"
+
+
+# курсы в памяти процесса: валюта -> (время загрузки, даты по возрастанию, курсы)
+_rates = {}
+
+
+def clear_rates():
+    _rates.clear()
+
+
+def rate(currency, day):
+    """
+    Курс валюты на день, как в converted_sum: последний на эту дату, а до
+    первого курса - первый. None, если курсов валюты нет
+    """
+    if currency == BASE_CURRENCY:
+        return Decimal(1)
+    loaded = _rates.get(currency)
+    if loaded is None or time.monotonic() - loaded[0] > settings.RATE_CACHE_TIMEOUT:
+        from .models import ExchangeRate
+
+        rows = list(ExchangeRate.objects.filter(currency=currency).order_by('date').values_list('date', 'rate'))
+        loaded = _rates[currency] = (time.monotonic(), [date for date, _ in rows], [value for _, value in rows])
+    _, dates, rates = loaded
+    if not dates:
+        return None
+    return rates[max(bisect_right(dates, day) - 1, 0)]
+
+
+def convert(minor, currency, day):
+    """Сумма в минимальных единицах рубля или None без курса"""
+    value = rate(currency, day)
+    if value is None:
+        return None
+    return int((minor * value).to_integral_value(ROUND_HALF_UP))
+
+
+def rate_expression(currency, day):
+    """
+    Курс для строки внешнего запроса: поле currency и день - имя поля DateField
+    или выражение над OuterRef
+    """
+    from .models import ExchangeRate
+
+    if isinstance(day, str):
+        day = OuterRef(day)
+    rates = ExchangeRate.objects.filter(currency=OuterRef(currency))
+    return Coalesce(
+        Subquery(rates.filter(date__lte=day).order_by('-date').values('rate')[:1]),
+        Subquery(rates.order_by('date').values('rate')[:1]),
+        output_field=RATE_FIELD,
+    )
+
+
+def converted_sum(amount, currency='currency', day='day'):
+    """
+    Sum(amount) в минимальных единицах рубля, округленная до целого. Суммы
+    в рублях берутся как есть, остальные умножаются на курс своего дня;
+    валюты без единого курса в итог не входят
+    """
+    value = Case(
+        When(**{currency: BASE_CURRENCY}, then=Cast(amount, CONVERTED_FIELD)),
+        default=F(amount) * rate_expression(currency, day),
+        output_field=CONVERTED_FIELD,
+    )
+    return Cast(Round(Coalesce(Sum(value), Value(0), output_field=CONVERTED_FIELD)), BigIntegerField())
@@ -0,0 +1,159 @@
+import base64
+import binascii
+import json
+from datetime import datetime
+
+from django.core.exceptions import EmptyResultSet
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+
+class InvalidCursor(Exception):
+    pass
+
+
+def encode_cursor(order_key, direction, value, pk):
+    if isinstance(value, datetime):
+        value = value.isoformat()
+    raw = json.dumps([order_key, direction, value, pk], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, order_key, field):
+    """Разбирает курсор; курсор от другой сортировки считается недействительным"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        key, direction, value, pk = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if key != order_key or direction not in ('next', 'prev'):
+            raise InvalidCursor(cursor)
+        if field == 'date_add':
+            value = datetime.fromisoformat(value)
+        else:
+            value = int(value)
+        return direction, value, int(pk)
+    except (ValueError, TypeError, binascii.Error, json.JSONDecodeError):
+        raise InvalidCursor(cursor)
+
+
+class KeysetPage:
+    """Страница keyset-пагинации: без COUNT(*) и OFFSET"""
+
+    def __init__(self, object_list, per_page, next_cursor=None, prev_cursor=None, base_query=''):
+        self.object_list = object_list
+        self.per_page = per_page
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+        self.base_query = base_query
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.prev_cursor is not None
+
+
+class KeysetPaginator:
+    """
+    Пагинация по ключу (field, id).
+
+    Порядок должен совпадать с тем, что выставляет apply_transfer_filters:
+    (-field, -id) при descending=True и (field, id) иначе.
+    """
+
+    def __init__(self, queryset, per_page, field, descending):
+        self.queryset = queryset
+        self.per_page = per_page
+        self.field = field
+        self.descending = descending
+        self.order_key = f"{'-' if descending else ''}{field}"
+
+    def _ordering(self, forward):
+        desc = self.descending == forward
+        prefix = '-' if desc else ''
+        return [f'{prefix}{self.field}', f'{prefix}id']
+
+    def _seek(self, queryset, value, pk, forward):
+        # (field, id) < (value, pk) записано так, чтобы первое условие
+        # было диапазоном по индексу, а второе лишь отсекало равные значения
+        op = 'lt' if self.descending == forward else 'gt'
+        return queryset.filter(**{f'{self.field}__{op}e': value}).filter(
+            Q(**{f'{self.field}__{op}': value}) | Q(**{self.field: value, f'id__{op}': pk})
+        )
+
+    def _cursor(self, direction, obj):
+        return encode_cursor(self.order_key, direction, getattr(obj, self.field), obj.pk)
+
+    def page(self, cursor=None, base_query=''):
+        direction, value, pk = 'next', None, None
+        if cursor:
+            try:
+                direction, value, pk = decode_cursor(cursor, self.order_key, self.field)
+            except InvalidCursor:
+                direction, value, pk = 'next', None, None
+
+        forward = direction == 'next'
+        queryset = self.queryset.order_by(*self._ordering(forward))
+        if pk is not None:
+            queryset = self._seek(queryset, value, pk, forward)
+
+        rows = list(queryset[:self.per_page + 1])
+        if not rows and pk is not None:
+            # курсор указывает за край выборки (например, записи удалены)
+            return self.page(base_query=base_query)
+        has_more = len(rows) > self.per_page
+        rows = rows[:self.per_page]
+        if not forward:
+            rows.reverse()
+
+        if forward:
+            has_next, has_previous = has_more, pk is not None
+        else:
+            has_next, has_previous = True, has_more
+
+        next_cursor = self._cursor('next', rows[-1]) if rows and has_next else None
+        prev_cursor = self._cursor('prev', rows[0]) if rows and has_previous else None
+        return KeysetPage(rows, self.per_page, next_cursor, prev_cursor, base_query)
+
+
+def estimate_count(queryset):
+    """Оценка числа строк планировщиком Postgres (EXPLAIN без выполнения)"""
+    try:
+        sql, params = queryset.order_by().values('pk').query.get_compiler(queryset.db).as_sql()
+    except EmptyResultSet:
+        return 0
+    with connections[queryset.db].cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]['Plan']['Plan Rows'])
+
+
+class EstimatedCountPaginator(Paginator):
+    """
+    Paginator для больших таблиц: если планировщик ожидает больше exact_limit
+    строк, вместо COUNT(*) используется его оценка. Небольшие выборки
+    по-прежнему считаются точно. Номер последней страницы при оценке
+    приблизительный: лишние страницы окажутся пустыми.
+    """
+    exact_limit = 10000
+
+    @cached_property
+    def count(self):
+        if not hasattr(self.object_list, 'query'):
+            return super().count
+        estimate = estimate_count(self.object_list)
+        if estimate <= self.exact_limit:
+            return self.object_list.count()
+        return estimate
@@ -0,0 +1,60 @@
+"""
+Параллельные запросы к базе для асинхронных представлений (views.index_async).
+
+Под ASGI соединение запроса не переживает запрос (CONN_MAX_AGE=0), и если
+каждый параллельный запрос открывал бы свое соединение, установка соединений
+съедала бы выигрыш от параллельности. Поэтому запросы выполняются в
+отдельном пуле из ASYNC_DB_THREADS потоков, и каждый поток держит свое
+постоянное соединение (ASYNC_DB_CONN_MAX_AGE секунд, с проверкой перед
+использованием). Соединений к базе от процесса - не больше числа потоков пула.
+
+Функция выполняется в копии контекста запроса (часовой пояс, учет метрик),
+в которой соединение подменено соединением потока; в контекст запроса
+подмена не возвращается.
+"""
+import asyncio
+import contextvars
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+executor = ThreadPoolExecutor(max_workers=settings.ASYNC_DB_THREADS, thread_name_prefix='db-worker')
+_thread = threading.local()
+
+
+def thread_connection(alias=DEFAULT_DB_ALIAS):
+    """Постоянное соединение текущего потока пула"""
+    connection = getattr(_thread, alias, None)
+    if connection is None:
+        connection = connections.create_connection(alias)
+        # settings_dict общий с connections.settings: время жизни задается копии
+        connection.settings_dict = {
+            **connection.settings_dict, 'CONN_MAX_AGE': settings.ASYNC_DB_CONN_MAX_AGE,
+        }
+        setattr(_thread, alias, connection)
+    return connection
+
+
+def in_thread_connection(func):
+    def wrapper():
+        connection = thread_connection()
+        connections[DEFAULT_DB_ALIAS] = connection
+        # как close_old_connections до и после запроса: разорванное или
+        # устаревшее соединение закрывается и открывается заново при обращении
+        connection.close_if_unusable_or_obsolete()
+        try:
+            return func()
+        finally:
+            connection.close_if_unusable_or_obsolete()
+    return wrapper
+
+
+async def run_concurrently(*calls):
+    """Выполняет независимые запросы к базе одновременно, каждый в соединении своего потока"""
+    loop = asyncio.get_running_loop()
+    return await asyncio.gather(*(
+        loop.run_in_executor(executor, contextvars.copy_context().run, in_thread_connection(call))
+        for call in calls
+    ))
@@ -0,0 +1,235 @@
+"""
+Секционирование таблицы переводов по месяцам date_add.
+
+Включается настройкой TRANSFERS_PARTITIONING: миграция 0008 (или команда
+manage_partitions --convert) пересоздает main_moneytransfer как
+PARTITION BY RANGE (date_add) с первичным ключом (id, date_add) и переносит
+в нее строки, индексы, ограничения, триггеры и представления старой таблицы. Модель не
+меняется: ORM работает с родительской таблицей, а условия date_add с
+константами (filtering.date_range_q) отсекают лишние секции еще при
+планировании запроса.
+
+Границы месяцев считаются в часовом поясе проекта, как и дни агрегатов.
+Строки вне созданных секций попадают в секцию по умолчанию; команда
+manage_partitions создает секции заранее и отсоединяет старые.
+"""
+from datetime import date, datetime, time
+
+from django.db import transaction
+from django.utils import timezone
+
+TABLE = 'main_moneytransfer'
+DEFAULT_PARTITION = f'{TABLE}_default'
+# на сколько месяцев вперед создаются секции
+DEFAULT_AHEAD = 3
+
+
+class PartitioningError(Exception):
+    pass
+
+
+def month_start(value):
+    return date(value.year, value.month, 1)
+
+
+def next_month(month):
+    return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+
+def add_months(month, count):
+    for _ in range(count):
+        month = next_month(month)
+    return month
+
+
+def partition_name(month):
+    return f'{TABLE}_p{month:%Y_%m}'
+
+
+def bound(month):
+    return timezone.make_aware(datetime.combine(month, time.min), timezone.get_default_timezone())
+
+
+def _literal(value):
+    # границы секций в DDL не передаются параметрами; значение строится здесь же
+    return f"'{value.isoformat()}'"
+
+
+def is_partitioned(cursor):
+    cursor.execute("SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)", [TABLE])
+    row = cursor.fetchone()
+    return row is not None and row[0] == 'p'
+
+
+def partitions(cursor):
+    """Секции: [(имя, первый месяц или None для секции по умолчанию, оценка строк)]"""
+    cursor.execute(
+        """
+        SELECT c.relname, c.reltuples::bigint
+        FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = to_regclass(%s)
+        ORDER BY c.relname
+        """,
+        [TABLE],
+    )
+    result = []
+    for name, rows in cursor.fetchall():
+        month = None
+        if name != DEFAULT_PARTITION:
+            month = datetime.strptime(name[-7:], '%Y_%m').date()
+        result.append((name, month, max(rows, 0)))
+    return result
+
+
+def _table_exists(cursor, name):
+    cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+    return cursor.fetchone()[0]
+
+
+def create_partition(cursor, month):
+    """Секция месяца; строки этого месяца из секции по умолчанию переносятся в нее"""
+    name = partition_name(month)
+    if _table_exists(cursor, name):
+        return False
+    start, end = _literal(bound(month)), _literal(bound(next_month(month)))
+    condition = f"date_add >= {start} AND date_add < {end}"
+
+    cursor.execute(f"SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} WHERE {condition})")
+    if not cursor.fetchone()[0]:
+        cursor.execute(f"CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES FROM ({start}) TO ({end})")
+        return True
+
+    # секцию с пересекающимися строками в секции по умолчанию не создать:
+    # строки сначала переносятся в отдельную таблицу, затем она присоединяется
+    cursor.execute(f"CREATE TABLE {name} (LIKE {TABLE} INCLUDING DEFAULTS)")
+    cursor.execute(
+        f"""
+        WITH moved AS (DELETE FROM {DEFAULT_PARTITION} WHERE {condition} RETURNING *)
+        INSERT INTO {name} SELECT * FROM moved
+        """
+    )
+    cursor.execute(f"ALTER TABLE {TABLE} ATTACH PARTITION {name} FOR VALUES FROM ({start}) TO ({end})")
+    return True
+
+
+def create_ahead(cursor, ahead=DEFAULT_AHEAD):
+    """Секции с текущего месяца на ahead месяцев вперед; возвращает имена созданных"""
+    month = month_start(timezone.localdate(timezone=timezone.get_default_timezone()))
+    created = []
+    for _ in range(ahead + 1):
+        if create_partition(cursor, month):
+            created.append(partition_name(month))
+        month = next_month(month)
+    return created
+
+
+def detach(cursor, month):
+    """
+    Отсоединяет секцию месяца. Ее строки вычитаются из агрегатов, а таблица
+    остается без внешних ключей - как архив, который можно выгрузить и удалить
+    """
+    from . import rollups
+    from .models import MoneyTransfer
+
+    name = partition_name(month)
+    deltas = rollups.Deltas()
+    deltas.add_grouped(
+        rollups.grouped(MoneyTransfer.objects.filter(date_add__gte=bound(month), date_add__lt=bound(next_month(month)))),
+        sign=-1,
+    )
+    rollups.apply(deltas)
+    cursor.execute(f"ALTER TABLE {TABLE} DETACH PARTITION {name}")
+    cursor.execute(
+        "SELECT conname FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'", [name],
+    )
+    for (constraint,) in cursor.fetchall():
+        cursor.execute(f'ALTER TABLE {name} DROP CONSTRAINT "{constraint}"')
+
+
+def convert(connection, ahead=DEFAULT_AHEAD):
+    """
+    Пересоздает таблицу переводов секционированной. Таблица блокируется на
+    все время копирования; возвращает False, если она уже секционирована
+    """
+    with transaction.atomic(using=connection.alias), connection.cursor() as cursor:
+        if is_partitioned(cursor):
+            return False
+        cursor.execute(f"LOCK TABLE {TABLE} IN ACCESS EXCLUSIVE MODE")
+
+        # определения переносятся как есть: индексы моделей, индексы внешних
+        # ключей, ограничения и триггер search_vector
+        cursor.execute(
+            "SELECT pg_get_indexdef(indexrelid), indisunique FROM pg_index "
+            "WHERE indrelid = to_regclass(%s) AND NOT indisprimary",
+            [TABLE],
+        )
+        indexes = cursor.fetchall()
+        if any(unique for _, unique in indexes):
+            # уникальность в секционированной таблице возможна только вместе с date_add
+            raise PartitioningError("У таблицы переводов есть уникальные индексы кроме первичного ключа")
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype IN ('c', 'f')",
+            [TABLE],
+        )
+        constraints = cursor.fetchall()
+        cursor.execute(
+            "SELECT pg_get_triggerdef(oid) FROM pg_trigger WHERE tgrelid = to_regclass(%s) AND NOT tgisinternal",
+            [TABLE],
+        )
+        triggers = [row[0] for row in cursor.fetchall()]
+        # представления над таблицей (TransferRecord) пересоздаются над новой
+        cursor.execute(
+            """
+            SELECT DISTINCT v.relname, pg_get_viewdef(v.oid)
+            FROM pg_depend d
+            JOIN pg_rewrite r ON r.oid = d.objid
+            JOIN pg_class v ON v.oid = r.ev_class
+            WHERE d.refobjid = to_regclass(%s) AND v.oid <> d.refobjid
+            """,
+            [TABLE],
+        )
+        views = cursor.fetchall()
+        cursor.execute(f"SELECT min(date_add), max(date_add), max(id) FROM {TABLE}")
+        first, last, last_id = cursor.fetchone()
+
+        for name, _ in views:
+            cursor.execute(f"DROP VIEW {name}")
+        old = f'{TABLE}_unpartitioned'
+        cursor.execute(f"ALTER TABLE {TABLE} RENAME TO {old}")
+        cursor.execute(
+            f"CREATE TABLE {TABLE} (LIKE {old} INCLUDING DEFAULTS INCLUDING IDENTITY) PARTITION BY RANGE (date_add)"
+        )
+        cursor.execute(f"CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT")
+
+        today = month_start(timezone.localdate(timezone=timezone.get_default_timezone()))
+        month = month_start(timezone.localtime(first, timezone.get_default_timezone())) if first else today
+        if last:
+            today = max(today, month_start(timezone.localtime(last, timezone.get_default_timezone())))
+        end = add_months(today, ahead)
+        while month <= end:
+            create_partition(cursor, month)
+            month = next_month(month)
+
+        cursor.execute(f"INSERT INTO {TABLE} SELECT * FROM {old}")
+        cursor.execute(f"DROP TABLE {old}")
+
+        # последовательность identity создана заново
+        cursor.execute("SELECT pg_get_serial_sequence(%s, 'id')", [TABLE])
+        sequence = cursor.fetchone()[0]
+        if last_id:
+            cursor.execute("SELECT setval(%s, %s)", [sequence, last_id])
+        if sequence.rsplit('.', 1)[-1] != f'{TABLE}_id_seq':
+            cursor.execute(f"ALTER SEQUENCE {sequence} RENAME TO {TABLE}_id_seq")
+
+        cursor.execute(f"ALTER TABLE {TABLE} ADD CONSTRAINT {TABLE}_pkey PRIMARY KEY (id, date_add)")
+        for definition, _ in indexes:
+            cursor.execute(definition)
+        for name, definition in constraints:
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT "{name}" {definition}')
+        for definition in triggers:
+            cursor.execute(definition)
+        for name, definition in views:
+            cursor.execute(f"CREATE VIEW {name} AS {definition}")
+        cursor.execute(f"ANALYZE {TABLE}")
+    return True
@@ -0,0 +1,210 @@
+"""
+Массовая смена статуса, типа, категории или подкатегории у переводов.
+
+Выборка сохраняется в ReassignJob как условия (пользователи, текущие
+значения поля, границы дат) или как список id переводов, а переводы обрабатываются пачками по
+возрастанию id. Каждая пачка - короткая транзакция, в которой вместе с
+переводами сохраняется и last_id задания, поэтому прерванное задание
+продолжается с места остановки. Новое значение задается названием и ищется
+в справочниках владельца каждого перевода; у кого такого значения нет,
+переводы пропускаются.
+"""
+import time
+from bisect import bisect_right
+from collections import defaultdict
+from datetime import datetime
+
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from .caching import get_references
+from .importer import name_key
+from .models import MoneyTransfer, ReassignJob
+
+DEFAULT_CHUNK_SIZE = 1000
+# ключи ReassignJob.selection
+SELECTION_KEYS = {'users', 'from_ids', 'from_name', 'date_gte', 'date_lt', 'ids'}
+
+
+class ReassignError(Exception):
+    pass
+
+
+def create_job(selection, field, target_name, subcategory_name='', created_by=None):
+    """selection - условия выборки, см. SELECTION_KEYS и get_selection"""
+    if field not in dict(ReassignJob.FIELD_CHOICES):
+        raise ReassignError(f"Неизвестное поле: {field}")
+    if not target_name.strip():
+        raise ReassignError("Не задано новое значение")
+    if field == 'category' and not subcategory_name.strip():
+        raise ReassignError("Для смены категории нужна подкатегория внутри новой категории")
+    unknown = selection.keys() - SELECTION_KEYS
+    if unknown:
+        raise ReassignError(f"Неизвестные условия выборки: {', '.join(sorted(unknown))}")
+    if 'ids' in selection:
+        selection = {**selection, 'ids': sorted(set(selection['ids']))}
+    job = ReassignJob(
+        field=field,
+        target_name=target_name.strip(),
+        subcategory_name=subcategory_name.strip(),
+        selection=selection,
+        created_by=created_by,
+    )
+    job.total = get_selection(job).count()
+    job.save()
+    return job
+
+
+def selection_ids(queryset, limit):
+    """Выборка из id переводов queryset, если их не больше limit"""
+    ids = list(queryset.order_by('pk').values_list('pk', flat=True)[:limit + 1])
+    if len(ids) > limit:
+        raise ReassignError(
+            f"Выбрано больше {limit} переводов; сузьте выборку или используйте "
+            f"команду manage.py reassign_transfers"
+        )
+    return {'ids': ids}
+
+
+def get_selection(job, ids=None):
+    """Переводы задания по условиям job.selection; ids заменяет сохраненный список id"""
+    selection = job.selection
+    field = job.field
+    queryset = MoneyTransfer.objects.all()
+    if 'users' in selection:
+        queryset = queryset.filter(user_id__in=selection['users'])
+    if 'from_ids' in selection:
+        queryset = queryset.filter(**{f'{field}_id__in': selection['from_ids']})
+    if 'from_name' in selection:
+        queryset = queryset.filter(**{f'{field}__name': selection['from_name']})
+    if 'date_gte' in selection:
+        queryset = queryset.filter(date_add__gte=datetime.fromisoformat(selection['date_gte']))
+    if 'date_lt' in selection:
+        queryset = queryset.filter(date_add__lt=datetime.fromisoformat(selection['date_lt']))
+    if 'ids' in selection:
+        queryset = queryset.filter(pk__in=selection['ids'] if ids is None else ids)
+    return queryset
+
+
+def chunk_ids(job, chunk_size):
+    """Следующие chunk_size id выборки по id после job.last_id; None для выборки по условиям"""
+    ids = (job.selection or {}).get('ids')
+    if ids is None:
+        return None
+    start = bisect_right(ids, job.last_id)
+    return ids[start:start + chunk_size]
+
+
+class Targets:
+    """Новые значения полей по пользователям, из кешированных справочников"""
+
+    def __init__(self, job):
+        self.field = job.field
+        self.target = name_key(job.target_name)
+        self.subcategory = name_key(job.subcategory_name)
+        self.users = {}
+
+    def load(self, user_ids):
+        missing = set(user_ids) - self.users.keys()
+        for user in User.objects.filter(pk__in=missing):
+            self.users[user.pk] = self.build(get_references(user))
+
+    def build(self, references):
+        # при одинаковых названиях берется первое, как в импорте
+        if self.field in ('status', 'type'):
+            objects = references.statuses if self.field == 'status' else references.types
+            return next((obj.pk for obj in objects if name_key(obj.name) == self.target), None)
+        if self.field == 'category':
+            category = next(
+                (obj.pk for obj in references.categories if name_key(obj.name) == self.target), None,
+            )
+            return next((
+                (category, obj.pk) for obj in references.subcategories
+                if obj.category_id == category and name_key(obj.name) == self.subcategory
+            ), None)
+        # подкатегория ищется внутри текущей категории перевода
+        subcategories = {}
+        for obj in references.subcategories:
+            if name_key(obj.name) == self.target:
+                subcategories.setdefault(obj.category_id, obj.pk)
+        return subcategories
+
+    def values(self, user_id, category_id):
+        """Новые значения для перевода или None, если у пользователя их нет"""
+        target = self.users.get(user_id)
+        if target is None:
+            return None
+        if self.field == 'category':
+            return {'category_id': target[0], 'subcategory_id': target[1]}
+        if self.field == 'subcategory':
+            subcategory = target.get(category_id)
+            return {'subcategory_id': subcategory} if subcategory else None
+        return {f'{self.field}_id': target}
+
+
+def run_chunk(job_id, targets, chunk_size=DEFAULT_CHUNK_SIZE):
+    with transaction.atomic():
+        # блокировка задания: два обработчика не возьмут одну и ту же пачку
+        job = ReassignJob.objects.select_for_update().get(pk=job_id)
+        if job.state == ReassignJob.STATE_DONE:
+            return job
+
+        ids = chunk_ids(job, chunk_size)
+        selection = get_selection(job, ids)
+        rows = list(
+            selection.filter(pk__gt=job.last_id).order_by('pk')
+            .values_list('pk', 'user_id', 'category_id', 'subcategory_id', 'status_id', 'type_id')
+            [:chunk_size]
+        )
+        if not rows and not ids:
+            job.state = ReassignJob.STATE_DONE
+            job.finished_at = timezone.now()
+            job.save()
+            return job
+
+        targets.load({row[1] for row in rows})
+        groups = defaultdict(list)
+        for pk, user_id, category_id, subcategory_id, status_id, type_id in rows:
+            values = targets.values(user_id, category_id)
+            if values is None:
+                job.skipped += 1
+                continue
+            current = {
+                'category_id': category_id, 'subcategory_id': subcategory_id,
+                'status_id': status_id, 'type_id': type_id,
+            }
+            if all(current[name] == value for name, value in values.items()):
+                continue
+            # подкатегория выбрана по категории перевода: условие на категорию
+            # защищает от перевода, который успели перенести в другую
+            condition = {'category_id': category_id} if job.field == 'subcategory' else {}
+            groups[(tuple(sorted(values.items())), tuple(condition.items()))].append(pk)
+
+        for (values, condition), pks in groups.items():
+            # update() ведет агрегаты TransferDailyRollup
+            job.updated += MoneyTransfer.objects.filter(pk__in=pks, **dict(condition)).update(**dict(values))
+
+        # пачка из списка id продвигается, даже если ее переводы уже удалены
+        job.last_id = ids[-1] if ids else rows[-1][0]
+        job.processed += len(rows)
+        job.state = ReassignJob.STATE_RUNNING
+        job.save()
+    return job
+
+
+def run(job, chunk_size=DEFAULT_CHUNK_SIZE, time_limit=None, progress=None):
+    """
+    Обрабатывает задание до конца или, если задан time_limit, пока не
+    истечет время (в секундах). progress вызывается после каждой пачки.
+    """
+    started = time.monotonic()
+    targets = Targets(job)
+    while True:
+        job = run_chunk(job.pk, targets, chunk_size)
+        if progress:
+            progress(job)
+        if job.state == ReassignJob.STATE_DONE:
+            return job
+        if time_limit is not None and time.monotonic() - started >= time_limit:
+            return job
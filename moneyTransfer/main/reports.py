@@ -0,0 +1,236 @@
+"""
+Отчеты: суммы и количества переводов по периодам в разрезе категории,
+подкатегории, типа или статуса.
+
+Группировка GROUP BY date_trunc(...) выполняется в базе. Если фильтры
+выражаются через дневные агрегаты (rollups.filtered), отчет строится по
+TransferDailyRollup, иначе - по самим переводам (с архивом, если его
+требует период) с границами периодов в часовом поясе пользователя. Строки разреза кешируются по пользователю под
+версией TRANSFERS, которую увеличивает каждое изменение переводов, а
+названия берутся из кеша справочников при выводе. Суммы - в копейках
+рубля: валюты переводятся по курсу дня (main.money.converted_sum), поэтому
+в ключе кеша есть и версия курсов RATES.
+"""
+import hashlib
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Count, DateField, Max, Min, Sum
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from . import archive, rollups
+from .caching import RATES, TRANSFERS, get_references, get_versions
+from .filtering import ID_FIELDS, compile_transfer_filters, date_range, parse_id
+from .models import TransferDailyRollup
+from .money import converted_sum
+
+UNITS = {
+    'day': "По дням",
+    'week': "По неделям",
+    'month': "По месяцам",
+    'quarter': "По кварталам",
+    'year': "По годам",
+}
+DIMENSIONS = {
+    'category': "Категории",
+    'subcategory': "Подкатегории",
+    'type': "Типы",
+    'status': "Статусы",
+}
+DEFAULT_UNIT = 'month'
+# столбцов в одной таблице отчета
+MAX_PERIODS = 400
+# строк на странице отчетов; остальные сворачиваются в "Прочие"
+PAGE_ROWS = 15
+
+MONTHS = ('янв', 'фев', 'мар', 'апр', 'май', 'июн', 'июл', 'авг', 'сен', 'окт', 'ноя', 'дек')
+
+
+class ReportError(Exception):
+    pass
+
+
+def too_many_periods(count):
+    return ReportError(f"Слишком много периодов ({count}): сузьте даты или выберите период крупнее")
+
+
+def period_label(period, unit):
+    if unit == 'year':
+        return str(period.year)
+    if unit == 'quarter':
+        return f"{(period.month - 1) // 3 + 1} кв. {period.year}"
+    if unit == 'month':
+        return f"{MONTHS[period.month - 1]} {period.year}"
+    return period.strftime('%d.%m.%Y')
+
+
+def period_count(start, end, unit):
+    """Число периодов unit, которые задевает полуоткрытый диапазон дней [start, end)"""
+    if end <= start:
+        return 0
+    last = end - timedelta(days=1)
+    if unit == 'day':
+        return (last - start).days + 1
+    if unit == 'week':
+        return (last - (start - timedelta(days=start.weekday()))).days // 7 + 1
+    if unit == 'month':
+        return (last.year - start.year) * 12 + last.month - start.month + 1
+    if unit == 'quarter':
+        return (last.year - start.year) * 4 + (last.month - 1) // 3 - (start.month - 1) // 3 + 1
+    return last.year - start.year + 1
+
+
+def check_periods(user, filters, unit):
+    """
+    ReportError, если диапазон фильтров дает больше MAX_PERIODS периодов.
+    Проверяется до запроса отчета; открытые границы берутся по первому и
+    последнему дню агрегатов пользователя
+    """
+    start, end = date_range(filters.get('date_from'), filters.get('date_to'), filters.get('period'))
+    if start is None or end is None:
+        days = TransferDailyRollup.objects.filter(user=user).aggregate(first=Min('day'), last=Max('day'))
+        if days['first'] is None:
+            return
+        start = start or days['first']
+        end = end or days['last'] + timedelta(days=1)
+    count = period_count(start, end, unit)
+    if count > MAX_PERIODS:
+        raise too_many_periods(count)
+
+
+def query(user, filters, dimension, unit):
+    """Строки (период, id, сумма, количество) одним GROUP BY"""
+    field = f'{dimension}_id'
+    aggregates = rollups.filtered(user, filters)
+    if aggregates is not None:
+        queryset = aggregates.annotate(period=Trunc('day', unit, output_field=DateField()))
+        summ, count = converted_sum('summ_total'), Sum('count')
+    else:
+        queryset = (
+            archive.transfers(user, filters).filter(compile_transfer_filters(filters))
+            .annotate(period=Trunc(
+                'date_add', unit, output_field=DateField(), tzinfo=timezone.get_current_timezone(),
+            ))
+        )
+        summ, count = converted_sum('summ', day=rollups.rate_day()), Count('id')
+    return list(
+        queryset.order_by().values('period', field)
+        .annotate(summ=summ, count=count)
+        .order_by('period', field)
+        .values_list('period', field, 'summ', 'count')
+    )
+
+
+def cache_key(user, filters, dimension, unit):
+    # период вроде this_month зависит от текущего дня, поэтому в ключе - сами границы
+    start, end = date_range(filters.get('date_from'), filters.get('date_to'), filters.get('period'))
+    parts = [
+        dimension, unit, start, end, filters.get('search', ''),
+        timezone.get_current_timezone_name(),
+        *(parse_id(filters.get(name)) if filters.get(name) else '' for name in ID_FIELDS),
+    ]
+    digest = hashlib.md5(repr(parts).encode()).hexdigest()
+    transfers_version, rates_version = get_versions([TRANSFERS, RATES], user.pk)
+    return f'reports:{user.pk}:{transfers_version}:{rates_version}:{digest}'
+
+
+def get_rows(user, filters, dimension, unit):
+    key = cache_key(user, filters, dimension, unit)
+    rows = cache.get(key)
+    if rows is None:
+        rows = query(user, filters, dimension, unit)
+        cache.set(key, rows, timeout=settings.REPORT_CACHE_TIMEOUT)
+    return rows
+
+
+def reference_names(references, dimension):
+    if dimension == 'subcategory':
+        return {obj.pk: f"{obj.category.name} - {obj.name}" for obj in references.subcategories}
+    objects = {
+        'category': references.categories, 'type': references.types, 'status': references.statuses,
+    }[dimension]
+    return {obj.pk: obj.name for obj in objects}
+
+
+class Breakdown:
+    """Сводная таблица: строки - значения разреза, столбцы - периоды"""
+
+    def __init__(self, dimension, unit, rows, names, limit=None):
+        self.dimension = dimension
+        self.unit = unit
+        self.periods = sorted({period for period, _, _, _ in rows})
+        # дни агрегатов - в поясе проекта, поэтому check_periods может ошибиться на период
+        if len(self.periods) > MAX_PERIODS:
+            raise too_many_periods(len(self.periods))
+        columns = {period: index for index, period in enumerate(self.periods)}
+        items = {}
+        for period, pk, summ, count in rows:
+            item = items.get(pk)
+            if item is None:
+                item = items[pk] = {
+                    'id': pk, 'name': names.get(pk, "—"),
+                    'total': 0, 'count': 0, 'values': [0] * len(self.periods),
+                }
+            item['values'][columns[period]] += summ
+            item['total'] += summ
+            item['count'] += count
+        self.rows = sorted(items.values(), key=lambda item: (-abs(item['total']), item['name']))
+        if limit is not None and len(self.rows) > limit:
+            self.rows[limit:] = [self.fold(self.rows[limit:])]
+        self.totals = [sum(item['values'][index] for item in self.rows) for index in range(len(self.periods))]
+        self.total = sum(self.totals)
+        self.count = sum(item['count'] for item in self.rows)
+
+    def fold(self, rows):
+        other = {
+            'id': None, 'name': f"Прочие ({len(rows)})",
+            'total': 0, 'count': 0, 'values': [0] * len(self.periods),
+        }
+        for item in rows:
+            other['values'] = [a + b for a, b in zip(other['values'], item['values'])]
+            other['total'] += item['total']
+            other['count'] += item['count']
+        return other
+
+    @property
+    def title(self):
+        return DIMENSIONS[self.dimension]
+
+    @property
+    def labels(self):
+        return [period_label(period, self.unit) for period in self.periods]
+
+    def as_dict(self):
+        return {
+            'dimension': self.dimension,
+            'unit': self.unit,
+            'periods': self.periods,
+            'rows': self.rows,
+            'totals': self.totals,
+            'total': self.total,
+            'count': self.count,
+        }
+
+
+def build(user, filters, dimensions, unit=DEFAULT_UNIT, limit=None):
+    """
+    Разрезы отчета; limit - сколько строк оставить в каждом, остальные
+    сворачиваются в одну. ReportError - при неизвестном разрезе, периоде
+    или слишком длинном отчете
+    """
+    if unit not in UNITS:
+        raise ReportError(f"Неизвестный период: {unit}")
+    unknown = [dimension for dimension in dimensions if dimension not in DIMENSIONS]
+    if unknown:
+        raise ReportError(f"Неизвестный разрез: {', '.join(unknown)}")
+    check_periods(user, filters, unit)
+    references = get_references(user)
+    return [
+        Breakdown(
+            dimension, unit, get_rows(user, filters, dimension, unit),
+            reference_names(references, dimension), limit,
+        )
+        for dimension in dict.fromkeys(dimensions)
+    ]
@@ -0,0 +1,372 @@
+"""
+Поддержка таблицы дневных агрегатов TransferDailyRollup.
+
+Каждая запись MoneyTransfer учитывается в строке с ключом
+(user, day, category, subcategory, status, type, currency). Суммы разных
+валют хранятся отдельно и переводятся в рубли при чтении по курсу дня
+строки (main.money.converted_sum). Изменения применяются
+как дельты (сумма, количество) в той же транзакции, что и запись перевода.
+Через apply проходят все изменения переводов, поэтому здесь же по дельтам
+количеств обновляются счетчики transfer_count справочников и увеличивается
+версия кеша TRANSFERS (отчеты) у затронутых пользователей.
+"""
+import operator
+from collections import defaultdict
+from functools import reduce
+
+from django.db import connections
+from django.db.models import (
+    Count, DateTimeField, Expression, ExpressionWrapper, F, IntegerField, Model, OuterRef, Q, Subquery, Sum, Value,
+)
+from django.db.models.functions import Coalesce, TruncDate
+from django.utils import timezone
+
+from .caching import TRANSFERS, bump_version
+from .money import converted_sum
+
+KEY_FIELDS = ('user_id', 'day', 'category_id', 'subcategory_id', 'status_id', 'type_id', 'currency')
+
+# Поля ключа со счетчиком transfer_count у справочника
+COUNTED_FIELDS = {
+    'status_id': 'Status', 'type_id': 'OperationType',
+    'category_id': 'Category', 'subcategory_id': 'Subcategory',
+}
+
+# Поля MoneyTransfer, от которых зависят агрегаты
+TRACKED_FIELDS = {
+    'user', 'date_add', 'category', 'subcategory', 'status', 'type', 'summ', 'currency',
+    'user_id', 'category_id', 'subcategory_id', 'status_id', 'type_id',
+}
+
+
+def rollup_day(value):
+    # Дни считаются в часовом поясе проекта, как и date_add__date
+    return timezone.localtime(value, timezone.get_default_timezone()).date()
+
+
+def rate_day():
+    """День перевода для курса в converted_sum: тот же, что у агрегатов"""
+    # у OuterRef нет output_field, который нужен TruncDate
+    date_add = ExpressionWrapper(OuterRef('date_add'), output_field=DateTimeField())
+    return TruncDate(date_add, tzinfo=timezone.get_default_timezone())
+
+
+def instance_key(transfer):
+    return (
+        transfer.user_id, rollup_day(transfer.date_add), transfer.category_id,
+        transfer.subcategory_id, transfer.status_id, transfer.type_id, transfer.currency,
+    )
+
+
+def grouped(queryset):
+    """Суммы и количества по ключу агрегата для набора переводов"""
+    return (
+        queryset.order_by()
+        .annotate(day=TruncDate('date_add', tzinfo=timezone.get_default_timezone()))
+        .values(*KEY_FIELDS)
+        .annotate(summ_total=Sum('summ'), count=Count('id'))
+    )
+
+
+def grouped_after_update(queryset, values):
+    """
+    Строки grouped() для queryset после QuerySet.update(**values), посчитанные
+    до самого UPDATE: выражения values вычисляются по текущим строкам так же,
+    как их вычислит UPDATE, поэтому строки не выбираются в приложение
+    """
+    model = queryset.model
+    # новые значения - под своими именами: аннотация не может совпадать с полем
+    new = {f'new_{name}': F(name) for name in KEY_FIELDS if name != 'day'}
+    date_add, summ = F('date_add'), F('summ')
+    for name, value in values.items():
+        if name not in TRACKED_FIELDS:
+            continue
+        field = model._meta.get_field(name)
+        if not hasattr(value, 'resolve_expression'):
+            value = Value(
+                value.pk if isinstance(value, Model) else value,
+                output_field=getattr(field, 'target_field', field),
+            )
+        if field.attname == 'date_add':
+            date_add = value
+        elif field.attname == 'summ':
+            summ = value
+        else:
+            new[f'new_{field.attname}'] = value
+    new['new_day'] = TruncDate(
+        ExpressionWrapper(date_add, output_field=DateTimeField()), tzinfo=timezone.get_default_timezone(),
+    )
+    rows = (
+        queryset.order_by().annotate(**new).values(*new)
+        .annotate(summ_total=Sum(summ), count=Count('id'))
+    )
+    return [
+        {**{name: row[f'new_{name}'] for name in KEY_FIELDS}, 'summ_total': row['summ_total'], 'count': row['count']}
+        for row in rows
+    ]
+
+
+class Deltas:
+    def __init__(self):
+        self.values = defaultdict(lambda: [0, 0])
+
+    def add(self, key, summ, count, sign=1):
+        delta = self.values[key]
+        delta[0] += sign * summ
+        delta[1] += sign * count
+
+    def add_instance(self, transfer, sign=1):
+        self.add(instance_key(transfer), transfer.summ, 1, sign)
+
+    def add_grouped(self, rows, sign=1, replace=None, summ=None):
+        """
+        Добавляет строки grouped(). replace подменяет поля ключа (для UPDATE
+        с константами), summ - новое значение summ для каждой строки группы.
+        """
+        for row in rows:
+            key = {field: row[field] for field in KEY_FIELDS}
+            if replace:
+                key.update(replace)
+            total = row['summ_total'] if summ is None else summ * row['count']
+            self.add(tuple(key[field] for field in KEY_FIELDS), total, row['count'], sign)
+
+    def users(self):
+        # и те, у кого дельты взаимно погасились: сами переводы все равно изменились
+        return {key[0] for key in self.values}
+
+    def changed(self):
+        return sorted(
+            (key, delta) for key, delta in self.values.items() if delta != [0, 0]
+        )
+
+
+def constant_replacements(model, values):
+    """
+    Переводит аргументы QuerySet.update() в подмену полей ключа.
+    Возвращает (replace, summ) или None, если значения не константы.
+    """
+    replace, summ = {}, None
+    for name, value in values.items():
+        if isinstance(value, Expression) or hasattr(value, 'resolve_expression'):
+            return None
+        field = model._meta.get_field(name)
+        if name == 'summ':
+            summ = value
+        elif name == 'date_add':
+            replace['day'] = rollup_day(value)
+        elif name in TRACKED_FIELDS:
+            replace[field.attname] = value.pk if isinstance(value, Model) else value
+    return replace, summ
+
+
+def apply(deltas, using='default'):
+    """Применяет дельты одним INSERT ... ON CONFLICT и убирает опустевшие строки"""
+    from .models import TransferDailyRollup
+
+    changed = deltas.changed()
+    if not changed:
+        touch(deltas.users(), using=using)
+        return
+
+    table = TransferDailyRollup._meta.db_table
+    columns = ', '.join(KEY_FIELDS)
+    placeholders = ', '.join(['(%s, %s, %s, %s, %s, %s, %s, %s, %s)'] * len(changed))
+    params = []
+    for key, (summ, count) in changed:
+        params.extend(key)
+        params.extend((summ, count))
+
+    # строки сортированы по ключу, поэтому блокировки берутся в одном порядке
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} ({columns}, summ_total, count)
+            VALUES {placeholders}
+            ON CONFLICT ({columns}) DO UPDATE SET
+                summ_total = {table}.summ_total + EXCLUDED.summ_total,
+                count = {table}.count + EXCLUDED.count
+            """,
+            params,
+        )
+
+    TransferDailyRollup.objects.using(using).filter(
+        user_id__in={key[0] for key, _ in changed},
+        day__in={key[1] for key, _ in changed},
+        count__lte=0,
+    ).delete()
+    update_counters(changed, using=using)
+    touch(deltas.users(), using=using)
+
+
+def update_counters(changed, using='default'):
+    """Прибавляет дельты количеств к transfer_count справочников, одним UPDATE на таблицу"""
+    from django.apps import apps
+
+    with connections[using].cursor() as cursor:
+        for field, model_name in COUNTED_FIELDS.items():
+            position = KEY_FIELDS.index(field)
+            counts = defaultdict(int)
+            for key, (_, count) in changed:
+                counts[key[position]] += count
+            rows = sorted((pk, count) for pk, count in counts.items() if count)
+            if not rows:
+                continue
+            table = apps.get_model('main', model_name)._meta.db_table
+            values = ', '.join(['(%s, %s)'] * len(rows))
+            # строки в порядке id, как и в INSERT выше
+            cursor.execute(
+                f"""
+                UPDATE {table} SET transfer_count = {table}.transfer_count + counts.delta
+                FROM (VALUES {values}) AS counts (id, delta)
+                WHERE {table}.id = counts.id
+                """,
+                [value for row in rows for value in row],
+            )
+
+
+def rollup_count(field):
+    """
+    Количество переводов по агрегатам TransferDailyRollup: подзапрос
+    суммирует дневные строки вместо COUNT по всем переводам
+    """
+    from .models import TransferDailyRollup
+
+    counts = (
+        TransferDailyRollup.objects.filter(**{field: OuterRef('pk')})
+        .order_by().values(field).annotate(total=Sum('count')).values('total')
+    )
+    return Coalesce(Subquery(counts, output_field=IntegerField()), 0)
+
+
+def recount(users, using='default'):
+    """Пересчитывает transfer_count справочников пользователей users по агрегатам"""
+    from django.apps import apps
+
+    for field, model_name in COUNTED_FIELDS.items():
+        model = apps.get_model('main', model_name)
+        model.objects.using(using).filter(user__in=users).update(
+            transfer_count=rollup_count(field.removesuffix('_id')),
+        )
+
+
+def touch(user_ids, using='default'):
+    """Сбрасывает закешированное по переводам пользователей (отчеты, страницы, фрагменты)"""
+    for user_id in user_ids:
+        bump_version(TRANSFERS, user_id, using=using)
+
+
+def rebuild(queryset, users, using='default'):
+    """Пересчитывает агрегаты пользователей users по строкам queryset"""
+    from .models import TransferDailyRollup
+
+    TransferDailyRollup.objects.using(using).filter(user__in=users).delete()
+    # INSERT ... SELECT: группировка и запись целиком на стороне базы
+    sql, params = grouped(queryset.using(using).filter(user__in=users)).query.sql_with_params()
+    table = TransferDailyRollup._meta.db_table
+    columns = ', '.join(KEY_FIELDS)
+    with connections[using].cursor() as cursor:
+        cursor.execute(
+            f"""
+            INSERT INTO {table} ({columns}, summ_total, count)
+            SELECT {columns}, summ_total, count FROM ({sql}) AS grouped
+            """,
+            params,
+        )
+    recount(users, using=using)
+    for user in users:
+        bump_version(TRANSFERS, getattr(user, 'pk', user), using=using)
+
+
+def filtered(user, filters):
+    """
+    Агрегаты пользователя с фильтрами get_transfer_filters или None, если
+    фильтры через агрегаты не выразить: поиска по комментарию в них нет, а
+    дни агрегатов считаются в часовом поясе проекта, и у пользователя границы
+    дней могут быть другими
+    """
+    from .filtering import clean_search, date_range
+
+    start, end = date_range(filters.get('date_from'), filters.get('date_to'), filters.get('period'))
+    if clean_search(filters.get('search')) or ((start or end) and not default_timezone()):
+        return None
+    return in_days(user, filters, start, end)
+
+
+def in_days(user, filters, start, end):
+    """Агрегаты пользователя с фильтрами по справочникам за дни [start, end) пояса проекта"""
+    from .filtering import ID_FIELDS, parse_id
+    from .models import TransferDailyRollup
+
+    rollups = TransferDailyRollup.objects.filter(user=user)
+    for name in ID_FIELDS:
+        if filters.get(name):
+            rollups = rollups.filter(**{f'{name}_id': parse_id(filters[name])})
+    if start:
+        rollups = rollups.filter(day__gte=start)
+    if end:
+        rollups = rollups.filter(day__lt=end)
+    return rollups
+
+
+def default_timezone():
+    """Совпадает ли часовой пояс пользователя с часовым поясом агрегатов"""
+    return timezone.get_current_timezone_name() == timezone.get_default_timezone_name()
+
+
+def whole_days(start, end, tz):
+    """
+    Дни агрегатов (пояс проекта), целиком попадающие в полуоткрытый диапазон
+    дней [start, end) пояса tz: (первый, день после последнего); открытая
+    граница остается None
+    """
+    from .filtering import day_start, next_day
+
+    project = timezone.get_default_timezone()
+    first = last = None
+    if start:
+        moment = day_start(start, tz)
+        first = rollup_day(moment)
+        if day_start(first, project) < moment:
+            # после date.max целых дней нет: first остается None
+            first = next_day(first)
+    if end:
+        last = rollup_day(day_start(end, tz))
+    return first, last
+
+
+def total(user, filters):
+    """
+    Сумма переводов с фильтрами get_transfer_filters в копейках рубля по
+    таблице агрегатов; курс берется на день агрегата. Если границы дней
+    пользователя не совпадают с днями агрегатов, неполные дни по краям
+    диапазона досчитываются по самим переводам
+    """
+    from . import archive
+    from .filtering import clean_search, compile_transfer_filters, date_range, day_start
+
+    rollups = filtered(user, filters)
+    if rollups is not None:
+        return rollups.aggregate(total=converted_sum('summ_total'))['total']
+
+    transfers = archive.transfers(user, filters)
+    tz = timezone.get_current_timezone()
+    start, end = date_range(filters.get('date_from'), filters.get('date_to'), filters.get('period'), tz)
+    first, last = whole_days(start, end, tz)
+    if clean_search(filters.get('search')) or (start and not first) or (first and last and first >= last):
+        transfers = transfers.filter(compile_transfer_filters(filters))
+        return transfers.aggregate(total=converted_sum('summ', day=rate_day()))['total']
+
+    project = timezone.get_default_timezone()
+    edges = []
+    if start and day_start(start, tz) < day_start(first, project):
+        edges.append(Q(date_add__gte=day_start(start, tz), date_add__lt=day_start(first, project)))
+    if end and day_start(last, project) < day_start(end, tz):
+        edges.append(Q(date_add__gte=day_start(last, project), date_add__lt=day_start(end, tz)))
+
+    result = in_days(user, filters, first, last).aggregate(total=converted_sum('summ_total'))['total']
+    if edges:
+        # условия по справочникам те же, а даты задают края
+        references = compile_transfer_filters({**filters, 'date_from': '', 'date_to': '', 'period': ''})
+        transfers = transfers.filter(references & reduce(operator.or_, edges))
+        result += transfers.aggregate(total=converted_sum('summ', day=rate_day()))['total']
+    return result
@@ -1,26 +1,94 @@
+from django.utils import timezone
 from rest_framework import serializers
-from .models import MoneyTransfer, Category, Subcategory
+from .models import MoneyTransfer, Category, Subcategory, Status, OperationType
+
+
+class UserScopedSerializer(serializers.ModelSerializer):
+    """Связанные поля принимают только объекты текущего пользователя"""
+    scoped_fields = ()
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None:
+            return
+        for name in self.scoped_fields:
+            field = self.fields[name]
+            field.queryset = field.queryset.filter(user=request.user)
+
+
+class StatusSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Status
+        fields = ['id', 'name']
+
+
+class OperationTypeSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = OperationType
+        fields = ['id', 'name']
+
 
 class CategorySerializer(serializers.ModelSerializer):
     class Meta:
         model = Category
-        fields = ['id', 'name', 'type']
+        fields = ['id', 'name']
 
-class SubcategorySerializer(serializers.ModelSerializer):
+
+class SubcategorySerializer(UserScopedSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
-    
+    scoped_fields = ('category',)
+
     class Meta:
         model = Subcategory
         fields = ['id', 'name', 'category', 'category_name']
 
-class MoneyTransferSerializer(serializers.ModelSerializer):
+
+class MoneyTransferSerializer(UserScopedSerializer):
     category_name = serializers.CharField(source='category.name', read_only=True)
     subcategory_name = serializers.CharField(source='subcategory.name', read_only=True)
-    
+    scoped_fields = ('status', 'type', 'category', 'subcategory')
+
     class Meta:
         model = MoneyTransfer
         fields = [
-            'id', 'date_add', 'date_operation', 'status', 'type', 
+            'id', 'date_add', 'status', 'type',
             'category', 'category_name', 'subcategory', 'subcategory_name',
-            'amount', 'comment'
-        ]
\ No newline at end of file
+            'summ', 'currency', 'comment'
+        ]
+
+    def validate(self, attrs):
+        category = attrs.get('category', getattr(self.instance, 'category', None))
+        subcategory = attrs.get('subcategory', getattr(self.instance, 'subcategory', None))
+        if category and subcategory and subcategory.category_id != category.pk:
+            raise serializers.ValidationError(
+                {'subcategory': "Подкатегория не принадлежит выбранной категории"}
+            )
+        return attrs
+
+
+# Список переводов отдается без сериализатора: строки берутся из values()
+# и переименовываются в поля MoneyTransferSerializer
+TRANSFER_LIST_FIELDS = {
+    'id': 'id',
+    'date_add': 'date_add',
+    'status': 'status_id',
+    'type': 'type_id',
+    'category': 'category_id',
+    'category_name': 'category__name',
+    'subcategory': 'subcategory_id',
+    'subcategory_name': 'subcategory__name',
+    'summ': 'summ',
+    'currency': 'currency',
+    'comment': 'comment',
+}
+
+
+def transfer_list_rows(rows):
+    result = []
+    for row in rows:
+        item = {name: row[source] for name, source in TRANSFER_LIST_FIELDS.items()}
+        # как DateTimeField сериализатора: в текущем часовом поясе
+        item['date_add'] = timezone.localtime(item['date_add'])
+        result.append(item)
+    return result
@@ -0,0 +1,27 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from . import money
+from .caching import RATES, REFERENCES, bump_version
+from .models import Category, ExchangeRate, OperationType, Status, Subcategory
+
+
+@receiver(post_save, sender=Status)
+@receiver(post_save, sender=OperationType)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=Subcategory)
+@receiver(post_delete, sender=Status)
+@receiver(post_delete, sender=OperationType)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=Subcategory)
+def invalidate_references(sender, instance, **kwargs):
+    bump_version(REFERENCES, instance.user_id)
+
+
+@receiver(post_save, sender=ExchangeRate)
+@receiver(post_delete, sender=ExchangeRate)
+def invalidate_rates(sender, instance, using, **kwargs):
+    # итоги и отчеты в рублях зависят от курсов у всех пользователей
+    bump_version(RATES, None, using=using)
+    transaction.on_commit(money.clear_rates, using=using)
@@ -0,0 +1,112 @@
+// Списки справочников с загрузкой вариантов по требованию (main.lookups).
+// <select data-lookup="url"> получает поле поиска; варианты запрашиваются при
+// первом открытии и при вводе, ответы кешируются на время жизни страницы, а
+// повторные запросы браузер проверяет по ETag.
+// data-lookup-parent - имя поля категории: ее id передается как ?category=.
+// data-lookup-label="full" - подпись "категория - подкатегория".
+(function () {
+    const DELAY = 250;
+    const responses = new Map();
+
+    function load(url) {
+        if (!responses.has(url)) {
+            const request = fetch(url, {credentials: 'same-origin', headers: {Accept: 'application/json'}})
+                .then(function (response) {
+                    if (!response.ok) {
+                        throw new Error(response.status);
+                    }
+                    return response.json();
+                });
+            // ошибка не кешируется: следующая попытка повторит запрос
+            request.catch(function () { responses.delete(url); });
+            responses.set(url, request);
+        }
+        return responses.get(url);
+    }
+
+    function label(select, item) {
+        if (select.dataset.lookupLabel === 'full' && item.category_name) {
+            return item.category_name + ' - ' + item.name;
+        }
+        return item.name;
+    }
+
+    function fill(select, data) {
+        const current = select.value;
+        // пустой и выбранный варианты остаются, остальные заменяются ответом
+        const keep = Array.from(select.options).filter(function (option) {
+            return !option.disabled && (option.value === '' || option.value === current);
+        });
+        select.replaceChildren.apply(select, keep);
+        data.results.forEach(function (item) {
+            if (String(item.id) !== current) {
+                select.add(new Option(label(select, item), item.id));
+            }
+        });
+        if (data.more) {
+            const more = new Option('… уточните поиск', '');
+            more.disabled = true;
+            select.add(more);
+        }
+    }
+
+    function setup(select) {
+        const parent = select.dataset.lookupParent && select.form
+            ? select.form.elements[select.dataset.lookupParent] : null;
+        const input = document.createElement('input');
+        input.type = 'search';
+        input.autocomplete = 'off';
+        input.placeholder = 'Поиск…';
+        input.className = select.classList.contains('form-select') ? 'form-control mb-1' : 'filter-input';
+        select.before(input);
+
+        let shown = null;
+        let timer = null;
+
+        function url() {
+            const params = new URLSearchParams();
+            const term = input.value.trim();
+            if (term) {
+                params.set('q', term);
+            }
+            if (parent && parent.value) {
+                params.set('category', parent.value);
+            }
+            return select.dataset.lookup + '?' + params.toString();
+        }
+
+        function refresh() {
+            const address = url();
+            if (address === shown) {
+                return;
+            }
+            shown = address;
+            load(address).then(function (data) {
+                if (shown === address) {
+                    fill(select, data);
+                }
+            }, function () {
+                shown = null;
+            });
+        }
+
+        input.addEventListener('focus', refresh);
+        input.addEventListener('input', function () {
+            clearTimeout(timer);
+            timer = setTimeout(refresh, DELAY);
+        });
+        select.addEventListener('focus', refresh);
+        select.addEventListener('mousedown', refresh);
+        if (parent) {
+            parent.addEventListener('change', function () {
+                // подкатегория другой категории больше не подходит
+                select.value = '';
+                refresh();
+            });
+        }
+    }
+
+    document.addEventListener('DOMContentLoaded', function () {
+        document.querySelectorAll('select[data-lookup]').forEach(setup);
+    });
+})();
@@ -0,0 +1,26 @@
+from django import template
+
+from .. import money
+from ..rollups import rollup_day
+
+register = template.Library()
+
+
+@register.filter
+def money_format(minor, currency=money.BASE_CURRENCY):
+    """Сумма в минимальных единицах: {{ transfer.summ|money_format:transfer.currency }}"""
+    return money.format_money(minor, currency)
+
+
+@register.filter
+def amount(minor):
+    """Сумма без знака валюты, для таблиц"""
+    return money.format_money(minor, None)
+
+
+@register.filter
+def in_rubles(transfer):
+    """Сумма перевода в рублях по курсу его дня или None для рублей и валют без курса"""
+    if transfer.currency == money.BASE_CURRENCY:
+        return None
+    return money.convert(transfer.summ, transfer.currency, rollup_day(transfer.date_add))
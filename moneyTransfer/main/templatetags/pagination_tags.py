@@ -0,0 +1,11 @@
+from django import template
+
+register = template.Library()
+
+
+@register.filter
+def nearby_pages(page_obj, distance=2):
+    """Номера страниц вокруг текущей, без перебора всего page_range"""
+    first = max(page_obj.number - distance, 1)
+    last = min(page_obj.number + distance, page_obj.paginator.num_pages)
+    return range(first, last + 1)
@@ -0,0 +1,265 @@
+from datetime import date, datetime, timedelta, timezone as dt_timezone
+from io import StringIO
+from unittest import mock, skipUnless
+from zoneinfo import ZoneInfo
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, connections
+from django.db.models import Q
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.utils import timezone
+
+from main import archive, rollups
+from main.filtering import compile_transfer_filters, date_range_q
+from main.management.commands.check_query_plans import NON_SARGABLE
+from main.models import (
+    ArchivedTransfer, Category, MoneyTransfer, OperationType, Status, Subcategory, TransferDailyRollup,
+)
+
+MOSCOW = ZoneInfo('Europe/Moscow')
+NEW_YORK = ZoneInfo('America/New_York')
+VLADIVOSTOK = ZoneInfo('Asia/Vladivostok')
+
+
+def utc(*args):
+    return datetime(*args, tzinfo=dt_timezone.utc)
+
+
+def bounds(q):
+    """Условия Q по именам поиска, включая вложенные"""
+    found = {}
+    for child in q.children:
+        if isinstance(child, Q):
+            found.update(bounds(child))
+        else:
+            found[child[0]] = child[1]
+    return found
+
+
+class DateRangeBoundsTests(SimpleTestCase):
+    """Фильтры по датам - полуоткрытый диапазон date_add по границам дней в поясе пользователя"""
+
+    def assertBounds(self, q, start, end):
+        self.assertEqual(bounds(q), {'date_add__gte': start, 'date_add__lt': end})
+
+    def test_day_in_moscow(self):
+        q = date_range_q('date_add', '2026-03-08', '2026-03-08', tz=MOSCOW)
+        self.assertBounds(q, utc(2026, 3, 7, 21), utc(2026, 3, 8, 21))
+
+    def test_same_day_in_other_timezone(self):
+        q = date_range_q('date_add', '2026-03-08', '2026-03-08', tz=VLADIVOSTOK)
+        self.assertBounds(q, utc(2026, 3, 7, 14), utc(2026, 3, 8, 14))
+
+    def test_dst_start_day_is_23_hours(self):
+        q = date_range_q('date_add', '2026-03-08', '2026-03-08', tz=NEW_YORK)
+        self.assertBounds(q, utc(2026, 3, 8, 5), utc(2026, 3, 9, 4))
+
+    def test_dst_end_day_is_25_hours(self):
+        q = date_range_q('date_add', '2026-11-01', '2026-11-01', tz=NEW_YORK)
+        self.assertBounds(q, utc(2026, 11, 1, 4), utc(2026, 11, 2, 5))
+
+    def test_open_ranges(self):
+        self.assertEqual(bounds(date_range_q('date_add', date_from='2026-03-08', tz=MOSCOW)),
+                         {'date_add__gte': utc(2026, 3, 7, 21)})
+        self.assertEqual(bounds(date_range_q('date_add', date_to='2026-03-08', tz=MOSCOW)),
+                         {'date_add__lt': utc(2026, 3, 8, 21)})
+        self.assertEqual(bounds(date_range_q('date_add', date_from='не дата', tz=MOSCOW)), {})
+
+    def test_last_date_is_open_bound(self):
+        # дня после 9999-12-31 нет: верхняя граница не задается
+        self.assertEqual(bounds(date_range_q('date_add', '2026-03-08', '9999-12-31', tz=MOSCOW)),
+                         {'date_add__gte': utc(2026, 3, 7, 21)})
+        with mock.patch('django.utils.timezone.now', return_value=utc(9999, 12, 31, 12)):
+            for period in ('today', 'this_month', 'this_year'):
+                with self.subTest(period=period):
+                    self.assertNotIn('date_add__lt', bounds(date_range_q('date_add', period=period, tz=MOSCOW)))
+
+    def test_period_uses_user_today(self):
+        # в UTC еще 31 марта, во Владивостоке уже 1 апреля
+        now = utc(2026, 3, 31, 15, 30)
+        with mock.patch('django.utils.timezone.now', return_value=now):
+            self.assertBounds(
+                date_range_q('date_add', period='today', tz=VLADIVOSTOK),
+                utc(2026, 3, 31, 14), utc(2026, 4, 1, 14),
+            )
+            self.assertBounds(
+                date_range_q('date_add', period='today', tz=MOSCOW),
+                utc(2026, 3, 30, 21), utc(2026, 3, 31, 21),
+            )
+
+    def test_period_across_dst(self):
+        with mock.patch('django.utils.timezone.now', return_value=utc(2026, 3, 15, 12)):
+            q = date_range_q('date_add', period='this_month', tz=NEW_YORK)
+        self.assertBounds(q, utc(2026, 3, 1, 5), utc(2026, 4, 1, 4))
+
+    def test_period_intersects_dates(self):
+        with mock.patch('django.utils.timezone.now', return_value=utc(2026, 3, 15, 12)):
+            q = date_range_q('date_add', '2026-02-20', '2026-03-10', 'this_month', tz=MOSCOW)
+        self.assertBounds(q, utc(2026, 2, 28, 21), utc(2026, 3, 10, 21))
+
+    def test_compile_uses_current_timezone(self):
+        filters = {'date_from': '2026-11-01', 'date_to': '2026-11-01', 'category': '5'}
+        with timezone.override(NEW_YORK):
+            q = compile_transfer_filters(filters)
+        found = bounds(q)
+        self.assertEqual(found['date_add__gte'], utc(2026, 11, 1, 4))
+        self.assertEqual(found['date_add__lt'], utc(2026, 11, 2, 5))
+        self.assertEqual(found['category_id'], 5)
+
+    def test_sql_compares_column_with_constants(self):
+        filters = {'date_from': '2026-03-08', 'date_to': '2026-03-08'}
+        for tz in (MOSCOW, NEW_YORK, VLADIVOSTOK):
+            with self.subTest(tz=tz.key):
+                query = MoneyTransfer.objects.filter(compile_transfer_filters(filters, tz)).query
+                sql, params = query.sql_with_params()
+                self.assertIn('"main_moneytransfer"."date_add" >= %s', sql)
+                self.assertIn('"main_moneytransfer"."date_add" < %s', sql)
+                self.assertNotRegex(sql, NON_SARGABLE)
+                start, end = params
+                self.assertEqual(start.astimezone(tz), datetime(2026, 3, 8, tzinfo=tz))
+                self.assertEqual(end.astimezone(tz), datetime(2026, 3, 9, tzinfo=tz))
+
+
+@skipUnless(connection.vendor == 'postgresql', "Планы запросов проверяются только в Postgres")
+class QueryPlanTests(TestCase):
+    """check_query_plans: запросы index с фильтрами используют составные индексы"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('plans', password='plans')
+        statuses = [Status.objects.create(user=cls.user, name=f"Статус {i}") for i in range(3)]
+        types = [OperationType.objects.create(user=cls.user, name=f"Тип {i}") for i in range(3)]
+        subcategories = []
+        for i in range(10):
+            category = Category.objects.create(user=cls.user, name=f"Категория {i}")
+            subcategories += [
+                Subcategory.objects.create(user=cls.user, category=category, name=f"Подкатегория {i}.{j}")
+                for j in range(3)
+            ]
+        now = timezone.now()
+        MoneyTransfer.objects.bulk_create(
+            MoneyTransfer(
+                user=cls.user, date_add=now - timedelta(hours=i), summ=100 * i,
+                status=statuses[i % 3], type=types[i // 3 % 3],
+                category=subcategories[i % 30].category, subcategory=subcategories[i % 30],
+            )
+            for i in range(3000)
+        )
+        # без статистики планировщик не отличает индекс по категории от индекса по дате
+        with connection.cursor() as cursor:
+            cursor.execute(f"ANALYZE {MoneyTransfer._meta.db_table}")
+
+    def test_index_queries_use_indexes(self):
+        # при плане без индекса команда завершается CommandError
+        call_command('check_query_plans', user=self.user.username, stdout=StringIO())
+
+
+@skipUnless(connection.vendor == 'postgresql', "Агрегаты поддерживаются только в Postgres")
+class RollupTotalTests(TestCase):
+    """rollups.total в часовом поясе пользователя совпадает с суммой самих переводов"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user('totals', password='totals')
+        status = Status.objects.create(user=cls.user, name="Статус")
+        kind = OperationType.objects.create(user=cls.user, name="Тип")
+        cls.categories = []
+        subcategories = []
+        for i in range(2):
+            category = Category.objects.create(user=cls.user, name=f"Категория {i}")
+            cls.categories.append(category)
+            subcategories.append(Subcategory.objects.create(user=cls.user, category=category, name=f"Подкатегория {i}"))
+        # переводы каждые 3 часа: в любом поясе есть строки у самых границ дней
+        cls.transfers = MoneyTransfer.objects.bulk_create(
+            MoneyTransfer(
+                user=cls.user, date_add=utc(2026, 3, 1) + timedelta(hours=3 * i, minutes=30), summ=100 + i,
+                status=status, type=kind, category=subcategories[i % 2].category, subcategory=subcategories[i % 2],
+            )
+            for i in range(8 * 20)
+        )
+
+    def expected(self, tz, date_from=None, date_to=None, category=None):
+        return sum(
+            t.summ for t in self.transfers
+            if (not date_from or t.date_add.astimezone(tz).date().isoformat() >= date_from)
+            and (not date_to or t.date_add.astimezone(tz).date().isoformat() <= date_to)
+            and (not category or t.category_id == category.pk)
+        )
+
+    def test_total_in_user_timezone(self):
+        cases = [
+            ('2026-03-03', '2026-03-10', None),
+            ('2026-03-03', '2026-03-03', None),
+            ('2026-03-03', None, None),
+            (None, '2026-03-10', None),
+            ('2026-03-05', '2026-03-12', self.categories[1]),
+            ('2026-03-03', '9999-12-31', None),
+            ('9999-12-31', None, None),
+        ]
+        for tz in (VLADIVOSTOK, NEW_YORK, ZoneInfo('UTC')):
+            for date_from, date_to, category in cases:
+                filters = {'date_from': date_from or '', 'date_to': date_to or '', 'category': category and category.pk}
+                with self.subTest(tz=tz.key, filters=filters), timezone.override(tz):
+                    self.assertEqual(
+                        rollups.total(self.user, filters), self.expected(tz, date_from, date_to, category),
+                    )
+
+    def test_whole_days_come_from_rollups(self):
+        with timezone.override(VLADIVOSTOK):
+            self.assertIsNone(rollups.filtered(self.user, {'date_from': '2026-03-03'}))
+            # 3 марта во Владивостоке - с 14:00 UTC 2 марта; целые дни UTC - с 3 марта
+            start, end = rollups.whole_days(date(2026, 3, 3), date(2026, 3, 11), VLADIVOSTOK)
+        self.assertEqual((start, end), (date(2026, 3, 3), date(2026, 3, 10)))
+
+
+@skipUnless(connection.vendor == 'postgresql', "Архив переносится запросом Postgres")
+class ArchiveBatchTests(TransactionTestCase):
+    """archive_batch переносит старые переводы и пропускает заблокированные другими транзакциями"""
+
+    def setUp(self):
+        self.user = User.objects.create_user('archive', password='archive')
+        category = Category.objects.create(user=self.user, name="Категория")
+        references = {
+            'status': Status.objects.create(user=self.user, name="Статус"),
+            'type': OperationType.objects.create(user=self.user, name="Тип"),
+            'category': category,
+            'subcategory': Subcategory.objects.create(user=self.user, category=category, name="Подкатегория"),
+        }
+        self.before = timezone.now() - timedelta(days=730)
+        self.old = MoneyTransfer.objects.bulk_create(
+            MoneyTransfer(user=self.user, date_add=self.before - timedelta(days=i + 1), summ=100 + i, **references)
+            for i in range(5)
+        )
+        self.new = MoneyTransfer.objects.create(user=self.user, summ=1000, **references)
+
+    def rollup_rows(self):
+        rows = TransferDailyRollup.objects.filter(user=self.user).order_by('day')
+        return list(rows.values_list('day', 'summ_total', 'count'))
+
+    def test_moves_old_transfers(self):
+        rows = self.rollup_rows()
+        self.assertEqual(archive.archive_batch(self.before, [self.user.pk], batch_size=3), 3)
+        self.assertEqual(archive.archive_batch(self.before, [self.user.pk], batch_size=3), 2)
+        self.assertEqual(archive.archive_batch(self.before, [self.user.pk], batch_size=3), 0)
+        self.assertEqual(list(MoneyTransfer.objects.filter(user=self.user).values_list('pk', flat=True)), [self.new.pk])
+        archived = ArchivedTransfer.objects.filter(user=self.user).values_list('pk', flat=True)
+        self.assertCountEqual(archived, [t.pk for t in self.old])
+        # дневные итоги учитывают архив так же, как основную таблицу
+        self.assertEqual(self.rollup_rows(), rows)
+
+    def test_skips_locked_transfers(self):
+        locked = self.old[0]
+        other = connections.create_connection('default')
+        try:
+            other.set_autocommit(False)
+            with other.cursor() as cursor:
+                cursor.execute(f"SELECT id FROM {MoneyTransfer._meta.db_table} WHERE id = %s FOR UPDATE", [locked.pk])
+            self.assertEqual(archive.archive_batch(self.before, [self.user.pk]), 4)
+        finally:
+            other.rollback()
+            other.close()
+        self.assertTrue(MoneyTransfer.objects.filter(pk=locked.pk).exists())
+        # после снятия блокировки перевод переносится следующим запуском
+        self.assertEqual(archive.archive_batch(self.before, [self.user.pk]), 1)
+        self.assertFalse(MoneyTransfer.objects.filter(pk=locked.pk).exists())
@@ -1,14 +1,30 @@
-from django.urls import path
-from . import views
+from django.conf import settings
+from django.urls import include, path
+from rest_framework.routers import DefaultRouter
+
+from . import api, views
+
+router = DefaultRouter()
+router.register('transfers', api.MoneyTransferViewSet, basename='api-transfer')
+router.register('statuses', api.StatusViewSet, basename='api-status')
+router.register('types', api.OperationTypeViewSet, basename='api-type')
+router.register('categories', api.CategoryViewSet, basename='api-category')
+router.register('subcategories', api.SubcategoryViewSet, basename='api-subcategory')
+router.register('reports', api.ReportViewSet, basename='api-report')
 
 urlpatterns = [
     # Главная страница - просмотр переводов
-    path("", views.index, name="index"),
+    path("", views.index_async if settings.SERVER_INTERFACE == 'asgi' else views.index, name="index"),
     
     # Переводы
     path('transfer/add/', views.transfer_add, name='transfer_add'),
+    path('transfer/import/', views.transfer_import, name='transfer_import'),
+    path('transfer/export/', views.transfer_export, name='transfer_export'),
     path('transfer/update/<int:pk>/', views.transfer_update, name='transfer_update'),
     path('transfer/delete/<int:pk>/', views.transfer_delete, name='transfer_delete'),
+
+    # Отчеты
+    path('reports/', views.reports, name='reports'),
     
     # Справочник
     path('reference/', views.reference, name='reference'),
@@ -21,9 +37,16 @@ urlpatterns = [
     path('type/delete/<int:pk>/', views.type_delete, name='type_delete'),
     path('category/edit/<int:pk>/', views.category_edit, name='category_edit'),
     path('category/delete/<int:pk>/', views.category_delete, name='category_delete'),
+    path('reference/<str:kind>/<int:pk>/merge/', views.reference_merge, name='reference_merge'),
 
     path("login/", views.login_user, name="login"),
     path("logout/", views.logout_user, name="logout"),
     path("register/", views.register_user, name="register"),
 
+    # REST API
+    path('api/', include(router.urls)),
+
+    # Метрики для Prometheus
+    path('metrics/', views.metrics, name='metrics'),
+
 ]
\ No newline at end of file
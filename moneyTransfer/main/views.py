@@ -1,13 +1,32 @@
+import hmac
+import io
+import ipaddress
+from urllib.parse import urlencode
+
+from asgiref.sync import sync_to_async
 from django.forms import ValidationError
+from django.http import Http404, HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404, redirect, render
 from django.contrib import messages
 from django.core.paginator import Paginator, EmptyPage, PageNotAnInteger
-from django.db.models import Sum
 from django.contrib.auth import logout, authenticate, login
 from django.contrib.auth.models import User
 from django.contrib.auth.decorators import login_required
+from django.db.models import ProtectedError
+from django.views.decorators.http import require_POST
+from django.conf import settings
 from .models import MoneyTransfer, Category, OperationType, Status, Subcategory
-from .forms import CategoryForm, MoneyTransferForm, StatusForm, SubcategoryForm, TypeForm
+from .forms import (
+    CategoryForm, MoneyTransferForm, ReferenceMergeForm, StatusForm, SubcategoryForm, TransferImportForm, TypeForm,
+)
+from .importer import COLUMNS, TransferImporter
+from .exporters import EXPORT_FORMATS, export_rows
+from .filtering import PERIODS, clean_search, compile_transfer_filters, filters_from_query, parse_id, search_rank
+from .pagination import KeysetPaginator
+from . import archive, merge, metrics as request_metrics, reports as reports_module, rollups
+from .parallel import run_concurrently
+from .caching import ARCHIVE, RATES, REFERENCES, TRANSFERS, get_references
+from .conditional import conditional_page, fragment_version
 
 def login_user(request):
     if request.method == "POST":
@@ -68,106 +87,251 @@ def get_paginated_queryset(request, queryset, prefix='', default_per_page=5):
 
 
 def apply_transfer_filters(queryset, filters):
-    if filters.get('category'):
-        queryset = queryset.filter(category_id=filters['category'])
-    
-    if filters.get('subcategory'):
-        queryset = queryset.filter(subcategory_id=filters['subcategory'])
-    
-    if filters.get('status'):
-        queryset = queryset.filter(status_id=filters['status'])
-    
-    if filters.get('type'):
-        queryset = queryset.filter(type_id=filters['type'])
-    
-    if filters.get('date_from'):
-        queryset = queryset.filter(date_add__date__gte=filters['date_from'])
+    queryset = queryset.filter(compile_transfer_filters(filters))
+
+    field, descending = get_transfer_ordering(filters)
+    prefix = '-' if descending else ''
+    if clean_search(filters.get('search')) and not filters.get('sum_order'):
+        # найденные по поиску - сначала самые релевантные; keyset-пагинация
+        # задает свой порядок и остается по дате
+        queryset = queryset.annotate(rank=search_rank(filters['search']))
+        return queryset.order_by('-rank', f'{prefix}{field}', f'{prefix}id')
+    queryset = queryset.order_by(f'{prefix}{field}', f'{prefix}id')
     
-    if filters.get('date_to'):
-        queryset = queryset.filter(date_add__date__lte=filters['date_to'])
+    return queryset
+
 
+def get_transfer_ordering(filters):
+    # id добавляется вторым ключом, чтобы порядок был однозначным для keyset-пагинации
     sum_order = filters.get('sum_order')
     if sum_order == "asc":
-        queryset = queryset.order_by('summ')
+        return 'summ', False
     elif sum_order == 'desc':
-        queryset = queryset.order_by('-summ')
-    else:
-        queryset = queryset.order_by('-date_add')
-    
-    return queryset
+        return 'summ', True
+    return 'date_add', True
+
+
+def get_keyset_page(request, queryset, filters, per_page):
+    field, descending = get_transfer_ordering(filters)
+    query = request.GET.copy()
+    query.pop('cursor', None)
+    query.pop('page', None)
+    paginator = KeysetPaginator(queryset, per_page, field, descending)
+    return paginator.page(request.GET.get('cursor'), base_query=query.urlencode())
+
+
+def use_keyset_pagination(request):
+    # пустой cursor= - первая страница в режиме курсоров (ссылка «Первая»)
+    return settings.TRANSFERS_PAGINATION == 'keyset' or 'cursor' in request.GET
 
 
 def get_transfer_filters(request):
-    filters = {
-        'category': request.GET.get('category', ''),
-        'subcategory': request.GET.get('subcategory', ''),
-        'status': request.GET.get('status', ''),
-        'type': request.GET.get('type', ''),
-        'date_from': request.GET.get('date_from', ''),
-        'date_to': request.GET.get('date_to', ''),
-        'sum_order': request.GET.get('sum_order', ''),
-    }
-    return filters
+    return filters_from_query(request.GET)
 
-@login_required
-def index(request):
-    transfers = MoneyTransfer.objects.select_related(
+def get_user_transfers(user, filters):
+    # search_vector нужен только в условии поиска; архив - только если его требует период
+    return archive.transfers(user, filters).select_related(
         'category', 
         'subcategory', 
         'type', 
         'status'
-    ).filter(user=request.user)
-    
-    current_filters = get_transfer_filters(request)
-
-    transfers = apply_transfer_filters(transfers, current_filters)
+    ).defer('search_vector')
 
-    total = transfers.aggregate(total=Sum('summ'))['total'] or 0
-    if current_filters is None:
-        transfers = transfers.order_by('-date_add')
-    
+def get_per_page(request):
     per_page = int(request.GET.get('per_page', 10))
     if per_page not in [10, 25, 50, 100]: per_page = 10
-    
-    paginator = Paginator(transfers, per_page)
-    page_number = request.GET.get('page', 1)
-    
-    transfers_page = paginator.page(page_number)
-    
-    categories = Category.objects.filter(user=request.user) 
-    subcategories = Subcategory.objects.filter(user=request.user) 
-    status_choices = Status.objects.filter(user=request.user) 
-    type_choices = OperationType.objects.filter(user=request.user) 
+    return per_page
+
+
+def get_selected_references(references, current_filters):
+    """
+    Выбранные в фильтрах категория и подкатегория: остальные варианты списков
+    загружаются по требованию (main.lookups), в страницу они не выводятся
+    """
+    category_id = parse_id(current_filters.get('category'))
+    subcategory_id = parse_id(current_filters.get('subcategory'))
+    return {
+        'selected_category': next((obj for obj in references.categories if obj.pk == category_id), None),
+        'selected_subcategory': next((obj for obj in references.subcategories if obj.pk == subcategory_id), None),
+    }
 
+
+def get_fragment_context(request, user, current_filters):
+    """
+    Ключи кешированных фрагментов шаблонов ({% cache ... using="fragments" %}):
+    фрагмент перерисовывается, только когда меняются его данные или параметры
+    """
+    return {
+        'fragment_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
+        'references_version': fragment_version(request, user.pk, REFERENCES),
+        'transfers_version': fragment_version(request, user.pk, TRANSFERS, REFERENCES, ARCHIVE, RATES),
+        # параметры фильтров без страницы и сортировки
+        'filters_query': urlencode(sorted(
+            (name, value) for name, value in current_filters.items() if value and name != 'sum_order'
+        )),
+    }
+
+
+def get_index_context(request, user, transfers_page, keyset, references, total, current_filters):
     sum_order_choices = [
         {'value': '', 'display': 'По дате (новые)'},
         {'value': 'asc', 'display': 'По сумме (по возрастанию)'},
         {'value': 'desc', 'display': 'По сумме (по убыванию)'},
     ]
-    context = {
+    return {
         'tab': 'transfers',
         'transfers': transfers_page,
-        'categories': categories,
-        'subcategories': subcategories,
-        'status_choices': status_choices,
-        'type_choices': type_choices,
+        'keyset': keyset,
+        **get_selected_references(references, current_filters),
+        'status_choices': references.statuses,
+        'type_choices': references.types,
         'current_filters': current_filters,
         'total': total,
         'sum_order_choices': sum_order_choices,
+        'period_choices': PERIODS,
+        'export_formats': list(EXPORT_FORMATS),
+        **get_fragment_context(request, user, current_filters),
     }
+
+
+@login_required
+@conditional_page(TRANSFERS, REFERENCES, ARCHIVE, RATES)
+def index(request):
+    current_filters = get_transfer_filters(request)
+
+    transfers = get_user_transfers(request.user, current_filters)
+
+    transfers = apply_transfer_filters(transfers, current_filters)
+
+    total = rollups.total(request.user, current_filters)
+    
+    per_page = get_per_page(request)
+    
+    keyset = use_keyset_pagination(request)
+    if keyset:
+        transfers_page = get_keyset_page(request, transfers, current_filters, per_page)
+    else:
+        paginator = Paginator(transfers, per_page)
+        page_number = request.GET.get('page', 1)
+        
+        transfers_page = paginator.page(page_number)
+    
+    references = get_references(request.user)
+
+    context = get_index_context(request, request.user, transfers_page, keyset, references, total, current_filters)
     
     return render(request, "main/index.html", context)
 
+
+@login_required
+@conditional_page(TRANSFERS, REFERENCES, ARCHIVE, RATES)
+async def index_async(request):
+    """
+    index для ASGI: страница, количество, итог и справочники запрашиваются
+    одновременно, поэтому задержка близка к самому медленному запросу
+    """
+    user = await request.auser()
+    current_filters = get_transfer_filters(request)
+
+    # выбор между таблицей и представлением с архивом может обратиться к базе
+    transfers = await sync_to_async(get_user_transfers)(user, current_filters)
+
+    transfers = apply_transfer_filters(transfers, current_filters)
+
+    per_page = get_per_page(request)
+
+    keyset = use_keyset_pagination(request)
+    if keyset:
+        transfers_page, total, references = await run_concurrently(
+            lambda: get_keyset_page(request, transfers, current_filters, per_page),
+            lambda: rollups.total(user, current_filters),
+            lambda: get_references(user),
+        )
+    else:
+        paginator = Paginator(transfers, per_page)
+        try:
+            page_number = max(int(request.GET.get('page', 1)), 1)
+        except (TypeError, ValueError):
+            page_number = 1
+        bottom = (page_number - 1) * per_page
+        # строки страницы выбираются параллельно с COUNT, номер страницы
+        # проверяется уже после, как в Paginator.page
+        rows, count, total, references = await run_concurrently(
+            lambda: list(transfers[bottom:bottom + per_page]),
+            lambda: transfers.count(),
+            lambda: rollups.total(user, current_filters),
+            lambda: get_references(user),
+        )
+        paginator.count = count
+        transfers_page = paginator.page(page_number)
+        transfers_page.object_list = rows
+
+    context = get_index_context(request, user, transfers_page, keyset, references, total, current_filters)
+
+    return await sync_to_async(render)(request, "main/index.html", context)
+
+@login_required
+def transfer_export(request):
+    fmt = request.GET.get('format', 'csv')
+    if fmt not in EXPORT_FORMATS:
+        raise Http404("Неизвестный формат выгрузки")
+    stream, content_type = EXPORT_FORMATS[fmt]
+    
+    # те же фильтры и порядок, что и в index, но без select_related: нужны только values()
+    filters = get_transfer_filters(request)
+    transfers = apply_transfer_filters(archive.transfers(request.user, filters), filters)
+    
+    response = StreamingHttpResponse(stream(export_rows(transfers)), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="transfers.{fmt}"'
+    # nginx не должен буферизовать ответ целиком
+    response['X-Accel-Buffering'] = 'no'
+    return response
+
+@login_required
+def reports(request):
+    current_filters = get_transfer_filters(request)
+    unit = request.GET.get('unit', reports_module.DEFAULT_UNIT)
+    if unit not in reports_module.UNITS:
+        unit = reports_module.DEFAULT_UNIT
+    dimensions = [name for name in request.GET.getlist('dimension') if name in reports_module.DIMENSIONS]
+    dimensions = dimensions or list(reports_module.DIMENSIONS)
+
+    try:
+        breakdowns = reports_module.build(
+            request.user, current_filters, dimensions, unit, limit=reports_module.PAGE_ROWS,
+        )
+        error = None
+    except reports_module.ReportError as e:
+        breakdowns, error = [], str(e)
+
+    references = get_references(request.user)
+    context = {
+        'tab': 'reports',
+        'breakdowns': breakdowns,
+        'error': error,
+        'unit': unit,
+        'dimensions': dimensions,
+        'unit_choices': reports_module.UNITS,
+        'dimension_choices': reports_module.DIMENSIONS,
+        **get_selected_references(references, current_filters),
+        'status_choices': references.statuses,
+        'type_choices': references.types,
+        'current_filters': current_filters,
+        'period_choices': PERIODS,
+        **get_fragment_context(request, request.user, current_filters),
+    }
+    return render(request, "main/reports.html", context)
+
 @login_required
 def transfer_add(request):
     if request.method == 'POST':
-        form = MoneyTransferForm(request.POST)
+        form = MoneyTransferForm(request.POST, user=request.user)
         
         if form.is_valid():
             try:
                 transfer = form.save(commit=False)
                 transfer.user = request.user
-                transfer.full_clean()
+                transfer.full_clean(exclude=form.cached_fields)
                 transfer.save()
                 return redirect('index')
             except ValidationError as e:
@@ -175,11 +339,7 @@ def transfer_add(request):
                     for msg in messages:
                         form.add_error(field, msg)
     else:
-        form = MoneyTransferForm()
-        form.fields['category'].queryset = Category.objects.filter(user=request.user)
-        form.fields['subcategory'].queryset = Subcategory.objects.filter(user=request.user)
-        form.fields['type'].queryset = OperationType.objects.filter(user=request.user)
-        form.fields['status'].queryset = Status.objects.filter(user=request.user)
+        form = MoneyTransferForm(user=request.user)
     
     context = {
         'form': form,
@@ -188,22 +348,40 @@ def transfer_add(request):
     
     return render(request, 'main/moneytransfer_form.html', context)
 
+@login_required
+def transfer_import(request):
+    report = None
+    if request.method == 'POST':
+        form = TransferImportForm(request.POST, request.FILES)
+        if form.is_valid():
+            # файл читается потоково: большие загрузки Django уже держит во временном файле
+            stream = io.TextIOWrapper(form.cleaned_data['file'].file, encoding='utf-8-sig', newline='')
+            report = TransferImporter(request.user).run(stream, form.cleaned_data['format'])
+    else:
+        form = TransferImportForm()
+    
+    context = {
+        'form': form,
+        'report': report,
+        'errors': report.errors[:100] if report else [],
+        'columns': COLUMNS,
+        'page_title': 'Импорт переводов',
+    }
+    
+    return render(request, 'main/transfer_import.html', context)
+
 @login_required
 def transfer_update(request, pk):
     transfer = get_object_or_404(MoneyTransfer, pk=pk)
     
     if request.method == 'POST':
-        form = MoneyTransferForm(request.POST, instance=transfer)
+        form = MoneyTransferForm(request.POST, instance=transfer, user=request.user)
         
         if form.is_valid():
             form.save()
             return redirect('index')
     else:
-        form = MoneyTransferForm(instance=transfer)
-        form.fields['category'].queryset = Category.objects.filter(user=request.user)
-        form.fields['subcategory'].queryset = Subcategory.objects.filter(user=request.user)
-        form.fields['type'].queryset = OperationType.objects.filter(user=request.user)
-        form.fields['status'].queryset = Status.objects.filter(user=request.user)
+        form = MoneyTransferForm(instance=transfer, user=request.user)
     
     context = {
         'form': form,
@@ -224,6 +402,8 @@ def transfer_delete(request, pk):
     return redirect('index')
 
 @login_required
+# счетчики transfer_count меняются вместе с переводами
+@conditional_page(REFERENCES, TRANSFERS)
 def reference(request):
     categories_queryset = Category.objects.prefetch_related('subcategories').filter(user=request.user) 
     subcategories_queryset = Subcategory.objects.select_related('category').filter(user=request.user) 
@@ -241,11 +421,14 @@ def reference(request):
         'subcategories': subcategories_page,
         'statuses': statuses_page,
         'types': types_page,
+        'fragment_timeout': settings.FRAGMENT_CACHE_TIMEOUT,
+        'references_version': fragment_version(request, request.user.pk, REFERENCES, TRANSFERS),
     }
     
     return render(request, "main/reference.html", context)
 
 @login_required
+@conditional_page(REFERENCES)
 def reference_add(request):
     if request.method == 'POST':
         action = request.POST.get('action')
@@ -272,7 +455,7 @@ def reference_add(request):
                 category.save()
         
         elif action == 'add_subcategory':
-            form = SubcategoryForm(request.POST)
+            form = SubcategoryForm(request.POST, user=request.user)
             if form.is_valid():
                 subcategory = form.save(commit=False)
                 subcategory.user = request.user
@@ -283,14 +466,11 @@ def reference_add(request):
     status_form = StatusForm()
     type_form = TypeForm()
     category_form = CategoryForm()
-    subcategory_form = SubcategoryForm()
-
-    subcategory_form.fields['category'].queryset = Category.objects.filter(user=request.user)
+    subcategory_form = SubcategoryForm(user=request.user)
 
-    status_list = Status.objects.filter(user=request.user).order_by('name')
-    type_list = OperationType.objects.filter(user=request.user).order_by('name')
-    categories = Category.objects.filter(user=request.user) 
-    subcategories = Subcategory.objects.filter(user=request.user) 
+    references = get_references(request.user)
+    status_list = sorted(references.statuses, key=lambda obj: obj.name)
+    type_list = sorted(references.types, key=lambda obj: obj.name)
     
     context = {
         'status_form': status_form,
@@ -299,10 +479,10 @@ def reference_add(request):
         'subcategory_form': subcategory_form,
         'status_list': status_list,
         'type_list': type_list,
-        'status_count': status_list.count(),
-        'type_count': type_list.count(),
-        'category_count': categories.count(),
-        'subcategory_count': subcategories.count(),
+        'status_count': len(status_list),
+        'type_count': len(type_list),
+        'category_count': len(references.categories),
+        'subcategory_count': len(references.subcategories),
         'page_title': 'Справочник',
     }
     
@@ -332,14 +512,10 @@ def status_edit(request, pk):
     return render(request, 'main/reference_edit.html', context)
 
 @login_required
+@require_POST
 def status_delete(request, pk):
-    status = get_object_or_404(Status, pk=pk)
-    
-    if request.method == 'GET':
-        status.delete()
-    
-    referer = request.META.get('HTTP_REFERER', 'reference')
-    return redirect(referer)
+    status = get_object_or_404(Status, pk=pk, user=request.user)
+    return delete_reference(request, status, 'status')
 
 @login_required
 def type_edit(request, pk):
@@ -365,14 +541,10 @@ def type_edit(request, pk):
     return render(request, 'main/reference_edit.html', context)
 
 @login_required
+@require_POST
 def type_delete(request, pk):
-    type_obj = get_object_or_404(OperationType, pk=pk)
-    
-    if request.method == 'POST':
-        type_obj.delete()
-    
-    referer = request.META.get('HTTP_REFERER', 'reference')
-    return redirect(referer)
+    type_obj = get_object_or_404(OperationType, pk=pk, user=request.user)
+    return delete_reference(request, type_obj, 'type')
 
 @login_required
 def category_edit(request, pk):
@@ -392,16 +564,15 @@ def category_edit(request, pk):
         else:
             return redirect('reference')
     
+    form_kwargs = {'user': request.user} if form_class == SubcategoryForm else {}
     if request.method == 'POST':
-        form = form_class(request.POST, instance=obj)
+        form = form_class(request.POST, instance=obj, **form_kwargs)
         
         if form.is_valid():
             form.save()
             return redirect('reference')
     else:
-        form = form_class(instance=obj)
-        if form_class == SubcategoryForm:
-            form.fields['category'].queryset = Category.objects.filter(user=request.user)
+        form = form_class(instance=obj, **form_kwargs)
     
     context = {
         'form': form,
@@ -413,16 +584,80 @@ def category_edit(request, pk):
     return render(request, 'main/category_form.html', context)
 
 @login_required
+@require_POST
 def category_delete(request, pk):
-    obj = Category.objects.filter(pk=pk).first()
+    obj = Category.objects.filter(pk=pk, user=request.user).first()
     
     if not obj:
-        obj = Subcategory.objects.filter(pk=pk).first()
+        obj = Subcategory.objects.filter(pk=pk, user=request.user).first()
     
     if not obj:
         return redirect('reference')
     
-    obj.delete()
+    kind = 'category' if isinstance(obj, Category) else 'subcategory'
+    return delete_reference(request, obj, kind)
+
+
+def delete_reference(request, obj, kind):
+    """Удаляет неиспользуемый элемент справочника, используемый - предлагает объединить"""
+    if obj.transfer_count:
+        return redirect('reference_merge', kind=kind, pk=obj.pk)
+    try:
+        obj.delete()
+    except ProtectedError:
+        # перевод мог появиться уже после чтения transfer_count
+        return redirect('reference_merge', kind=kind, pk=obj.pk)
     
     referer = request.META.get('HTTP_REFERER', 'reference')
     return redirect(referer)
+
+
+@login_required
+def reference_merge(request, kind, pk):
+    model = merge.MODELS.get(kind)
+    if model is None:
+        raise Http404
+    source = get_object_or_404(model, pk=pk, user=request.user)
+    
+    if request.method == 'POST':
+        form = ReferenceMergeForm(request.POST, source=source, kind=kind, user=request.user)
+        if form.is_valid():
+            try:
+                merge.merge(source, form.cleaned_data['target'])
+            except merge.MergeError as e:
+                form.add_error(None, str(e))
+            else:
+                return redirect('reference')
+    else:
+        form = ReferenceMergeForm(source=source, kind=kind, user=request.user)
+    
+    context = {
+        'form': form,
+        'object': source,
+        'kind': kind,
+        'page_title': f'Объединение: {source}',
+    }
+    
+    return render(request, 'main/reference_merge.html', context)
+
+
+def metrics_allowed(request):
+    if settings.METRICS_TOKEN:
+        authorization = request.META.get('HTTP_AUTHORIZATION', '')
+        if hmac.compare_digest(authorization.encode(), f'Bearer {settings.METRICS_TOKEN}'.encode()):
+            return True
+    try:
+        address = ipaddress.ip_address(request.META.get('REMOTE_ADDR', ''))
+    except ValueError:
+        return False
+    return any(address in ipaddress.ip_network(network) for network in settings.METRICS_ALLOWED_NETWORKS)
+
+
+def metrics(request):
+    """Метрики всех воркеров в текстовом формате Prometheus"""
+    if not metrics_allowed(request):
+        raise Http404
+    return HttpResponse(
+        request_metrics.render(request_metrics.collect()),
+        content_type='text/plain; version=0.0.4; charset=utf-8',
+    )
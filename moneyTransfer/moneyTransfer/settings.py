@@ -22,10 +22,21 @@ BASE_DIR = Path(__file__).resolve().parent.parent
 # SECURITY WARNING: keep the secret key used in production secret!
 SECRET_KEY = 'django-insecure--3)1o^w=)&6y@4%-w5^xujt&*ma%e45#fq(^zd75b0xz_n#vz5'
 
-# SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = os.getenv('DEBUG', 'True').lower() == 'true'
+# development - runserver, production - gunicorn (см. entrypoint.sh и gunicorn.conf.py)
+SERVER_MODE = os.getenv('SERVER_MODE', 'development')
+PRODUCTION = SERVER_MODE == 'production'
 
-ALLOWED_HOSTS = []
+# SECURITY WARNING: don't run with debug turned on in production!
+# в production отладка выключена, если DEBUG не задан явно
+DEBUG = os.getenv('DEBUG', str(not PRODUCTION)).lower() == 'true'
+# wsgi или asgi; под ASGI главная страница выполняет запросы параллельно (views.index_async)
+SERVER_INTERFACE = os.getenv('SERVER_INTERFACE', 'wsgi')
+# Потоки для параллельных запросов index_async (main.parallel); у каждого потока
+# свое постоянное соединение, поэтому это и число таких соединений на процесс
+ASYNC_DB_THREADS = int(os.getenv('ASYNC_DB_THREADS', 4))
+ASYNC_DB_CONN_MAX_AGE = int(os.getenv('ASYNC_DB_CONN_MAX_AGE', 600))
+
+ALLOWED_HOSTS = [host.strip() for host in os.getenv('ALLOWED_HOSTS', '').split(',') if host.strip()]
 INTERNAL_IPS = [
     '127.0.0.1',
 ]
@@ -39,43 +50,68 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     'rest_framework',
+    'django_filters',
     'main.apps.MainConfig',
-    'debug_toolbar',
 ]
 
 REST_FRAMEWORK = {
     'DEFAULT_FILTER_BACKENDS': [
         'django_filters.rest_framework.DjangoFilterBackend'
     ],
+    'DEFAULT_PERMISSION_CLASSES': [
+        'rest_framework.permissions.IsAuthenticated',
+    ],
+    # браузерный интерфейс API заметно дороже JSON, поэтому только для отладки
+    'DEFAULT_RENDERER_CLASSES': [
+        'rest_framework.renderers.JSONRenderer',
+    ] + (['rest_framework.renderers.BrowsableAPIRenderer'] if DEBUG else []),
 }
 
 MIDDLEWARE = [
+    # первым, чтобы время ответа включало остальные middleware
+    'main.middleware.request_metrics_middleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'main.middleware.user_timezone_middleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    "debug_toolbar.middleware.DebugToolbarMiddleware",
 ]
 
+# debug_toolbar собирает SQL и шаблоны каждого запроса - только для отладки,
+# в production время запросов видно на /metrics/
+if DEBUG:
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'moneyTransfer.urls'
 
+TEMPLATE_LOADERS = [
+    'django.template.loaders.filesystem.Loader',
+    'django.template.loaders.app_directories.Loader',
+]
+
 TEMPLATES = [
     {
         'BACKEND': 'django.template.backends.django.DjangoTemplates',
         'DIRS': [
             BASE_DIR / 'templates',
         ],
-        'APP_DIRS': True,
         'OPTIONS': {
             'context_processors': [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
             ],
+            # в production скомпилированные шаблоны хранятся в памяти процесса,
+            # при отладке изменения шаблонов видны без перезапуска
+            'loaders': TEMPLATE_LOADERS if DEBUG else [
+                ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+            ],
         },
     },
 ]
@@ -94,10 +130,88 @@ DATABASES = {
         "PASSWORD": os.getenv('DB_PASSWORD', '0000'),
         "HOST": os.getenv('DB_HOST', 'localhost'),
         "PORT": os.getenv('DB_PORT', '5432'),
+        # Постоянные соединения: воркер gunicorn держит соединение между запросами,
+        # а перед повторным использованием проверяет, что оно живо.
+        # Под ASGI потоки запросов не переиспользуются, поэтому соединения не сохраняются;
+        # параллельные запросы index_async идут через постоянные соединения main.parallel
+        "CONN_MAX_AGE": int(os.getenv('DB_CONN_MAX_AGE', 600 if PRODUCTION and SERVER_INTERFACE == 'wsgi' else 0)),
+        "CONN_HEALTH_CHECKS": True,
+        "OPTIONS": {
+            "connect_timeout": int(os.getenv('DB_CONNECT_TIMEOUT', 5)),
+        },
     }
 }
 
 
+# Cache
+# По умолчанию - память процесса. Воркеры gunicorn не видят память друг друга,
+# поэтому в production по умолчанию используется файловый кеш, общий для всех
+# воркеров контейнера. Для нескольких контейнеров нужен внешний кеш
+# (например, CACHE_BACKEND=django.core.cache.backends.redis.RedisCache и CACHE_LOCATION)
+
+if PRODUCTION:
+    DEFAULT_CACHE_BACKEND = 'django.core.cache.backends.filebased.FileBasedCache'
+    DEFAULT_CACHE_LOCATION = '/tmp/moneytransfer-cache'
+else:
+    DEFAULT_CACHE_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+    DEFAULT_CACHE_LOCATION = 'moneytransfer'
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', DEFAULT_CACHE_BACKEND),
+        'LOCATION': os.getenv('CACHE_LOCATION', DEFAULT_CACHE_LOCATION),
+    },
+    # Фрагменты шаблонов ({% cache ... using="fragments" %}) - в памяти процесса:
+    # их ключи включают версии данных из 'default', поэтому воркерам не нужен
+    # общий кеш, а MAX_ENTRIES ограничивает память (вытесняются давно не читанные)
+    'fragments': {
+        'BACKEND': os.getenv('FRAGMENT_CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('FRAGMENT_CACHE_LOCATION', 'moneytransfer-fragments'),
+        'OPTIONS': {
+            'MAX_ENTRIES': int(os.getenv('FRAGMENT_CACHE_MAX_ENTRIES', 2000)),
+        },
+    },
+}
+
+# Время жизни закешированных справочников пользователя, секунды
+REFERENCE_CACHE_TIMEOUT = int(os.getenv('REFERENCE_CACHE_TIMEOUT', 300))
+
+# Время жизни фрагментов шаблонов, секунды; изменения данных сбрасывают их сразу
+FRAGMENT_CACHE_TIMEOUT = int(os.getenv('FRAGMENT_CACHE_TIMEOUT', 600))
+
+# Время жизни закешированных отчетов, секунды; изменения переводов
+# сбрасывают кеш отчетов пользователя сразу
+REPORT_CACHE_TIMEOUT = int(os.getenv('REPORT_CACHE_TIMEOUT', 3600))
+
+# Сколько секунд процесс держит в памяти курсы валют (main.money.rate);
+# изменение курсов через приложение сбрасывает их сразу
+RATE_CACHE_TIMEOUT = int(os.getenv('RATE_CACHE_TIMEOUT', 300))
+
+# Сколько секунд действие админки переназначает переводы в рамках запроса;
+# остальное продолжается из раздела "Массовые переназначения" или командой reassign_transfers
+REASSIGN_TIME_LIMIT = float(os.getenv('REASSIGN_TIME_LIMIT', 10))
+# Задание из админки хранит id выбранных переводов; большие выборки - через команду reassign_transfers
+REASSIGN_MAX_IDS = int(os.getenv('REASSIGN_MAX_IDS', 100000))
+
+
+# Metrics
+# Каталог, через который воркеры gunicorn складывают метрики для /metrics/;
+# пусто - только метрики текущего процесса (runserver)
+METRICS_DIR = os.getenv('METRICS_DIR', '/tmp/moneytransfer-metrics' if PRODUCTION else '')
+# как часто воркер записывает свои метрики в файл, секунды
+METRICS_FLUSH_INTERVAL = float(os.getenv('METRICS_FLUSH_INTERVAL', 5))
+# сети, из которых /metrics/ доступен без токена; через nginx адрес закрыт.
+# Запросы на проброшенный порт docker приходят с адреса шлюза сети, поэтому
+# по умолчанию - только loopback, а Prometheus в сети docker передает токен
+METRICS_ALLOWED_NETWORKS = [
+    network.strip()
+    for network in os.getenv('METRICS_ALLOWED_NETWORKS', '127.0.0.0/8,::1/128').split(',')
+    if network.strip()
+]
+# с заголовком "Authorization: Bearer <METRICS_TOKEN>" /metrics/ доступен из любой сети
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -130,11 +244,37 @@ USE_TZ = True
 
 LOGIN_URL = "/login/"
 
+# Секционирование таблицы переводов по месяцам (миграция 0008, команда manage_partitions)
+TRANSFERS_PARTITIONING = os.getenv('TRANSFERS_PARTITIONING', 'False').lower() == 'true'
+
+# Переводы старше стольких дней команда archive_transfers переносит в архив
+TRANSFERS_ARCHIVE_AFTER_DAYS = int(os.getenv('TRANSFERS_ARCHIVE_AFTER_DAYS', 730))
+
+# Режим пагинации списка переводов: 'page' (номера страниц) или 'keyset' (курсоры)
+TRANSFERS_PAGINATION = os.getenv('TRANSFERS_PAGINATION', 'page')
+
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/5.2/howto/static-files/
 
 STATIC_URL = 'static/'
 
+# Куда collectstatic собирает файлы; в docker - том, который nginx отдает по /static/
+STATIC_ROOT = os.getenv('STATIC_ROOT', BASE_DIR.parent / 'static')
+
+STORAGES = {
+    'default': {
+        'BACKEND': 'django.core.files.storage.FileSystemStorage',
+    },
+    # без DEBUG имена файлов содержат хеш содержимого (main.css -> main.3f2a1c.css),
+    # поэтому nginx отдает их с кешированием навсегда; манифест создает collectstatic
+    'staticfiles': {
+        'BACKEND': (
+            'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG
+            else 'django.contrib.staticfiles.storage.ManifestStaticFilesStorage'
+        ),
+    },
+}
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 